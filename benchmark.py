@@ -0,0 +1,205 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import matplotlib
+matplotlib.use("Agg")  # bez otwierania okien - plt.show() nic nie robi
+
+import rsa
+
+from utils.display_functions import *
+from utils import RSA, rsa_lib_wrapper, rsa_wrapper
+
+
+## domyślna konfiguracja benchmarku ##
+default_durations = [1, 10, 60]     # długości wygenerowanych plików [s], np. 3600 dla godzinnych
+default_key_bit_lengths = [512, 1024]
+default_rsa_payload_len = 16 * 1024  # liczba bajtów danych szyfrowanych przez RSA
+default_repeat = 3
+###################################
+
+
+def parse_file(path: str):
+    session = WavSession.open(path)
+    return session.riff, session.fmt, session.data, session.raw_data
+
+
+def generate_file(path: str, duration: float, sample_rate: int = 44100, num_channels: int = 2,
+                  bits_per_sample: int = 16) -> None:
+    # sinus 440 Hz zapisywany blokami, żeby godzinne pliki nie trafiały w całości do pamięci
+    sample_len = bits_per_sample // 8
+    block_align = sample_len * num_channels
+    frames = int(duration * sample_rate)
+    data_size = frames * block_align
+    with open(path, "wb") as file:
+        writer = ChunkWriter(file)
+        RIFFHeader("RIFF", 36 + data_size, ["WAVE"]).write(writer)
+        FmtChunk("fmt ", 16, [1, num_channels, sample_rate, sample_rate * block_align, block_align,
+                              bits_per_sample]).write(writer)
+        writer.begin_chunk("data", data_size)
+        amplitude = 2 ** (bits_per_sample - 1) - 1
+        block_frames = sample_rate * 10
+        for start in range(0, frames, block_frames):
+            t = np.arange(start, min(start + block_frames, frames)) / sample_rate
+            block = (np.sin(2 * np.pi * 440 * t) * amplitude * 0.8).astype("<i%d" % sample_len)
+            writer.write(np.repeat(block[:, None], num_channels, axis=1).tobytes())
+        writer.close()
+
+
+def measure(function, repeat: int, data_len: int = 0, sample_count: int = 0) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    # osobny przebieg ze śledzeniem pamięci, żeby tracemalloc nie zawyżał czasów
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = min(times)
+    result = {
+        "seconds_min": best,
+        "seconds_mean": sum(times) / len(times),
+        "peak_memory_bytes": peak_memory,
+    }
+    if data_len:
+        result["bytes"] = data_len
+        result["mb_per_s"] = data_len / best / 1e6 if best > 0 else None
+    if sample_count:
+        result["samples"] = sample_count
+        result["samples_per_s"] = sample_count / best if best > 0 else None
+    return result
+
+
+def benchmark_file(path: str, repeat: int, skip_display: bool) -> dict:
+    riff_chunk, fmt_chunk, data_chunk, raw_data = parse_file(path)
+    sample_count = len(data_chunk.data.samples) * len(data_chunk.data.samples[0])
+    results = {
+        "file_size": os.path.getsize(path),
+        "audio_format": fmt_chunk.data.audio_format,
+        "num_channels": fmt_chunk.data.num_channels,
+        "bits_per_sample": fmt_chunk.data.bits_per_sample,
+        "sample_rate": fmt_chunk.data.sample_rate,
+        "operations": {},
+    }
+    operations = results["operations"]
+
+    operations["parse_chunks"] = measure(lambda: parse_file(path), repeat, os.path.getsize(path), sample_count)
+    operations["bytes_to_channels"] = measure(
+        lambda: DataChunk.Contents.bytes_to_channels(fmt_chunk, raw_data, len(raw_data)),
+        repeat, len(raw_data), sample_count)
+    try:
+        operations["channels_to_bytes"] = measure(
+            lambda: DataChunk.Contents.channels_to_bytes(fmt_chunk, data_chunk.data),
+            repeat, len(raw_data), sample_count)
+    except Exception as e:
+        operations["channels_to_bytes"] = {"error": repr(e)}
+
+    if not skip_display:
+        frame_count = len(data_chunk.data.samples[0])
+        for display in (display_waveform, display_amplitude_spectrum, display_phase_spectrum, display_spectrogram):
+            try:
+                operations[display.__name__] = measure(lambda: display(data_chunk, fmt_chunk, None, None), repeat,
+                                                       len(raw_data), sample_count)
+            except Exception as e:
+                operations[display.__name__] = {"error": repr(e), "frames": frame_count}
+            plt.close("all")
+    return results
+
+
+def benchmark_rsa(payload: bytes, key_bit_lengths: list, repeat: int) -> dict:
+    results = {}
+    for bit_length in key_bit_lengths:
+        entry = {}
+        rsa_data = rsa_wrapper.new_keys(bit_length)
+        encrypted, leftover = rsa_wrapper.encrypt_ecb(payload, rsa_data)
+        entry["rsa_wrapper.encrypt_ecb"] = measure(lambda: rsa_wrapper.encrypt_ecb(payload, rsa_data), repeat,
+                                                   len(payload))
+        entry["rsa_wrapper.decrypt_ecb"] = measure(lambda: rsa_wrapper.decrypt_ecb(encrypted, rsa_data, leftover),
+                                                   repeat, len(payload))
+        encrypted, init_vector, leftover = rsa_wrapper.encrypt_cbc(payload, rsa_data)
+        entry["rsa_wrapper.encrypt_cbc"] = measure(lambda: rsa_wrapper.encrypt_cbc(payload, rsa_data), repeat,
+                                                   len(payload))
+        entry["rsa_wrapper.decrypt_cbc"] = measure(
+            lambda: rsa_wrapper.decrypt_cbc(encrypted, rsa_data, init_vector, leftover), repeat, len(payload))
+
+        public_key, private_key = rsa.newkeys(bit_length)
+        encrypted = rsa_lib_wrapper.encrypt_ecb(payload, public_key)
+        entry["rsa_lib_wrapper.encrypt_ecb"] = measure(lambda: rsa_lib_wrapper.encrypt_ecb(payload, public_key),
+                                                       repeat, len(payload))
+        entry["rsa_lib_wrapper.decrypt_ecb"] = measure(lambda: rsa_lib_wrapper.decrypt_ecb(encrypted, private_key),
+                                                       repeat, len(payload))
+        encrypted, init_vector = rsa_lib_wrapper.encrypt_cbc(payload, public_key)
+        entry["rsa_lib_wrapper.encrypt_cbc"] = measure(lambda: rsa_lib_wrapper.encrypt_cbc(payload, public_key),
+                                                       repeat, len(payload))
+        entry["rsa_lib_wrapper.decrypt_cbc"] = measure(
+            lambda: rsa_lib_wrapper.decrypt_cbc(encrypted, private_key, init_vector), repeat, len(payload))
+
+        entry["RSA.choose_prime_numbers"] = measure(lambda: RSA.choose_prime_numbers(bit_length // 2), repeat)
+        entry["RSA.choose_prime_numbers(e=65537)"] = measure(
+            lambda: RSA.choose_prime_numbers(bit_length // 2, RSA.DEFAULT_PUBLIC_EXPONENT), repeat)
+        results[str(bit_length)] = entry
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pomiar wydajności wczytywania, wyświetlania i szyfrowania plików WAV")
+    parser.add_argument("--data-dir", default="data", help="katalog z plikami testowymi")
+    parser.add_argument("--durations", type=float, nargs="*", default=default_durations,
+                        help="długości generowanych plików w sekundach")
+    parser.add_argument("--key-bits", type=int, nargs="*", default=default_key_bit_lengths,
+                        help="długości kluczy RSA w bitach")
+    parser.add_argument("--rsa-payload", type=int, default=default_rsa_payload_len,
+                        help="liczba bajtów szyfrowanych w pomiarach RSA")
+    parser.add_argument("--repeat", type=int, default=default_repeat)
+    parser.add_argument("--skip-display", action="store_true", help="pomiń pomiary funkcji wyświetlających")
+    parser.add_argument("--output", default=None, help="plik wynikowy JSON (domyślnie standardowe wyjście)")
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter("ignore")
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "files": {},
+        "generated": {},
+        "rsa": {},
+    }
+
+    for path in sorted(glob.glob(os.path.join(args.data_dir, "*.wav"))):
+        try:
+            report["files"][os.path.basename(path)] = benchmark_file(path, args.repeat, args.skip_display)
+        except Exception as e:
+            report["files"][os.path.basename(path)] = {"error": repr(e)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for duration in args.durations:
+            path = os.path.join(directory, f"generated-{duration:g}s.wav")
+            generate_file(path, duration)
+            report["generated"][f"{duration:g}s"] = benchmark_file(path, args.repeat, args.skip_display)
+            os.remove(path)
+
+    first_file = sorted(glob.glob(os.path.join(args.data_dir, "*.wav")))
+    payload = parse_file(first_file[0])[3][:args.rsa_payload] if first_file else os.urandom(args.rsa_payload)
+    report["rsa"] = benchmark_rsa(payload, args.key_bits, args.repeat)
+
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
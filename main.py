@@ -1,6 +1,10 @@
+import io
+import os
 import rsa
 from utils.display_functions import *
-from utils import rsa_lib_wrapper, encryption_utils, rsa_wrapper
+from utils import rsa_lib_wrapper, encryption_utils, rsa_wrapper, instrumentation, encrypted_data, compression, \
+    pipeline, metadata_editor, overview, render, spectrogram_tiles, result_cache
+from utils.instrumentation import span
 
 
 ## konfiguracja wykonania skryptu ##
@@ -11,105 +15,84 @@ use_library_rsa = True
 use_cbc = False
 generate_new_keys = True
 new_key_bit_len = 1024
+compress_before_encryption = None   # None, "zlib" albo "lzma" - mniej bloków do zaszyfrowania
+use_pipeline = False                # szyfrowanie ECB w potoku: czytanie / pula procesów / zapis
+pipeline_workers = None             # domyślnie liczba rdzeni
+pipeline_queue_depth = None         # domyślnie 2 * pipeline_workers
+pass_through_unmodified = True      # niezmienione chunki kopiowane z pliku źródłowego bez dekodowania
+edit_metadata_in_place = False      # bez szyfrowania: LIST/id3 zmieniane w pliku wejściowym zamiast zapisu nowego
+use_waveform_overview = True        # długie fragmenty przebiegu rysowane z podglądu min/max zapisanego obok pliku
+use_spectrogram_tiles = True        # spektrogram długich fragmentów składany z kafelków piramidy STFT
+spectrogram_tiles_dir = None        # np. "spectrogram_tiles" - kafelki zapisywane także na dysku
+render_output_dir = None            # np. "previews" - wykresy zapisywane do plików zamiast wyświetlania (bez input())
+render_formats = ("png",)           # "png" i/lub "svg"
+render_range = (None, None)         # zakres ramek rysowany w trybie zapisu do plików, None - całość
+render_size = render.default_size   # rozmiar obrazów w pikselach
+result_cache_dir = None             # np. "result_cache" - plik wynikowy kopiowany z pamięci podręcznej, jeśli te same
+                                    # dane były już szyfrowane tym samym kluczem i z tymi samymi ustawieniami
+result_cache_max_bytes = 1 << 30
+profile_execution = False           # albo zmienna środowiskowa WAV_READER_PROFILE=1
+profile_report_file_name = "profile_report.json"
+cprofile_file_name = None           # np. "profile.prof" - zrzut cProfile
 ###################################
-encryption_data_file_name = "encryption_data.yaml"
+encryption_data_file_name = "encryption_data.yaml"  # rozszerzenie inne niż .yaml/.yml - zapis binarny
 save_file_name = "piano_encrypted.wav"
 f = open(file="data/gos_copy2.wav", mode="rb")
 ###################################
 
+if profile_execution:
+    instrumentation.enable(profile_report_file_name, cprofile_file_name)
+else:
+    instrumentation.enable_from_environment()
 
-size = 0
-sample_len = 0
 
-while 1:
-    id = bytes.decode(f.read(4))
-    if len(id):
-        size = int.from_bytes(f.read(4), byteorder="little")
-    else:
-        break
-    data = []
-    if id == "RIFF":
-        data = [bytes.decode(f.read(4))]
-        riffChunk = RIFFHeader(id, size, data)
-    elif id == "fmt ":
-        data = [int.from_bytes(f.read(2), byteorder="little"), int.from_bytes(f.read(2), byteorder="little"),
-                int.from_bytes(f.read(4), byteorder="little"), int.from_bytes(f.read(4), byteorder="little"),
-                int.from_bytes(f.read(2), byteorder="little"), int.from_bytes(f.read(2), byteorder="little")]
-        if size > 16:
-            data.append(int.from_bytes(f.read(2), byteorder="little"))
-            data.append(int.from_bytes(f.read(data[6]), byteorder="little"))
-        fmtChunk = FmtChunk(id, size, data)
-    elif id == "LIST":
-        data = [f.read(size)]
-        listChunk = LISTChunk(id, size, data[0])
-        Optional.update({index: listChunk.id})
-        index += 1
-    elif id == "id3 ":
-        data = [f.read(size)]
-        id3Chunk = id3Chunk(id, size, data[0])
-        Optional.update({index: id3Chunk.id})
-        index += 1
-    elif id == "fact":
-        data = [f.read(size)]
-        factChunk = factChunk(id, size, data)
-        Optional.update({index: factChunk.id})
-        index += 1
-    elif id == "cue ":
-        data = [f.read(size)]
-        cueChunk = CueChunk(id, size, data)
-        Optional.update({index: cueChunk.id})
-        index += 1
-    elif id == "data":
-        data = f.read(size)
-        raw_data = data
-        if decrypt_file_contents_on_read:
-            encryption_data = encryption_utils.read_rsa_data_from_file(encryption_data_file_name)
-            try:
-                if encryption_data.block_leftover_len is None: # to pole jest puste jesli wykorzystano szyfrowanie z biblioteki
-                    if encryption_data.init_vector is None:
-                        data = rsa_lib_wrapper.decrypt_ecb(data, private_key=rsa.PrivateKey(*encryption_data))
-                    else:
-                        data = rsa_lib_wrapper.decrypt_cbc(data, private_key=rsa.PrivateKey(*encryption_data),
-                                                           init_vector=encryption_data.init_vector)
-                    raw_data = data
-                    data = DataChunk.Contents.bytes_to_channels(fmtChunk, data, len(data))
-                    print("Pomyślnie odszyfrowano dane wewnątrz pliku.")
-                else:
-                    encryption_data = encryption_utils.read_rsa_data_from_file(encryption_data_file_name)
-                    if encryption_data.init_vector is None:
-                        data = rsa_wrapper.decrypt_ecb(data, encryption_data,
-                                                       block_leftover_len=encryption_data.block_leftover_len)
-                    else:
-                        data = rsa_wrapper.decrypt_cbc(data, encryption_data,
-                                                       init_vector=encryption_data.init_vector,
-                                                       block_leftover_len=encryption_data.block_leftover_len)
-                    raw_data = data
-                    data = DataChunk.Contents.bytes_to_channels(fmtChunk, data, len(data))
-                    print("Pomyślnie odszyfrowano dane wewnątrz pliku.")
-            except Exception:
-                print("Odszyfrowanie nie powiodło się. Wczytano dane w wersji niezmodyfikowanej.")
-                data = DataChunk.Contents.bytes_to_channels(fmtChunk, data, size)
-        else:
-            data = DataChunk.Contents.bytes_to_channels(fmtChunk, data, size)
-        dataChunk = DataChunk(id, len(data[0]), data)
-    else:
-        data = f.read(size)
-        unrecognizedChunk.append(Chunk(id, size, data))
+# próbki są potrzebne tylko do wyświetlania i szyfrowania - w pozostałych przypadkach dane zostają w pliku
+samples_needed = not skip_display or decrypt_file_contents_on_read or encrypt_file_contents_on_save or \
+                 not pass_through_unmodified
+session = WavSession()
+with span("read") as read_record:
+    session.read(f, decode_samples=not decrypt_file_contents_on_read, load_data=samples_needed)
+    read_record.bytes = f.tell()
 
 f.close()
 
-if "listChunk" not in locals():
-    listChunk = None
-if "factChunk" not in locals():
-    factChunk = None
-if "id3Chunk" not in locals():
-    id3Chunk = None
-if "cueChunk" not in locals():
-    cueChunk = None
-
-display_information(riffChunk, dataChunk, fmtChunk, Optional, listChunk, id3Chunk, factChunk, cueChunk)
-
-if not skip_display:
+if decrypt_file_contents_on_read:
+    data = session.raw_data
+    with span("load_rsa_data"):
+        encryption_data = encryption_utils.load_rsa_data(encryption_data_file_name)
+    try:
+        # parametry zapisane w pliku mają pierwszeństwo przed zawartością pliku z kluczem
+        parameters = encrypted_data.encryption_parameters(session, encryption_data)
+        with span("decrypt_" + parameters.mode.lower(), len(data)):
+            data = encrypted_data.decrypt_data(data, encryption_data, parameters, session.fmt)
+        session.decode_data(data)
+        session.encryption = None
+        print("Pomyślnie odszyfrowano dane wewnątrz pliku.")
+    except Exception:
+        print("Odszyfrowanie nie powiodło się. Wczytano dane w wersji niezmodyfikowanej.")
+        session.decode_data(session.raw_data)
+
+riffChunk, fmtChunk, dataChunk = session.riff, session.fmt, session.data
+if dataChunk is None:
+    dataChunk = Chunk("data", session.chunk_offsets["data"][1])
+
+display_information(riffChunk, dataChunk, fmtChunk, session.optional, session.list, session.id3, session.fact,
+                    session.cue, session.unrecognized)
+if session.encryption is not None:
+    print(session.encryption)
+
+if not skip_display and render_output_dir is not None:
+    channels = np.asarray(normalize_samples(dataChunk.data.samples, fmtChunk), dtype=np.float64)
+    lower, upper = render_range
+    if lower is None or upper is None or not 0 <= lower < upper <= channels.shape[1]:
+        lower, upper = 0, channels.shape[1]
+    name = os.path.splitext(os.path.basename(f.name))[0]
+    outputs = render.PreviewRenderer(render_size).render_samples(channels[:, lower:upper], fmtChunk.data.sample_rate,
+                                                                 name, render_output_dir, formats=render_formats,
+                                                                 first_frame=lower)
+    for output in outputs:
+        print(f"Zapisano wykres: {output}")
+elif not skip_display:
     print("\n\nWybierz przedział próbek, z których zostanie narysowany przebieg oraz widma (najpierw dolny indeks, następnie górny, w przypadku nieprawidłowych indeksów wybrana zostanie całość)")
     print(f"(min: 0 --- max: {len(dataChunk.data.samples[0])-1})")
     print("Dolny indeks: ", end="")
@@ -124,87 +107,126 @@ if not skip_display:
         upper = None
 
 
-    display_waveform(dataChunk, fmtChunk, lower, upper)
+    # podgląd liczony jest z pliku, więc nie pasuje do danych odszyfrowanych w pamięci
+    waveform_overview = None
+    if use_waveform_overview and session.encryption is None and not decrypt_file_contents_on_read:
+        waveform_overview = overview.get_overview(f.name)
+    display_waveform(dataChunk, fmtChunk, lower, upper, waveform_overview)
     display_amplitude_spectrum(dataChunk, fmtChunk, lower, upper)
     display_phase_spectrum(dataChunk, fmtChunk, lower, upper)
-    display_spectrogram(dataChunk, fmtChunk, lower, upper)
+    pyramid = None
+    if use_spectrogram_tiles and session.encryption is None and not decrypt_file_contents_on_read:
+        pyramid = spectrogram_tiles.SpectrogramPyramid(f.name, cache_dir=spectrogram_tiles_dir)
+    display_spectrogram(dataChunk, fmtChunk, lower, upper, pyramid)
 
 ###
 # zapis
 
 print("\n\nPodaj indeksy które metadane zapisać do pliku, zakończ wybór wpisując literę:")
 print("(Pamiętaj, żeby podać wszystkie chunki zawierające chunk, który chcesz zapisać):")
-print(Optional)
+print(session.optional)
 while True:
     try:
-        elem = Optional.get(int(input()))
-        tab.append(elem) if elem not in tab else None
+        session.select(session.optional.get(int(input())))
     except Exception:
         break
 
 
 encrypted_samples = None
-
-
-if encrypt_file_contents_on_save:
+encryption_pipeline = None
+data_writer = None
+cache = None
+cache_key = None
+cached_output = False
+
+
+# pamięć podręczna tylko dla istniejącego klucza - nowy klucz zawsze daje inny wynik
+if result_cache_dir is not None and encrypt_file_contents_on_save and not generate_new_keys:
+    cache = result_cache.open_cache(result_cache_dir, result_cache_max_bytes)
+    with span("result_cache_lookup"):
+        cached_encryption_data = encryption_utils.load_rsa_data(encryption_data_file_name)
+        cache_key = cache.key(result_cache.session_digest(session), "encrypted_wav",
+                              fingerprint=encryption_utils.key_fingerprint(cached_encryption_data.n,
+                                                                           cached_encryption_data.e).hex(),
+                              mode="CBC" if use_cbc else "ECB", library_rsa=use_library_rsa,
+                              compression=compress_before_encryption, pass_through=pass_through_unmodified,
+                              metadata=result_cache.metadata_digest(session, pass_through_unmodified))
+        cached_output = cache.get_file(cache_key, save_file_name)
+    if cached_output:
+        print(f"\nPlik wynikowy {save_file_name} skopiowano z pamięci podręcznej wyników.")
+
+
+if encrypt_file_contents_on_save and not cached_output:
     if generate_new_keys:
-        if use_library_rsa:
-            encryption_data = rsa_lib_wrapper.private_key_to_rsa_data(rsa.newkeys(new_key_bit_len)[1])
-        else:
-            encryption_data = rsa_wrapper.new_keys(new_key_bit_len)
+        with span("generate_keys"):
+            if use_library_rsa:
+                encryption_data = rsa_lib_wrapper.private_key_to_rsa_data(rsa.newkeys(new_key_bit_len)[1])
+            else:
+                encryption_data = rsa_wrapper.new_keys(new_key_bit_len)
     else:
-        encryption_data = encryption_utils.read_rsa_data_from_file(encryption_data_file_name)
+        with span("load_rsa_data"):
+            encryption_data = encryption_utils.load_rsa_data(encryption_data_file_name)
         if not use_cbc:
             encryption_data.init_vector = None
         if use_library_rsa:
             encryption_data.block_leftover_len = None
 
-    samples_as_bytes = DataChunk.Contents.channels_to_bytes(fmtChunk, dataChunk.data)
+    with span("channels_to_bytes") as record:
+        samples_as_bytes = DataChunk.Contents.channels_to_bytes(fmtChunk, dataChunk.data)
+        record.bytes = len(samples_as_bytes)
+
+    delta_filter = False
+    if compress_before_encryption is not None:
+        with span("compress", len(samples_as_bytes)):
+            samples_as_bytes, delta_filter = compression.compress(samples_as_bytes, fmtChunk,
+                                                                  compress_before_encryption)
 
     if use_cbc:
-        if use_library_rsa:
-            encrypted_samples, init_vector = rsa_lib_wrapper.encrypt_cbc(samples_as_bytes,
-                                                                         rsa.PublicKey(encryption_data.n, encryption_data.e))
-        else:
-            encrypted_samples, init_vector, block_leftover_len = rsa_wrapper.encrypt_cbc(samples_as_bytes,
-                                                                                         encryption_data)
-            encryption_data.block_leftover_len = block_leftover_len
+        with span("encrypt_cbc", len(samples_as_bytes)):
+            if use_library_rsa:
+                encrypted_samples, init_vector = rsa_lib_wrapper.encrypt_cbc(samples_as_bytes,
+                                                                             rsa.PublicKey(encryption_data.n, encryption_data.e))
+            else:
+                encrypted_samples, init_vector, block_leftover_len = rsa_wrapper.encrypt_cbc(samples_as_bytes,
+                                                                                             encryption_data)
+                encryption_data.block_leftover_len = block_leftover_len
         encryption_data.init_vector = init_vector
+    elif use_pipeline:
+        # szyfrogram powstaje w trakcie zapisu pliku (session.write)
+        encryption_pipeline = pipeline.EncryptionPipeline(encryption_data, use_library_rsa, workers=pipeline_workers,
+                                                          queue_depth=pipeline_queue_depth)
+        data_writer = encryption_pipeline.data_chunk_writer(io.BytesIO(samples_as_bytes), len(samples_as_bytes))
+        encryption_data.block_leftover_len = encryption_pipeline.block_leftover_len(len(samples_as_bytes))
     else:
-        if use_library_rsa:
-            encrypted_samples = rsa_lib_wrapper.encrypt_ecb(samples_as_bytes,
-                                                            rsa.PublicKey(encryption_data.n, encryption_data.e))
-        else:
-            encrypted_samples, block_leftover_len = rsa_wrapper.encrypt_ecb(samples_as_bytes, encryption_data)
-            encryption_data.block_leftover_len = block_leftover_len
-
-    encryption_utils.write_rsa_data_to_file(encryption_data_file_name, encryption_data)
-
-file = open(save_file_name, "wb")
-riffChunk.write(file)
-fmtChunk.write(file)
-dataChunk.write(file, fmtChunk, encrypted_samples)
-try:
-    if 'LIST' in tab:
-        listChunk.write(file)
-except Exception:
-    pass
-try:
-    if 'id3 ' in tab:
-        id3Chunk.write(file)
-except Exception:
-    pass
-try:
-    if 'fact' in tab:
-        factChunk.write(file)
-except Exception:
-    pass
-try:
-    if 'cue ' in tab:
-        cueChunk.write(file)
-except Exception:
-    pass
-
-if 'id3 ' in tab:
-    file.write((0).to_bytes(1, byteorder="little", signed=True))
-file.close()
+        with span("encrypt_ecb", len(samples_as_bytes)):
+            if use_library_rsa:
+                encrypted_samples = rsa_lib_wrapper.encrypt_ecb(samples_as_bytes,
+                                                                rsa.PublicKey(encryption_data.n, encryption_data.e))
+            else:
+                encrypted_samples, block_leftover_len = rsa_wrapper.encrypt_ecb(samples_as_bytes, encryption_data)
+                encryption_data.block_leftover_len = block_leftover_len
+
+    session.encryption = EncryptionChunk.create(EncryptionChunk.Contents(
+        "CBC" if use_cbc else "ECB", use_library_rsa, encryption_data.block_leftover_len, encryption_data.init_vector,
+        encryption_utils.key_fingerprint(encryption_data.n, encryption_data.e), compress_before_encryption,
+        delta_filter))
+
+    # parametry szyfrowania są w pliku wynikowym - plik z kluczem zapisujemy tylko dla nowego klucza
+    if generate_new_keys:
+        with span("save_rsa_data"):
+            encryption_utils.save_rsa_data(encryption_data_file_name, encryption_data)
+
+if edit_metadata_in_place and not encrypt_file_contents_on_save:
+    with span("edit_metadata_in_place"):
+        result = metadata_editor.write_in_place(session.source_name, [("LIST", session.list), ("id3 ", session.id3)],
+                                                session.tab)
+    print(f"\nZmieniono metadane w pliku {session.source_name}: {result}")
+elif not cached_output:
+    session.save(save_file_name, encrypted_samples, data_writer, pass_through_unmodified)
+    if cache_key is not None:
+        cache.put_file(cache_key, save_file_name)
+
+if encryption_pipeline is not None:
+    print(f"\nPotok szyfrowania: {encryption_pipeline.stats}")
+
+instrumentation.finish()
@@ -3,6 +3,8 @@ import secrets
 import sys
 import math
 
+DEFAULT_PUBLIC_EXPONENT = 65537
+
 
 def multiply(x, y):
     base = 1536
@@ -118,26 +120,39 @@ def choose(size):
             return n
 
 
-def choose_prime_numbers(size):
-    # wybór liczb pierwszych
-    p = choose(size)
-    q = choose(size)
-    while p == q or p is None or q is None:
-        print("p i q mogły wyjść równe. Przeliczanie od nowa.")
+def choose_prime_numbers(size, public_exponent=None):
+    """
+    :param size: potęga 2 - górna granica losowania liczb pierwszych
+    :param public_exponent: stały wykładnik publiczny (np. 65537); None - losowy e z zakresu drawrange
+    :return: klucz publiczny, klucz prywatny i para liczb pierwszych
+    """
+    while True:
+        # wybór liczb pierwszych
         p = choose(size)
         q = choose(size)
+        while p == q or p is None or q is None:
+            print("p i q mogły wyjść równe. Przeliczanie od nowa.")
+            p = choose(size)
+            q = choose(size)
+
+        # zakres losowania
+        drawrange = multiply((p-1),(q-1))  # Funkcja λ (lambda) Carmichaela
+        # stały e musi być względnie pierwszy z drawrange - w przeciwnym razie losujemy nowe p i q
+        if public_exponent is None or (public_exponent < drawrange and gcd(public_exponent, drawrange) == 1):
+            break
 
     # wyznaczenie num
     num = multiply(p, q)
 
-    # zakres losowania
-    drawrange = multiply((p-1),(q-1))  # Funkcja λ (lambda) Carmichaela
-    g = 0
-    while g != 1 or e == 0:
-        # względnie pierwsza e
-        e = secrets.randbelow(drawrange)
-        # czy względnie pierwsza (Euclid Algorithm)
-        g = gcd(e, drawrange)
+    if public_exponent is not None:
+        e = public_exponent
+    else:
+        g = 0
+        while g != 1 or e == 0:
+            # względnie pierwsza e
+            e = secrets.randbelow(drawrange)
+            # czy względnie pierwsza (Euclid Algorithm)
+            g = gcd(e, drawrange)
 
     # część prywatna
     d = inverse(e, drawrange)  # e^-1 mod drawrange
@@ -153,5 +168,6 @@ def RSA():  # to albo od razu choose_prime_numbers
     return public, private, prime
 
 
-public, private, prime = choose_prime_numbers(900)
-print(public, private, prime)
+if __name__ == "__main__":
+    public, private, prime = choose_prime_numbers(900)
+    print(public, private, prime)
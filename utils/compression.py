@@ -0,0 +1,91 @@
+import lzma
+import zlib
+
+import numpy as np
+
+# Bezstratna kompresja próbek przed szyfrowaniem: różnice kolejnych próbek w każdym kanale
+# (arytmetyka modulo 2^n, więc bez przepełnień), rozdzielenie bajtów próbek na płaszczyzny i zlib/lzma.
+
+methods = {"zlib": 1, "lzma": 2}        # nazwa -> kod zapisywany w chunku "encr"
+method_names = {code: name for name, code in methods.items()}
+
+_unsigned_types = {1: np.uint8, 2: np.dtype("<u2"), 3: np.dtype("<u4"), 4: np.dtype("<u4")}
+
+
+def can_delta_filter(fmtChunk) -> bool:
+    # tylko liniowe PCM - dla a-law/u-law, float i ADPCM różnice nie pomagają
+    return fmtChunk.data.audio_format == 1 and fmtChunk.data.bits_per_sample in (8, 16, 24, 32) and \
+        fmtChunk.data.block_align == fmtChunk.data.num_channels * fmtChunk.data.bits_per_sample // 8
+
+
+def _to_words(raw: bytes, sample_len: int, num_channels: int) -> np.ndarray:
+    if sample_len == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+        words = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+    else:
+        words = np.frombuffer(raw, dtype=_unsigned_types[sample_len])
+    return words.reshape(-1, num_channels)
+
+
+def _from_words(words: np.ndarray, sample_len: int) -> bytes:
+    if sample_len == 3:
+        words = words.astype("<u4").reshape(-1, 1).view(np.uint8)[:, :3]
+    return words.tobytes()
+
+
+def delta_encode(raw: bytes, fmtChunk) -> bytes:
+    sample_len = fmtChunk.data.bits_per_sample // 8
+    body_len = len(raw) - len(raw) % fmtChunk.data.block_align
+    words = _to_words(raw[:body_len], sample_len, fmtChunk.data.num_channels)
+    delta = np.empty_like(words)
+    delta[:1] = words[:1]
+    np.subtract(words[1:], words[:-1], out=delta[1:])
+    if sample_len == 3:
+        delta &= 0xFFFFFF
+    # płaszczyzny bajtów: najpierw wszystkie młodsze bajty, potem starsze - lepiej się kompresują
+    planes = np.frombuffer(_from_words(delta, sample_len), dtype=np.uint8).reshape(-1, sample_len).T
+    return planes.tobytes() + raw[body_len:]
+
+
+def delta_decode(data: bytes, fmtChunk) -> bytes:
+    sample_len = fmtChunk.data.bits_per_sample // 8
+    body_len = len(data) - len(data) % fmtChunk.data.block_align
+    planes = np.frombuffer(data, dtype=np.uint8, count=body_len).reshape(sample_len, -1)
+    words = _to_words(np.ascontiguousarray(planes.T).tobytes(), sample_len, fmtChunk.data.num_channels)
+    words = np.cumsum(words, axis=0, dtype=words.dtype)
+    if sample_len == 3:
+        words &= 0xFFFFFF
+    return _from_words(words, sample_len) + data[body_len:]
+
+
+def compress(raw: bytes, fmtChunk, method: str, delta_filter: bool = True) -> (bytes, bool):
+    """
+    :param raw: próbki w postaci bajtów (wynik channels_to_bytes)
+    :param fmtChunk: chunk fmt opisujący próbki
+    :param method: "zlib" albo "lzma"
+    :param delta_filter: czy kodować różnice próbek (stosowane tylko dla liniowego PCM)
+    :return: skompresowane dane, czy użyto kodowania różnicowego
+    """
+    delta_filter = delta_filter and can_delta_filter(fmtChunk)
+    if delta_filter:
+        raw = delta_encode(raw, fmtChunk)
+    if method == "zlib":
+        return zlib.compress(raw, 6), delta_filter
+    elif method == "lzma":
+        return lzma.compress(raw, preset=6), delta_filter
+    else:
+        print("Nieznana metoda kompresji")
+        raise Exception
+
+
+def decompress(data: bytes, fmtChunk, method: str, delta_filter: bool) -> bytes:
+    if method == "zlib":
+        raw = zlib.decompress(data)
+    elif method == "lzma":
+        raw = lzma.decompress(data)
+    else:
+        print("Nieznana metoda kompresji")
+        raise Exception
+    if delta_filter:
+        raw = delta_decode(raw, fmtChunk)
+    return raw
@@ -5,7 +5,7 @@ from utils.wav_chunks import *
 
 def display_information(riff_chunk: RIFFHeader, data_chunk: DataChunk, fmt_chunk: FmtChunk, optional: dict,
                         list_chunk: LISTChunk = None, id3_chunk: ID3Chunk = None, fact_chunk: factChunk = None,
-                        cue_chunk: CueChunk = None):
+                        cue_chunk: CueChunk = None, unrecognized_chunks: list = ()):
     print("Pomyślnie wczytano plik")
     print(riff_chunk)
     print(fmt_chunk)
@@ -32,7 +32,7 @@ def display_information(riff_chunk: RIFFHeader, data_chunk: DataChunk, fmt_chunk
     except Exception:
         pass
     try:
-        for unrecognized in unrecognizedChunk:
+        for unrecognized in unrecognized_chunks:
             try:
                 print("\tNierozpoznany:")
                 print(f"\tChunk ID: {unrecognized.id} Chunk size: {unrecognized.size}")
@@ -64,7 +64,93 @@ def normalize_samples(samples: list, fmtChunk: FmtChunk):
         return samples/(2**(fmtChunk.data.bits_per_sample-1))
 
 
-def display_waveform(dataChunk: DataChunk, fmtChunk: FmtChunk, lower: int = None, upper: int = None):
+fft_workers = -1                    # liczba wątków scipy.fft (-1 - wszystkie rdzenie)
+
+
+def compute_spectra(channels: np.ndarray, sample_rate: int, workers: int = None,
+                    fast_len: bool = False) -> (np.ndarray, np.ndarray):
+    """
+    :param channels: znormalizowane próbki (kanał, ramka)
+    :param sample_rate: częstotliwość próbkowania
+    :param workers: liczba wątków scipy.fft, None - fft_workers z chwili wywołania
+    :param fast_len: dopełnienie zerami do scipy.fft.next_fast_len - szybsza transformata, gęstsza siatka częstotliwości
+    :return: częstotliwości i widma wszystkich kanałów (kanał, prążek), liczone jedną transformatą
+    """
+    channels = np.atleast_2d(np.asarray(channels, dtype=np.float64))
+    length = channels.shape[1]
+    if fast_len:
+        length = scipy.fft.next_fast_len(length, real=True)
+    spectra = scipy.fft.rfft(channels, n=length, axis=1, workers=fft_workers if workers is None else workers)
+    return scipy.fft.rfftfreq(length, 1 / sample_rate), spectra
+
+
+def compute_spectrogram(channels: np.ndarray, sample_rate: int, nfft: int = 256, noverlap: int = 128,
+                        workers: int = None) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    :param channels: znormalizowane próbki (kanał, ramka)
+    :param sample_rate: częstotliwość próbkowania
+    :param nfft: długość okna
+    :param noverlap: liczba ramek wspólnych dla kolejnych okien
+    :param workers: liczba wątków scipy.fft, None - fft_workers z chwili wywołania
+    :return: częstotliwości, czasy środków okien i gęstość widmowa mocy (kanał, prążek, okno) jak
+             matplotlib.mlab.specgram - okna wszystkich kanałów liczone jedną transformatą
+    """
+    channels = np.atleast_2d(np.asarray(channels, dtype=np.float64))
+    if channels.shape[1] < nfft:
+        channels = np.pad(channels, ((0, 0), (0, nfft - channels.shape[1])))
+    windows = np.lib.stride_tricks.sliding_window_view(channels, nfft, axis=1)[:, ::nfft - noverlap]
+    window = np.hanning(nfft)
+    spectra = scipy.fft.rfft(windows * window, axis=-1, workers=fft_workers if workers is None else workers)
+    power = (spectra * spectra.conj()).real
+    # widmo jednostronne - moc prążków poza składową stałą (i częstotliwością Nyquista) podwojona
+    power[..., 1:-1 if nfft % 2 == 0 else None] *= 2
+    power /= sample_rate * (window ** 2).sum()
+    times = (np.arange(windows.shape[1]) * (nfft - noverlap) + nfft / 2) / sample_rate
+    return scipy.fft.rfftfreq(nfft, 1 / sample_rate), times, power.transpose(0, 2, 1)
+
+
+def phase_spectra(spectra: np.ndarray, threshold: float = 0.01) -> np.ndarray:
+    # faza prążków; prążki o amplitudzie poniżej threshold * maksimum kanału są zerowane (szum)
+    magnitude = np.abs(spectra)
+    limit = magnitude.max(axis=-1, keepdims=True, initial=0) * threshold
+    return np.angle(np.where(magnitude < limit, 0, spectra))
+
+
+def display_waveform_overview(overview, lower: int = None, upper: int = None):
+    # przebieg rysowany z podglądu (utils.overview): obwiednia min/max i RMS przedziałów
+    plt.close()
+
+    if lower is None or upper is None or lower < 0 or upper < 0 or lower > overview.frames or \
+            upper > overview.frames or lower >= upper:
+        lower = 0
+        upper = overview.frames
+
+    level = overview.best_level(lower, upper)
+    time_axis, minimum, maximum, rms = overview.select(level, lower, upper)
+    figure, axes = plt.subplots(overview.num_channels, 1, sharex=False, sharey=True, squeeze=False)
+    for channel_index in range(overview.num_channels):
+        axis = axes[channel_index][0]
+        axis.fill_between(time_axis, minimum[channel_index], maximum[channel_index], linewidth=0)
+        axis.fill_between(time_axis, -rms[channel_index], rms[channel_index], linewidth=0, alpha=0.6)
+        if overview.num_channels > 1:
+            axis.set_title(f"Kanał {channel_index+1}")
+        axis.set_ylabel("Znormalizowana amplituda")
+        axis.set_xlabel("Czas [s]")
+    plt.suptitle("Przebieg wybranego fragmentu sygnału wewnątrz pliku")
+    plt.tight_layout()
+    plt.show(block=True)
+
+
+def display_waveform(dataChunk: DataChunk, fmtChunk: FmtChunk, lower: int = None, upper: int = None,
+                     overview=None, max_plotted_frames: int = 1 << 18):
+    # overview - podgląd z utils.overview, używany gdy fragment ma więcej niż max_plotted_frames ramek
+    # albo próbki nie zostały wczytane (dataChunk None)
+    if overview is not None:
+        if dataChunk is None or lower is None or upper is None or upper - lower > max_plotted_frames or \
+                not 0 <= lower < upper <= overview.frames:
+            display_waveform_overview(overview, lower, upper)
+            return
+
     plt.close()
 
     channels = np.array(dataChunk.data.samples)
@@ -100,7 +186,35 @@ def display_waveform(dataChunk: DataChunk, fmtChunk: FmtChunk, lower: int = None
     plt.show(block=True)
 
 
-def display_spectrogram(dataChunk: DataChunk, fmtChunk: FmtChunk, lower, upper):
+def display_spectrogram_tiles(pyramid, lower: int = None, upper: int = None):
+    # spektrogram złożony z kafelków utils.spectrogram_tiles (amplituda w dB)
+    plt.close()
+
+    times, frequencies, magnitude = pyramid.view(lower, upper)
+    figure, axes = plt.subplots(magnitude.shape[0], 1, sharex=False, sharey=True, squeeze=False)
+    for channel_index in range(magnitude.shape[0]):
+        axis = axes[channel_index][0]
+        axis.pcolormesh(times, frequencies, magnitude[channel_index], shading="auto")
+        axis.set_yscale("symlog")
+        if magnitude.shape[0] > 1:
+            axis.set_title(f"Kanał {channel_index+1}")
+        axis.set_ylabel("Częstotliwość [Hz]")
+        axis.set_xlabel("Czas [s]")
+    plt.suptitle("Spektrogram wybranego fragmentu sygnału wewnątrz pliku")
+    plt.tight_layout()
+    plt.show(block=True)
+
+
+def display_spectrogram(dataChunk: DataChunk, fmtChunk: FmtChunk, lower, upper, pyramid=None,
+                        max_computed_frames: int = 1 << 20):
+    # pyramid - kafelki z utils.spectrogram_tiles, używane gdy fragment ma więcej niż max_computed_frames ramek
+    # albo próbki nie zostały wczytane (dataChunk None)
+    if pyramid is not None:
+        if dataChunk is None or lower is None or upper is None or upper - lower > max_computed_frames or \
+                not 0 <= lower < upper <= pyramid.frames:
+            display_spectrogram_tiles(pyramid, lower, upper)
+            return
+
     plt.close()
     channels = np.array(dataChunk.data.samples)
 
@@ -115,19 +229,22 @@ def display_spectrogram(dataChunk: DataChunk, fmtChunk: FmtChunk, lower, upper):
     figure, axes = plt.subplots(len(channels), 1, sharex=False, sharey=True)
 
 
+    # okna wszystkich kanałów jedną transformatą, wykres w dB jak Axes.specgram
+    frequencies, times, power = compute_spectrogram(normalize_samples(channels[:, lower:upper], fmtChunk),
+                                                    fmtChunk.data.sample_rate)
+    with np.errstate(divide="ignore"):
+        power = 10 * np.log10(power)
+
     if fmtChunk.data.num_channels == 1:
-        channel = channels[0]
-        channel = channel[lower:upper]
-        channel = normalize_samples(channel, fmtChunk)
-        axes.specgram(x=channel, Fs=fmtChunk.data.sample_rate, scale="dB")
+        axes.pcolormesh(times, frequencies, power[0], shading="auto")
+        axes.set_ylim(frequencies[0], frequencies[-1])
         axes.set_yscale("symlog")
         axes.set_ylabel("Częstotliwość [Hz]")
         axes.set_xlabel("Czas [s]")
     else:
-        for channel_index, channel in enumerate(channels):
-            channel = channel[lower:upper]
-            channel = normalize_samples(channel, fmtChunk)
-            axes[channel_index].specgram(x=channel, Fs=fmtChunk.data.sample_rate, scale="dB")
+        for channel_index in range(len(channels)):
+            axes[channel_index].pcolormesh(times, frequencies, power[channel_index], shading="auto")
+            axes[channel_index].set_ylim(frequencies[0], frequencies[-1])
             axes[channel_index].set_yscale("symlog")
             axes[channel_index].set_title(f"Kanał {channel_index+1}")
             axes[channel_index].set_ylabel("Częstotliwość [Hz]")
@@ -148,24 +265,17 @@ def display_amplitude_spectrum(dataChunk: DataChunk, fmtChunk: FmtChunk, lower:
         lower = 0
         upper = len(channels[0])
 
-    time_axis = (np.array(range(0, len(channels[0])))/fmtChunk.data.sample_rate)[lower:upper]
     figure, axes = plt.subplots(len(channels), 1, sharex=False, sharey=True)
+    frequencies, spectra = compute_spectra(normalize_samples(channels[:, lower:upper], fmtChunk),
+                                           fmtChunk.data.sample_rate)
 
     if fmtChunk.data.num_channels == 1:
-        channel = channels[0][lower:upper]
-        channel = normalize_samples(channel, fmtChunk)
-        spectrum = scipy.fft.rfft(channel)
-        frequencies = scipy.fft.rfftfreq(len(channel), 1 / fmtChunk.data.sample_rate)
-        axes.plot(frequencies, np.abs(spectrum))
+        axes.plot(frequencies, np.abs(spectra[0]))
         axes.set_xscale("symlog")
         axes.set_ylabel("Amplituda")
         axes.set_xlabel("Częstotliwość [Hz]")
     else:
-        for channel_index, channel in enumerate(channels):
-            channel = channel[lower:upper]
-            #channel = normalize_samples(channel, fmtChunk)
-            spectrum = scipy.fft.rfft(channel)
-            frequencies = scipy.fft.rfftfreq(len(channel), 1/fmtChunk.data.sample_rate)
+        for channel_index, spectrum in enumerate(spectra):
             axes[channel_index].plot(frequencies, np.abs(spectrum))
             axes[channel_index].set_xscale("symlog")
             axes[channel_index].set_title(f"Kanał {channel_index+1}")
@@ -187,33 +297,19 @@ def display_phase_spectrum(dataChunk: DataChunk, fmtChunk: FmtChunk, lower: int
         lower = 0
         upper = len(channels[0])
 
-    time_axis = (np.array(range(0, len(channels[0])))/fmtChunk.data.sample_rate)[lower:upper]
     figure, axes = plt.subplots(len(channels), 1, sharex=False, sharey=True)
+    frequencies, spectra = compute_spectra(normalize_samples(channels[:, lower:upper], fmtChunk),
+                                           fmtChunk.data.sample_rate)
+    phases = phase_spectra(spectra)
 
     if fmtChunk.data.num_channels == 1:
-        channel = channels[0][lower:upper]
-        normalize_samples(channel, fmtChunk)
-        spectrum = scipy.fft.rfft(channel)
-        threshold = max(abs(spectrum)) / 100
-        for i, x in enumerate(spectrum):
-            if x < threshold:
-                spectrum[i] = 0
-        frequencies = scipy.fft.rfftfreq(len(channel), 1 / fmtChunk.data.sample_rate)
-        axes.plot(frequencies, np.angle(spectrum))
+        axes.plot(frequencies, phases[0])
         axes.set_xscale("symlog")
         axes.set_ylabel("Przesunięcie fazowe [rad]")
         axes.set_xlabel("Częstotliwość [Hz]")
     else:
-        for channel_index, channel in enumerate(channels):
-            channel = channel[lower:upper]
-            channel = normalize_samples(channel, fmtChunk)
-            spectrum = scipy.fft.rfft(channel)
-            threshold = max(abs(spectrum))/100
-            for i, x in enumerate(spectrum):
-                if x < threshold:
-                    spectrum[i] = 0
-            frequencies = scipy.fft.rfftfreq(len(channel), 1/fmtChunk.data.sample_rate)
-            axes[channel_index].plot(frequencies, np.angle(spectrum))
+        for channel_index, phase in enumerate(phases):
+            axes[channel_index].plot(frequencies, phase)
             axes[channel_index].set_xscale("symlog")
             axes[channel_index].set_title(f"Kanał {channel_index+1}")
             axes[channel_index].set_ylabel("Przesunięcie fazowe [rad]")
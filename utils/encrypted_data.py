@@ -0,0 +1,172 @@
+import rsa
+
+from utils import rsa_wrapper, rsa_lib_wrapper, compression
+from utils.encryption_utils import RsaData, key_fingerprint
+from utils.wav_chunks import EncryptionChunk, DataChunk, FmtChunk, WavSession
+
+
+def encryption_parameters(session: WavSession, rsa_data: RsaData) -> EncryptionChunk.Contents:
+    # parametry z chunka "encr"; dla starszych plików - z pliku z kluczem
+    if session.encryption is not None:
+        parameters = session.encryption.data
+        if parameters.key_fingerprint != key_fingerprint(rsa_data.n, rsa_data.e):
+            print("Klucz nie pasuje do klucza, którym zaszyfrowano plik.")
+            raise Exception
+        return parameters
+    library = rsa_data.block_leftover_len is None  # to pole jest puste jesli wykorzystano szyfrowanie z biblioteki
+    return EncryptionChunk.Contents("ECB" if rsa_data.init_vector is None else "CBC", library,
+                                    rsa_data.block_leftover_len, rsa_data.init_vector,
+                                    key_fingerprint(rsa_data.n, rsa_data.e))
+
+
+def decrypt_data(message: bytes, rsa_data: RsaData, parameters: EncryptionChunk.Contents,
+                 fmtChunk: FmtChunk = None) -> bytes:
+    # fmtChunk jest potrzebny tylko do odwrócenia kodowania różnicowego (parameters.delta_filter)
+    if parameters.library:
+        private_key = rsa.PrivateKey(*rsa_data)
+        if parameters.mode == "ECB":
+            data = rsa_lib_wrapper.decrypt_ecb(message, private_key=private_key)
+        else:
+            data = rsa_lib_wrapper.decrypt_cbc(message, private_key=private_key, init_vector=parameters.init_vector)
+    elif parameters.mode == "ECB":
+        data = rsa_wrapper.decrypt_ecb(message, rsa_data, block_leftover_len=parameters.block_leftover_len)
+    else:
+        data = rsa_wrapper.decrypt_cbc(message, rsa_data, init_vector=parameters.init_vector,
+                                       block_leftover_len=parameters.block_leftover_len)
+    if parameters.compression is not None:
+        data = compression.decompress(data, fmtChunk, parameters.compression, parameters.delta_filter)
+    return data
+
+
+class BlockLayout:
+    # Rozmiary bloków tekstu jawnego i szyfrogramu dla obu implementacji RSA (jak w rsa_wrapper/rsa_lib_wrapper)
+    def __init__(self, rsa_data: RsaData, parameters: EncryptionChunk.Contents):
+        bit_length = rsa_data.n.bit_length()
+        self.parameters = parameters
+        if parameters.library:
+            self.plain_block_size = bit_length // 8 - 11
+            self.cipher_block_size = bit_length // 8
+            private_key = rsa.PrivateKey(*rsa_data)
+            self.decrypt_block = lambda block: rsa.decrypt(block, private_key)
+        else:
+            self.plain_block_size = bit_length // 8 - 1
+            self.cipher_block_size = bit_length // 8 + 1
+            self.decrypt_block = lambda block: rsa_wrapper.decrypt_block(block, rsa_data)
+        self.init_vector_len = self.cipher_block_size
+
+    def block_count(self, cipher_len: int) -> int:
+        return -(-cipher_len // self.cipher_block_size)
+
+    def blocks_for_bytes(self, byte_start: int, byte_end: int, cipher_len: int) -> (int, int):
+        # indeksy pierwszego i ostatniego bloku zawierającego bajty tekstu jawnego [byte_start, byte_end)
+        last_block = self.block_count(cipher_len) - 1
+        first = min(byte_start // self.plain_block_size, last_block)
+        last = min(max(byte_end - 1, byte_start) // self.plain_block_size, last_block)
+        return first, last
+
+    def decrypt_blocks(self, read_ciphertext, first: int, last: int, cipher_len: int) -> bytes:
+        """
+        :param read_ciphertext: funkcja (pozycja, długość) -> bajty szyfrogramu z chunka danych
+        :param first: indeks pierwszego bloku
+        :param last: indeks ostatniego bloku (włącznie)
+        :param cipher_len: rozmiar całego szyfrogramu
+        :return: odszyfrowane bloki first..last
+        """
+        cbc = self.parameters.mode == "CBC"
+        size = self.cipher_block_size
+        # w CBC blok i zależy tylko od szyfrogramu bloku i-1 (lub wektora inicjalizującego)
+        read_from = first - 1 if cbc and first > 0 else first
+        ciphertext = read_ciphertext(read_from * size, (last + 1 - read_from) * size)
+        if cbc and first > 0:
+            previous_vector = ciphertext[0:size]
+            ciphertext = ciphertext[size:]
+        elif cbc:
+            previous_vector = self.parameters.init_vector.to_bytes(length=self.init_vector_len, byteorder="little")
+
+        last_block = self.block_count(cipher_len) - 1
+        leftover = self.parameters.block_leftover_len
+        decrypted_blocks = []
+        for i in range(first, last + 1):
+            block = bytes(ciphertext[(i - first) * size:(i - first + 1) * size])
+            decrypted_block = self.decrypt_block(block)
+            if cbc:
+                previous_vector_as_number = int.from_bytes(previous_vector[0:len(decrypted_block)], byteorder="little")
+                decrypted_block_as_number = int.from_bytes(decrypted_block, "little")
+                decrypted_block = (decrypted_block_as_number ^ previous_vector_as_number).to_bytes(
+                    length=len(decrypted_block), byteorder="little")
+                previous_vector = block
+            if not self.parameters.library:
+                decrypted_block = decrypted_block[0:self.plain_block_size]
+                if i == last_block and leftover:
+                    decrypted_block = decrypted_block[0:leftover]
+            decrypted_blocks.append(decrypted_block)
+        return b"".join(decrypted_blocks)
+
+
+def decrypt_byte_range(read_ciphertext, cipher_len: int, rsa_data: RsaData, parameters: EncryptionChunk.Contents,
+                       byte_start: int, byte_end: int) -> bytes:
+    layout = BlockLayout(rsa_data, parameters)
+    first, last = layout.blocks_for_bytes(byte_start, byte_end, cipher_len)
+    plain = layout.decrypt_blocks(read_ciphertext, first, last, cipher_len)
+    offset = byte_start - first * layout.plain_block_size
+    return plain[offset:offset + byte_end - byte_start]
+
+
+def _range_parameters(session: WavSession, rsa_data: RsaData) -> EncryptionChunk.Contents:
+    parameters = encryption_parameters(session, rsa_data)
+    if parameters.compression is not None:
+        # strumień zlib/lzma trzeba rozpakować od początku - pozostaje odszyfrowanie całości (decrypt_data)
+        print("Dane skompresowane przed szyfrowaniem nie mogą być odszyfrowane fragmentami.")
+        raise Exception
+    return parameters
+
+
+def _ciphertext_reader(session: WavSession, file):
+    # funkcja (pozycja, długość) -> bajty szyfrogramu z session.raw_data albo z otwartego pliku źródłowego
+    data_offset, cipher_len = session.chunk_offsets["data"]
+    if session.raw_data is not None:
+        view = memoryview(session.raw_data)
+
+        def read_ciphertext(offset, length):
+            return view[offset:offset + length]
+    else:
+        def read_ciphertext(offset, length):
+            file.seek(data_offset + offset)
+            return file.read(min(length, cipher_len - offset))
+    return read_ciphertext
+
+
+def decrypted_frames(session: WavSession, rsa_data: RsaData, file=None) -> int:
+    """
+    :param session: wczytany plik (dane mogą nie być wczytane - WavSession.read(..., load_data=False))
+    :param rsa_data: klucz prywatny
+    :param file: otwarty plik źródłowy, jeśli session.raw_data nie zawiera szyfrogramu
+    :return: liczba ramek tekstu jawnego - rozmiar chunka danych to długość szyfrogramu; odszyfrowywany jest
+             tylko ostatni blok (dopełnienie biblioteki rsa albo block_leftover_len)
+    """
+    parameters = _range_parameters(session, rsa_data)
+    cipher_len = session.chunk_offsets["data"][1]
+    layout = BlockLayout(rsa_data, parameters)
+    last = layout.block_count(cipher_len) - 1
+    if last < 0:
+        return 0
+    last_block = layout.decrypt_blocks(_ciphertext_reader(session, file), last, last, cipher_len)
+    return (last * layout.plain_block_size + len(last_block)) // session.fmt.data.block_align
+
+
+def decrypt_frame_range(session: WavSession, rsa_data: RsaData, lower: int, upper: int, file=None) -> list:
+    """
+    :param session: wczytany plik (dane mogą nie być wczytane - WavSession.read(..., load_data=False))
+    :param rsa_data: klucz prywatny
+    :param lower: pierwsza ramka
+    :param upper: ramka za ostatnią
+    :param file: otwarty plik źródłowy, jeśli session.raw_data nie zawiera szyfrogramu
+    :return: kanały z próbkami z zakresu [lower, upper), jak DataChunk.Contents.bytes_to_channels
+    """
+    parameters = _range_parameters(session, rsa_data)
+    cipher_len = session.chunk_offsets["data"][1]
+    block_align = session.fmt.data.block_align
+    raw = decrypt_byte_range(_ciphertext_reader(session, file), cipher_len, rsa_data, parameters, lower * block_align,
+                             upper * block_align)
+    raw = raw[:len(raw) - len(raw) % block_align]
+    return DataChunk.Contents.bytes_to_channels(session.fmt, raw, len(raw))
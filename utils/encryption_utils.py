@@ -1,5 +1,22 @@
 import yaml
 import secrets
+import struct
+import copy
+import hashlib
+import os
+import tempfile
+import threading
+
+# binarny zapis kluczy: nagłówek i pola big-endian o stałej szerokości (długość modułu n w bajtach)
+binary_magic = b"WRK1"
+binary_header_struct = struct.Struct(">4sBI")      # magic, flagi, szerokość pól
+binary_leftover_struct = struct.Struct(">I")
+FLAG_INIT_VECTOR = 1
+FLAG_BLOCK_LEFTOVER_LEN = 2
+yaml_extensions = (".yaml", ".yml")
+
+_cache = {}
+_cache_lock = threading.Lock()
 
 
 class RsaData:
@@ -32,18 +49,105 @@ def read_rsa_data_from_file(file_name: str) -> RsaData:
         raise Exception
 
 
+def _replace_file(file_name: str, content, mode: str) -> None:
+    # plik tymczasowy o unikalnej nazwie w katalogu docelowym - równoległe zapisy nie piszą do tego samego pliku,
+    # a os.replace podmienia plik docelowy w całości
+    descriptor, temporary_name = tempfile.mkstemp(prefix=os.path.basename(file_name) + ".", suffix=".tmp",
+                                                  dir=os.path.dirname(os.path.abspath(file_name)))
+    try:
+        with os.fdopen(descriptor, mode) as file:
+            file.write(content)
+    except BaseException:
+        os.remove(temporary_name)
+        raise
+    os.replace(temporary_name, file_name)
+
+
 def write_rsa_data_to_file(file_name: str, data: RsaData) -> None:
-    with open(file_name, "w+") as file:
-        data_dict = {
-            "n": data.n,
-            "e": data.e,
-            "d": data.d,
-            "p": data.p,
-            "q": data.q,
-            "init_vector": data.init_vector,
-            "block_leftover_len": data.block_leftover_len
-        }
-        yaml.dump(data=data_dict, Dumper=yaml.Dumper, stream=file, sort_keys=False)
+    data_dict = {
+        "n": data.n,
+        "e": data.e,
+        "d": data.d,
+        "p": data.p,
+        "q": data.q,
+        "init_vector": data.init_vector,
+        "block_leftover_len": data.block_leftover_len
+    }
+    _replace_file(file_name, yaml.dump(data=data_dict, Dumper=yaml.Dumper, sort_keys=False), "w")
+
+
+def write_rsa_data_to_binary_file(file_name: str, data: RsaData) -> None:
+    width = (data.n.bit_length() + 7) // 8
+    flags = 0
+    if data.init_vector is not None:
+        flags |= FLAG_INIT_VECTOR
+    if data.block_leftover_len is not None:
+        flags |= FLAG_BLOCK_LEFTOVER_LEN
+    fields = [binary_header_struct.pack(binary_magic, flags, width)]
+    for value in (data.n, data.e, data.d, data.p, data.q):
+        fields.append(value.to_bytes(width, byteorder="big"))
+    if data.init_vector is not None:
+        fields.append(data.init_vector.to_bytes(width, byteorder="big"))
+    if data.block_leftover_len is not None:
+        fields.append(binary_leftover_struct.pack(data.block_leftover_len))
+    _replace_file(file_name, b"".join(fields), "wb")
+
+
+def read_rsa_data_from_binary_file(file_name: str) -> RsaData:
+    with open(file_name, "rb") as file:
+        content = file.read()
+    magic, flags, width = binary_header_struct.unpack_from(content, 0)
+    if magic != binary_magic:
+        raise Exception
+    offset = binary_header_struct.size
+    values = []
+    for _ in range(5):
+        values.append(int.from_bytes(content[offset:offset + width], byteorder="big"))
+        offset += width
+    n, e, d, p, q = values
+    init_vector = None
+    block_leftover_len = None
+    if flags & FLAG_INIT_VECTOR:
+        init_vector = int.from_bytes(content[offset:offset + width], byteorder="big")
+        offset += width
+    if flags & FLAG_BLOCK_LEFTOVER_LEN:
+        block_leftover_len = binary_leftover_struct.unpack_from(content, offset)[0]
+    return RsaData(n, e, d, p, q, init_vector, block_leftover_len)
+
+
+def load_rsa_data(file_name: str) -> RsaData:
+    # odczyt YAML lub binarny (rozpoznawany po nagłówku) z pamięcią podręczną procesu
+    # kluczem jest ścieżka i czas modyfikacji, więc każdy plik kluczy jest parsowany tylko raz
+    path = os.path.abspath(file_name)
+    stat = os.stat(path)
+    cache_key = (path, stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        data = _cache.get(cache_key)
+    if data is None:
+        with open(path, "rb") as file:
+            is_binary = file.read(len(binary_magic)) == binary_magic
+        if is_binary:
+            data = read_rsa_data_from_binary_file(path)
+        else:
+            data = read_rsa_data_from_file(path)
+        with _cache_lock:
+            for key in [key for key in _cache if key[0] == path]:
+                del _cache[key]
+            _cache[cache_key] = data
+    # kopia - wywołujący często nadpisują init_vector i block_leftover_len
+    return copy.copy(data)
+
+
+def save_rsa_data(file_name: str, data: RsaData) -> None:
+    if file_name.lower().endswith(yaml_extensions):
+        write_rsa_data_to_file(file_name, data)
+    else:
+        write_rsa_data_to_binary_file(file_name, data)
+
+
+def clear_rsa_data_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
 
 
 def divide_data_into_blocks(message: bytearray, preferred_block_size: int) -> list:
@@ -59,5 +163,11 @@ def divide_data_into_blocks(message: bytearray, preferred_block_size: int) -> li
     return blocks
 
 
+def key_fingerprint(n: int, e: int) -> bytes:
+    # SHA-256 klucza publicznego - pozwala sprawdzić, czy plik zaszyfrowano danym kluczem, bez ujawniania klucza
+    return hashlib.sha256(n.to_bytes((n.bit_length() + 7) // 8, byteorder="big") +
+                          e.to_bytes((e.bit_length() + 7) // 8, byteorder="big")).digest()
+
+
 def create_random_init_vector(bit_length: int) -> int:
     return secrets.randbits(bit_length)
@@ -0,0 +1,152 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Pomiar czasu i pamięci poszczególnych etapów przetwarzania.
+# Włączany zmienną środowiskową WAV_READER_PROFILE=1 albo funkcją enable().
+# WAV_READER_PROFILE_REPORT - ścieżka raportu JSON, WAV_READER_CPROFILE - ścieżka zrzutu cProfile.
+
+ENV_ENABLE = "WAV_READER_PROFILE"
+ENV_REPORT = "WAV_READER_PROFILE_REPORT"
+ENV_CPROFILE = "WAV_READER_CPROFILE"
+default_report_file_name = "profile_report.json"
+
+
+class SpanRecord:
+    __slots__ = ("name", "wall_time", "cpu_time", "bytes", "peak_memory", "thread", "depth",
+                 "_start_memory", "_peak_so_far")
+
+    def __init__(self, name: str, bytes_processed: int = 0):
+        self.name = name
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.bytes = bytes_processed
+        self.peak_memory = 0
+        self.thread = threading.current_thread().name
+        self.depth = 0
+        self._start_memory = 0
+        self._peak_so_far = 0
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "wall_time": self.wall_time, "cpu_time": self.cpu_time, "bytes": self.bytes,
+                "peak_memory": self.peak_memory, "thread": self.thread, "depth": self.depth}
+
+
+class _Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.report_file_name = None
+        self.cprofile_file_name = None
+        self.cprofile = None
+        self.started_tracemalloc = False
+
+
+_profiler = _Profiler()
+_disabled_record = SpanRecord("")
+
+
+def is_enabled() -> bool:
+    return _profiler.enabled
+
+
+def enable(report_file_name: str = None, cprofile_file_name: str = None) -> None:
+    _profiler.enabled = True
+    _profiler.records = []
+    _profiler.report_file_name = report_file_name or default_report_file_name
+    _profiler.cprofile_file_name = cprofile_file_name
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _profiler.started_tracemalloc = True
+    if cprofile_file_name is not None:
+        _profiler.cprofile = cProfile.Profile()
+        _profiler.cprofile.enable()
+
+
+def enable_from_environment() -> bool:
+    if os.environ.get(ENV_ENABLE, "") not in ("", "0"):
+        enable(os.environ.get(ENV_REPORT), os.environ.get(ENV_CPROFILE))
+    return _profiler.enabled
+
+
+@contextmanager
+def span(name: str, bytes_processed: int = 0):
+    """
+    :param name: nazwa etapu
+    :param bytes_processed: liczba przetworzonych bajtów (można zwiększać przez record.bytes)
+    :return: SpanRecord uzupełniany po zakończeniu etapu
+    """
+    if not _profiler.enabled:
+        yield _disabled_record
+        return
+
+    record = SpanRecord(name, bytes_processed)
+    stack = getattr(_profiler.local, "stack", None)
+    if stack is None:
+        stack = _profiler.local.stack = []
+    record.depth = len(stack)
+
+    # reset_peak jest globalny, więc przed resetem zapamiętujemy szczyt dla etapów nadrzędnych
+    current, peak = tracemalloc.get_traced_memory()
+    for parent in stack:
+        parent._peak_so_far = max(parent._peak_so_far, peak)
+    tracemalloc.reset_peak()
+    record._start_memory = current
+    record._peak_so_far = current
+    stack.append(record)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield record
+    finally:
+        record.cpu_time = time.thread_time() - cpu_start
+        record.wall_time = time.perf_counter() - wall_start
+        peak = max(record._peak_so_far, tracemalloc.get_traced_memory()[1])
+        record.peak_memory = peak - record._start_memory
+        stack.pop()
+        for parent in stack:
+            parent._peak_so_far = max(parent._peak_so_far, peak)
+        with _profiler.lock:
+            _profiler.records.append(record)
+
+
+def report() -> dict:
+    with _profiler.lock:
+        records = list(_profiler.records)
+    summary = {}
+    for record in records:
+        entry = summary.setdefault(record.name, {"count": 0, "wall_time": 0.0, "cpu_time": 0.0, "bytes": 0,
+                                                 "peak_memory": 0})
+        entry["count"] += 1
+        entry["wall_time"] += record.wall_time
+        entry["cpu_time"] += record.cpu_time
+        entry["bytes"] += record.bytes
+        entry["peak_memory"] = max(entry["peak_memory"], record.peak_memory)
+    for entry in summary.values():
+        entry["mb_per_s"] = entry["bytes"] / entry["wall_time"] / 1e6 if entry["wall_time"] > 0 else None
+    return {"spans": [record.to_dict() for record in records], "summary": summary}
+
+
+def finish() -> dict:
+    # zatrzymuje pomiary i zapisuje raport (oraz ewentualny zrzut cProfile)
+    if not _profiler.enabled:
+        return {}
+    if _profiler.cprofile is not None:
+        _profiler.cprofile.disable()
+        _profiler.cprofile.dump_stats(_profiler.cprofile_file_name)
+        _profiler.cprofile = None
+    result = report()
+    with open(_profiler.report_file_name, "w") as file:
+        json.dump(result, file, indent=2)
+    if _profiler.started_tracemalloc:
+        tracemalloc.stop()
+        _profiler.started_tracemalloc = False
+    _profiler.enabled = False
+    return result
@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+
+# Pamięć podręczna LRU ograniczona liczbą wpisów i/lub łącznym rozmiarem wartości (size_of), bezpieczna dla wątków.
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = None, max_bytes: int = None, size_of=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of or (lambda value: 0)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        size = self.size_of(value)
+        with self.lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                return                  # większy niż cała pamięć podręczna - nie jest przechowywany
+            if key in self.entries:
+                self.bytes -= self.size_of(self.entries.pop(key))
+            self.entries[key] = value
+            self.bytes += size
+            while (self.max_entries is not None and len(self.entries) > self.max_entries) or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, removed = self.entries.popitem(last=False)
+                self.bytes -= self.size_of(removed)
+
+    def get_or_compute(self, key, compute):
+        # obliczenie poza blokadą - równoległe żądania o ten sam klucz mogą policzyć wartość dwa razy
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,112 @@
+import io
+import os
+import struct
+
+from utils.wav_chunks import Chunk, ChunkWriter, DS64Chunk, RIFFHeader, padding_chunk_ids
+
+# Zmiana metadanych (LIST, id3) bez przepisywania próbek. Nowa zawartość trafia w miejsce starego chunka,
+# jeśli mieści się w nim razem z sąsiednimi chunkami JUNK/PAD (reszta miejsca staje się chunkiem JUNK);
+# w przeciwnym razie stary chunk zamieniany jest na JUNK, a nowy dopisywany na końcu pliku.
+
+
+def scan_chunks(file) -> list:
+    """
+    :param file: plik otwarty w trybie binarnym
+    :return: lista (identyfikator, pozycja nagłówka, rozmiar) chunków najwyższego poziomu w kolejności z pliku
+    """
+    file_size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    id, _ = Chunk.header_struct.unpack(file.read(8))
+    if id != b"RIFF" and str(id, encoding="utf-8", errors="surrogateescape") not in RIFFHeader.rf64_ids:
+        print("Plik nie jest plikiem RIFF")
+        raise Exception
+    chunks = []
+    ds64 = None
+    offset = 12
+    while offset + 8 <= file_size:
+        file.seek(offset)
+        id, size = Chunk.header_struct.unpack(file.read(8))
+        id = str(id, encoding="utf-8", errors="surrogateescape")
+        if id == "ds64":
+            ds64 = DS64Chunk.Contents.parse(file.read(size))
+        elif size == ChunkWriter.max_size and ds64 is not None:
+            size = ds64.size_of(id, size)
+        chunks.append((id, offset, size))
+        offset += 8 + size + size % 2
+    return chunks
+
+
+def serialize_chunk(chunk, selected=None) -> bytes:
+    buffer = io.BytesIO()
+    writer = ChunkWriter(buffer, selected)
+    chunk.write(writer)
+    writer.close()
+    return buffer.getvalue()
+
+
+def _free_region(chunks: list, index: int) -> (int, int):
+    # początek i koniec obszaru zajmowanego przez chunk wraz z przylegającymi chunkami JUNK/PAD
+    # JUNK bezpośrednio za "WAVE" to miejsce zarezerwowane na ds64 (RF64) - nie jest wykorzystywane
+    first = index
+    while first > 0 and chunks[first - 1][0] in padding_chunk_ids and chunks[first - 1][1] != 12:
+        first -= 1
+    last = index
+    while last + 1 < len(chunks) and chunks[last + 1][0] in padding_chunk_ids:
+        last += 1
+    id, offset, size = chunks[last]
+    return chunks[first][1], offset + 8 + size + size % 2
+
+
+def _write_junk(file, offset: int, length: int) -> None:
+    # chunk JUNK wypełniony zerami - stare metadane nie zostają w pliku
+    file.seek(offset)
+    file.write(ChunkWriter.header_struct.pack(b"JUNK", length - 8))
+    file.write(bytes(length - 8))
+
+
+def write_in_place(path: str, chunks: list, selected=None) -> dict:
+    """
+    :param path: ścieżka modyfikowanego pliku
+    :param chunks: lista (identyfikator, chunk) - chunk None usuwa dany chunk z pliku (zamienia go na JUNK)
+    :param selected: identyfikatory pól do zapisania (jak WavSession.tab), None - wszystkie
+    :return: identyfikator -> "in place", "appended" albo "removed"
+    """
+    result = {}
+    with open(path, "r+b") as file:
+        for id, chunk in chunks:
+            layout = scan_chunks(file)
+            index = next((i for i, entry in enumerate(layout) if entry[0] == id), None)
+            if chunk is None or (selected is not None and id not in selected):
+                if index is not None:
+                    start, end = _free_region(layout, index)
+                    _write_junk(file, start, end - start)
+                    result[id] = "removed"
+                continue
+
+            data = serialize_chunk(chunk, selected)
+            if index is not None:
+                start, end = _free_region(layout, index)
+                space = end - start
+                if len(data) == space or len(data) + 8 <= space:
+                    file.seek(start)
+                    file.write(data)
+                    if space > len(data):
+                        _write_junk(file, start + len(data), space - len(data))
+                    result[id] = "in place"
+                    continue
+                _write_junk(file, start, space)
+            if file.seek(0, os.SEEK_END) % 2:
+                file.write(b"\x00")        # wyrównanie, jeśli ostatni chunk nie miał bajtu dopełnienia
+            file.write(data)
+            result[id] = "appended"
+
+        file_size = file.seek(0, os.SEEK_END)
+        ds64_offset = next((offset for id, offset, _ in scan_chunks(file) if id == "ds64"), None)
+        if ds64_offset is not None:
+            # RF64 - rozmiar pliku w ds64, w nagłówku pozostaje 0xFFFFFFFF
+            file.seek(ds64_offset + 8)
+            file.write(struct.pack("<Q", file_size - 8))
+        else:
+            file.seek(4)
+            file.write(ChunkWriter.size_struct.pack(file_size - 8))
+    return result
@@ -0,0 +1,142 @@
+import os
+import tempfile
+
+import numpy as np
+
+from utils.display_functions import normalize_samples
+from utils.instrumentation import span
+from utils.wav_chunks import DataChunk, WavSession
+
+# Wielopoziomowy podgląd przebiegu: min/max/RMS znormalizowanych próbek każdego kanału w przedziałach
+# po 256, 4096 i 65536 ramek. Liczony jednym przebiegiem po chunku danych i zapisywany obok pliku
+# (<plik>.overview.npz) razem ze ścieżką, rozmiarem i czasem modyfikacji pliku.
+
+default_levels = (256, 4096, 65536)
+sidecar_suffix = ".overview.npz"
+version = 1
+
+
+class Overview:
+    __slots__ = ("sample_rate", "frames", "levels")
+
+    def __init__(self, sample_rate: int, frames: int, levels: dict):
+        self.sample_rate = sample_rate
+        self.frames = frames
+        self.levels = levels            # ramki w przedziale -> (min, max, rms), tablice (kanał, przedział)
+
+    @property
+    def num_channels(self) -> int:
+        return next(iter(self.levels.values()))[0].shape[0]
+
+    def best_level(self, lower: int, upper: int, max_points: int = 4096) -> int:
+        # najdokładniejszy poziom, przy którym wybrany fragment ma najwyżej max_points przedziałów
+        for level in sorted(self.levels):
+            if (upper - lower) / level <= max_points:
+                return level
+        return max(self.levels)
+
+    def select(self, level: int, lower: int, upper: int) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        """
+        :return: oś czasu (środki przedziałów) oraz min, max i RMS przedziałów obejmujących ramki [lower, upper)
+        """
+        first, last = lower // level, -(-upper // level)
+        minimum, maximum, rms = (values[:, first:last] for values in self.levels[level])
+        centers = (np.arange(first, first + minimum.shape[1]) + 0.5) * level
+        time_axis = np.minimum(centers, self.frames) / self.sample_rate
+        return time_axis, minimum, maximum, rms
+
+
+def _reduce(channels: np.ndarray, level: int) -> (np.ndarray, np.ndarray, np.ndarray):
+    full = channels.shape[1] // level * level
+    parts = []
+    if full:
+        buckets = channels[:, :full].reshape(channels.shape[0], -1, level)
+        parts.append((buckets.min(axis=2), buckets.max(axis=2), np.sqrt(np.mean(buckets ** 2, axis=2))))
+    if full < channels.shape[1]:
+        rest = channels[:, full:]
+        parts.append((rest.min(axis=1, keepdims=True), rest.max(axis=1, keepdims=True),
+                      np.sqrt(np.mean(rest ** 2, axis=1, keepdims=True))))
+    return tuple(np.concatenate([part[i] for part in parts], axis=1).astype(np.float32) for i in range(3))
+
+
+def compute_overview(path: str, levels: tuple = default_levels, block_buckets: int = 16) -> Overview:
+    session = WavSession.open(path, decode_samples=False, load_data=False)
+    fmt = session.fmt
+    data_offset, data_size = session.chunk_offsets["data"]
+    # bloki są wielokrotnością największego przedziału, więc niepełny przedział może być tylko na końcu
+    block_frames = max(levels) * block_buckets
+    block_size = block_frames * fmt.data.block_align
+    results = {level: [] for level in levels}
+    frames = 0
+    with span("compute_overview", data_size), open(path, "rb") as file:
+        file.seek(data_offset)
+        remaining = data_size
+        while remaining > 0:
+            raw = file.read(min(block_size, remaining))
+            if not raw:
+                break
+            remaining -= len(raw)
+            channels = normalize_samples(DataChunk.Contents.bytes_to_array(fmt, raw), fmt)
+            if channels.shape[1] == 0:
+                break
+            frames += channels.shape[1]
+            for level in levels:
+                results[level].append(_reduce(channels, level))
+    summaries = {}
+    for level in levels:
+        parts = results[level]
+        if parts:
+            summaries[level] = tuple(np.concatenate([part[i] for part in parts], axis=1) for i in range(3))
+        else:
+            empty = np.zeros((fmt.data.num_channels, 0), dtype=np.float32)
+            summaries[level] = (empty, empty, empty)
+    return Overview(fmt.data.sample_rate, frames, summaries)
+
+
+def _cache_key(path: str) -> np.ndarray:
+    stat = os.stat(path)
+    return np.array([version, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def save_overview(path: str, overview: Overview) -> None:
+    arrays = {"key": _cache_key(path), "path": np.array(os.path.abspath(path)),
+              "info": np.array([overview.sample_rate, overview.frames], dtype=np.int64)}
+    for level, (minimum, maximum, rms) in overview.levels.items():
+        arrays[f"min_{level}"], arrays[f"max_{level}"], arrays[f"rms_{level}"] = minimum, maximum, rms
+    # plik tymczasowy o unikalnej nazwie - procesy liczące ten sam podgląd nie piszą do jednego pliku,
+    # a os.replace podmienia podgląd w całości
+    descriptor, temporary_name = tempfile.mkstemp(prefix=os.path.basename(path) + sidecar_suffix + ".",
+                                                  suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            np.savez(file, **arrays)
+    except BaseException:
+        os.remove(temporary_name)
+        raise
+    os.replace(temporary_name, path + sidecar_suffix)
+
+
+def load_overview(path: str, levels: tuple = default_levels):
+    # None, jeśli podglądu nie ma albo plik zmienił się od jego zapisania
+    try:
+        with np.load(path + sidecar_suffix) as cached:
+            if not np.array_equal(cached["key"], _cache_key(path)) or \
+                    str(cached["path"]) != os.path.abspath(path):
+                return None
+            sample_rate, frames = (int(value) for value in cached["info"])
+            summaries = {level: (cached[f"min_{level}"], cached[f"max_{level}"], cached[f"rms_{level}"])
+                         for level in levels}
+        return Overview(sample_rate, frames, summaries)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def get_overview(path: str, levels: tuple = default_levels) -> Overview:
+    overview = load_overview(path, levels)
+    if overview is None:
+        overview = compute_overview(path, levels)
+        try:
+            save_overview(path, overview)
+        except OSError:
+            pass                        # katalog tylko do odczytu - podgląd zostaje tylko w pamięci
+    return overview
@@ -0,0 +1,199 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import rsa
+
+from utils import rsa_wrapper, rsa_lib_wrapper
+from utils.encryption_utils import RsaData, key_fingerprint
+from utils.instrumentation import span
+from utils.wav_chunks import ChunkWriter, EncryptionChunk, WavSession
+
+# Szyfrowanie ECB chunka danych w potoku: wątek czytający -> pula procesów szyfrujących -> wątek zapisujący.
+# Kolejka między czytaniem a zapisem jest ograniczona (queue_depth), więc w pamięci jest najwyżej
+# queue_depth paczek naraz. Wątek zapisujący odbiera wyniki w kolejności paczek.
+
+
+def _encrypt_batch_custom(batch: bytes, rsa_data: RsaData) -> (bytes, float):
+    start = time.thread_time()
+    encrypted = rsa_wrapper.encrypt_ecb(batch, rsa_data)[0]
+    return encrypted, time.thread_time() - start
+
+
+def _encrypt_batch_library(batch: bytes, public_key: rsa.PublicKey) -> (bytes, float):
+    start = time.thread_time()
+    encrypted = rsa_lib_wrapper.encrypt_ecb(batch, public_key)
+    return encrypted, time.thread_time() - start
+
+
+def _ready() -> bool:
+    return True
+
+
+def _default_executor(workers: int):
+    # przy "spawn" procesy potomne importowałyby ponownie skrypt główny (main.py nie ma "if __name__")
+    if "fork" in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+    return ThreadPoolExecutor(workers)
+
+
+class EncryptionPipeline:
+    def __init__(self, rsa_data: RsaData, library: bool, batch_blocks: int = 64, workers: int = None,
+                 queue_depth: int = None, executor=None):
+        """
+        :param rsa_data: klucz (wystarczy publiczny: n, e)
+        :param library: True - rsa_lib_wrapper, False - rsa_wrapper
+        :param batch_blocks: liczba bloków RSA w jednej paczce
+        :param workers: liczba procesów szyfrujących (domyślnie liczba rdzeni)
+        :param queue_depth: maksymalna liczba paczek w drodze (domyślnie 2 * workers)
+        :param executor: własna pula (concurrent.futures), np. współdzielona między plikami
+        """
+        bit_length = rsa_data.n.bit_length()
+        self.library = library
+        if library:
+            self.plain_block_size = bit_length // 8 - 11
+            self.cipher_block_size = bit_length // 8
+            self.encrypt_batch = _encrypt_batch_library
+            self.key = rsa.PublicKey(rsa_data.n, rsa_data.e)
+        else:
+            self.plain_block_size = bit_length // 8 - 1
+            self.cipher_block_size = bit_length // 8 + 1
+            self.encrypt_batch = _encrypt_batch_custom
+            self.key = RsaData(rsa_data.n, rsa_data.e, 0, 0, 0)
+        self.batch_size = self.plain_block_size * batch_blocks    # wielokrotność bloku - wynik jak encrypt_ecb
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_depth = queue_depth or 2 * self.workers
+        self.executor = executor
+        self.stats = None
+
+    def encrypted_size(self, length: int) -> int:
+        return -(-length // self.plain_block_size) * self.cipher_block_size
+
+    def block_leftover_len(self, length: int):
+        # jak w rsa_wrapper.encrypt_ecb; biblioteka rsa nie potrzebuje tej wartości
+        if self.library:
+            return None
+        return length % self.plain_block_size
+
+    def run(self, source, length: int, write) -> dict:
+        """
+        :param source: obiekt z metodą read(n), ustawiony na początku danych
+        :param length: liczba bajtów do zaszyfrowania
+        :param write: funkcja zapisująca kolejne fragmenty szyfrogramu
+        :return: statystyki etapów (czas pracy, czas oczekiwania, wykorzystanie)
+        """
+        futures = queue.Queue(maxsize=self.queue_depth)
+        stop = threading.Event()
+        errors = []
+        stats = {"reader": {"busy": 0.0, "waiting": 0.0}, "workers": {"busy": 0.0},
+                 "writer": {"busy": 0.0, "waiting": 0.0}, "batches": 0, "bytes": length,
+                 "workers_count": self.workers, "queue_depth": self.queue_depth}
+        executor = self.executor or _default_executor(self.workers)
+        # pierwsze zlecenie tworzy procesy puli (fork) - jeszcze z jednego wątku, przed startem czytania i zapisu
+        executor.submit(_ready).result()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    futures.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get():
+            while not stop.is_set():
+                try:
+                    return futures.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return None
+
+        def reader():
+            try:
+                remaining = length
+                while remaining > 0 and not stop.is_set():
+                    start = time.perf_counter()
+                    batch = source.read(min(self.batch_size, remaining))
+                    stats["reader"]["busy"] += time.perf_counter() - start
+                    if not batch:
+                        print("Nieoczekiwany koniec danych do zaszyfrowania")
+                        raise Exception
+                    remaining -= len(batch)
+                    future = executor.submit(self.encrypt_batch, batch, self.key)
+                    start = time.perf_counter()
+                    if not put(future):
+                        break
+                    stats["reader"]["waiting"] += time.perf_counter() - start
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                put(None)
+
+        def writer():
+            try:
+                while True:
+                    start = time.perf_counter()
+                    future = get()
+                    if future is None:
+                        break
+                    encrypted, busy = future.result()
+                    stats["writer"]["waiting"] += time.perf_counter() - start
+                    stats["workers"]["busy"] += busy
+                    start = time.perf_counter()
+                    write(encrypted)
+                    stats["writer"]["busy"] += time.perf_counter() - start
+                    stats["batches"] += 1
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+        with span("encrypt_pipeline", length):
+            wall_start = time.perf_counter()
+            threads = [threading.Thread(target=reader, name="pipeline-reader"),
+                       threading.Thread(target=writer, name="pipeline-writer")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall_time = time.perf_counter() - wall_start
+            if self.executor is None:
+                executor.shutdown(cancel_futures=True)
+        if errors:
+            raise errors[0]
+
+        stats["wall_time"] = wall_time
+        if wall_time > 0:
+            for name in ("reader", "writer"):
+                stats[name]["utilization"] = stats[name]["busy"] / wall_time
+            stats["workers"]["utilization"] = stats["workers"]["busy"] / (wall_time * self.workers)
+            stats["mb_per_s"] = length / wall_time / 1e6
+        self.stats = stats
+        return stats
+
+    def data_chunk_writer(self, source, length: int):
+        # funkcja dla WavSession.write - zapisuje cały chunk "data" z szyfrogramem
+        def write_data_chunk(writer: ChunkWriter) -> None:
+            writer.begin_chunk("data", self.encrypted_size(length))
+            self.run(source, length, writer.write)
+            writer.end_chunk()
+        return write_data_chunk
+
+
+def encrypt_file(source_path: str, destination_path: str, rsa_data: RsaData, library: bool, **options) -> dict:
+    # szyfruje chunk danych strumieniowo, bez dekodowania próbek; metadane są przepisywane bez zmian
+    session = WavSession.open(source_path, decode_samples=False, load_data=False)
+    for id in session.optional.values():
+        session.select(id)
+    encryption_pipeline = EncryptionPipeline(rsa_data, library, **options)
+    data_offset, length = session.chunk_offsets["data"]
+    session.encryption = EncryptionChunk.create(EncryptionChunk.Contents(
+        "ECB", library, encryption_pipeline.block_leftover_len(length), None, key_fingerprint(rsa_data.n, rsa_data.e)))
+    with open(source_path, "rb") as source, open(destination_path, "wb") as file:
+        source.seek(data_offset)
+        session.write(file, data_writer=encryption_pipeline.data_chunk_writer(source, length))
+    return encryption_pipeline.stats
@@ -0,0 +1,259 @@
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from utils.display_functions import compute_spectra, compute_spectrogram, normalize_samples, phase_spectra
+from utils.instrumentation import span
+from utils.result_cache import ResultCache, data_digest, format_digest, open_cache
+from utils.wav_chunks import DataChunk, WavSession
+
+# Rysowanie bez okien (Agg) do plików PNG/SVG: przebieg, widmo amplitudowe, widmo fazowe i spektrogram,
+# jak w display_functions, dla zadanego zakresu ramek i rozmiaru obrazu. Figury są tworzone bez pyplot
+# i używane ponownie dla kolejnych plików; katalogi renderowane są w puli procesów.
+# Użycie wsadowe: python -m utils.render <katalog> <katalog wynikowy> [--kinds ...] [--formats png svg]
+
+kinds = ("waveform", "amplitude", "phase", "spectrogram")
+titles = {"waveform": "Przebieg wybranego fragmentu sygnału wewnątrz pliku",
+          "amplitude": "Widmo amplitudowe wybranego fragmentu sygnału wewnątrz pliku",
+          "phase": "Widmo fazowe wybranego fragmentu sygnału wewnątrz pliku",
+          "spectrogram": "Spektrogram wybranego fragmentu sygnału wewnątrz pliku"}
+default_size = (1200, 800)
+default_dpi = 100
+
+
+def read_range(path: str, lower: int = None, upper: int = None) -> (np.ndarray, int, int):
+    """
+    :return: znormalizowane próbki (kanał, ramka) z zakresu [lower, upper), częstotliwość próbkowania
+             i numer pierwszej ramki; nieprawidłowy zakres - cały plik, jak w display_functions
+    """
+    session = WavSession.open(path, decode_samples=False, load_data=False)
+    if session.encryption is not None:
+        print(f"Dane pliku {path} są zaszyfrowane")
+        raise Exception
+    fmt = session.fmt
+    data_offset, data_size = session.chunk_offsets["data"]
+    frames = data_size // fmt.data.block_align
+    if lower is None or upper is None or not 0 <= lower < upper <= frames:
+        lower, upper = 0, frames
+    with open(path, "rb") as file:
+        file.seek(data_offset + lower * fmt.data.block_align)
+        raw = file.read((upper - lower) * fmt.data.block_align)
+    channels = normalize_samples(DataChunk.Contents.bytes_to_array(fmt, raw), fmt)
+    return np.asarray(channels, dtype=np.float64), fmt.data.sample_rate, lower
+
+
+class PreviewRenderer:
+    def __init__(self, size: tuple = default_size, dpi: int = default_dpi):
+        """
+        :param size: rozmiar obrazu w pikselach (szerokość, wysokość)
+        :param dpi: rozdzielczość (także dla SVG - wielkość czcionek względem rozmiaru)
+        """
+        self.size = size
+        self.dpi = dpi
+        self.figures = {}               # (rodzaj, liczba kanałów) -> (figura, osie)
+
+    def figure(self, kind: str, num_channels: int) -> (Figure, list):
+        key = (kind, num_channels)
+        if key not in self.figures:
+            figure = Figure(figsize=(self.size[0] / self.dpi, self.size[1] / self.dpi), dpi=self.dpi)
+            FigureCanvasAgg(figure)
+            axes = figure.subplots(num_channels, 1, sharex=False, sharey=True, squeeze=False)[:, 0]
+            self.figures[key] = (figure, list(axes))
+        figure, axes = self.figures[key]
+        for axis in axes:
+            axis.clear()
+        return figure, axes
+
+    def _draw_waveform(self, axis, channel: np.ndarray, first_frame: int, sample_rate: int) -> None:
+        columns = self.size[0]
+        if len(channel) > 4 * columns:
+            # więcej próbek niż pikseli - obwiednia min/max kolumn obrazu
+            bucket = -(-len(channel) // columns)
+            padded = np.pad(channel, (0, -len(channel) % bucket), mode="edge").reshape(-1, bucket)
+            time_axis = (first_frame + (np.arange(len(padded)) + 0.5) * bucket) / sample_rate
+            axis.fill_between(time_axis, padded.min(axis=1), padded.max(axis=1), linewidth=0)
+        else:
+            axis.plot((first_frame + np.arange(len(channel))) / sample_rate, channel)
+        axis.set_ylabel("Znormalizowana amplituda")
+        axis.set_xlabel("Czas [s]")
+
+    @staticmethod
+    def _draw_amplitude(axis, frequencies: np.ndarray, magnitude: np.ndarray) -> None:
+        axis.plot(frequencies, magnitude)
+        axis.set_xscale("symlog")
+        axis.set_ylabel("Amplituda")
+        axis.set_xlabel("Częstotliwość [Hz]")
+
+    @staticmethod
+    def _draw_phase(axis, frequencies: np.ndarray, phase: np.ndarray) -> None:
+        axis.plot(frequencies, phase)
+        axis.set_xscale("symlog")
+        axis.set_ylabel("Przesunięcie fazowe [rad]")
+        axis.set_xlabel("Częstotliwość [Hz]")
+
+    @staticmethod
+    def _draw_spectrogram(axis, times: np.ndarray, frequencies: np.ndarray, power: np.ndarray) -> None:
+        # siatka jako obraz także w SVG (zamiast kształtu na komórkę); osie i opisy pozostają wektorowe
+        with np.errstate(divide="ignore"):
+            axis.pcolormesh(times, frequencies, 10 * np.log10(power), shading="auto", rasterized=True)
+        axis.set_ylim(frequencies[0], frequencies[-1])
+        axis.set_yscale("symlog")
+        axis.set_ylabel("Częstotliwość [Hz]")
+        axis.set_xlabel("Czas [s]")
+
+    def render(self, kind: str, channels: np.ndarray, sample_rate: int, output_paths: list,
+               first_frame: int = 0) -> list:
+        """
+        :param kind: "waveform", "amplitude", "phase" albo "spectrogram"
+        :param channels: znormalizowane próbki (kanał, ramka)
+        :param output_paths: pliki wynikowe - format z rozszerzenia (.png, .svg); wykres rysowany jest raz
+        :param first_frame: numer pierwszej ramki (oś czasu przebiegu)
+        """
+        figure, axes = self.figure(kind, channels.shape[0])
+        if kind in ("amplitude", "phase"):
+            # widma wszystkich kanałów jedną transformatą
+            frequencies, spectra = compute_spectra(channels, sample_rate)
+            values = np.abs(spectra) if kind == "amplitude" else phase_spectra(spectra)
+        elif kind == "spectrogram":
+            # okna wszystkich kanałów jedną transformatą
+            frequencies, times, values = compute_spectrogram(channels, sample_rate)
+        for channel_index, (axis, channel) in enumerate(zip(axes, channels)):
+            if kind == "waveform":
+                self._draw_waveform(axis, channel, first_frame, sample_rate)
+            elif kind == "amplitude":
+                self._draw_amplitude(axis, frequencies, values[channel_index])
+            elif kind == "phase":
+                self._draw_phase(axis, frequencies, values[channel_index])
+            elif kind == "spectrogram":
+                self._draw_spectrogram(axis, times, frequencies, values[channel_index])
+            else:
+                print(f"Nieznany rodzaj wykresu: {kind}")
+                raise Exception
+            if len(channels) > 1:
+                axis.set_title(f"Kanał {channel_index+1}")
+        figure.suptitle(titles[kind])
+        figure.tight_layout()
+        for output_path in output_paths:
+            with span("render " + kind):
+                figure.savefig(output_path)
+        return output_paths
+
+    def render_samples(self, channels: np.ndarray, sample_rate: int, name: str, output_dir: str,
+                       kinds_to_render: tuple = kinds, formats: tuple = ("png",), first_frame: int = 0) -> list:
+        # pliki <katalog>/<nazwa>.<rodzaj>.<format>
+        os.makedirs(output_dir, exist_ok=True)
+        outputs = []
+        for kind in kinds_to_render:
+            outputs += self.render(kind, channels, sample_rate,
+                                   [os.path.join(output_dir, f"{name}.{kind}.{extension}") for extension in formats],
+                                   first_frame)
+        return outputs
+
+    def render_file(self, path: str, output_dir: str, lower: int = None, upper: int = None,
+                    kinds_to_render: tuple = kinds, formats: tuple = ("png",), cache: ResultCache = None) -> list:
+        """
+        :param cache: pamięć podręczna wyników - obrazy plików o niezmienionych danych są kopiowane z niej
+                      bez odczytu próbek i rysowania
+        """
+        name = os.path.splitext(os.path.basename(path))[0]
+        missing = tuple(kinds_to_render)
+        outputs = []
+        if cache is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            digest = data_digest(path)
+            fmt = format_digest(WavSession.open(path, decode_samples=False, load_data=False))
+            keys = {(kind, extension): cache.key(digest, "preview", plot=kind, format=extension, fmt=fmt,
+                                                 lower=lower, upper=upper, size=list(self.size), dpi=self.dpi)
+                    for kind in kinds_to_render for extension in formats}
+            missing = ()
+            for kind in kinds_to_render:
+                paths = [os.path.join(output_dir, f"{name}.{kind}.{extension}") for extension in formats]
+                if all(cache.get_file(keys[(kind, extension)], output_path)
+                       for extension, output_path in zip(formats, paths)):
+                    outputs += paths
+                else:
+                    missing += (kind,)
+        if missing:
+            channels, sample_rate, first_frame = read_range(path, lower, upper)
+            rendered = self.render_samples(channels, sample_rate, name, output_dir, missing, formats, first_frame)
+            if cache is not None:
+                for output_path in rendered:
+                    kind, extension = output_path.rsplit(".", 2)[-2:]
+                    cache.put_file(keys[(kind, extension)], output_path)
+            outputs += rendered
+        return outputs
+
+
+# renderer procesu puli - figury używane ponownie dla wszystkich plików obsłużonych przez ten proces
+_worker_renderer = None
+
+
+_worker_cache = None
+
+
+def _init_worker(size: tuple, dpi: int, cache_dir: str = None) -> None:
+    global _worker_renderer, _worker_cache
+    _worker_renderer = PreviewRenderer(size, dpi)
+    _worker_cache = None if cache_dir is None else open_cache(cache_dir)
+
+
+def _render_or_error(path: str, output_dir: str, lower: int, upper: int, kinds_to_render: tuple,
+                     formats: tuple) -> (str, list, str):
+    # błąd jednego pliku nie przerywa renderowania katalogu
+    try:
+        return path, _worker_renderer.render_file(path, output_dir, lower, upper, kinds_to_render, formats,
+                                                  _worker_cache), None
+    except Exception as e:
+        return path, [], repr(e)
+
+
+def render_directory(directory: str, output_dir: str, pattern: str = "*.wav", recursive: bool = True,
+                     lower: int = None, upper: int = None, kinds_to_render: tuple = kinds,
+                     formats: tuple = ("png",), size: tuple = default_size, dpi: int = default_dpi,
+                     workers: int = None, cache_dir: str = None) -> dict:
+    """
+    :param cache_dir: katalog utils.result_cache - obrazy plików o niezmienionych danych nie są rysowane ponownie
+    :return: ścieżka pliku -> lista zapisanych obrazów albo {"error": ...}
+    """
+    search = os.path.join(directory, "**", pattern) if recursive else os.path.join(directory, pattern)
+    paths = sorted(path for path in glob.glob(search, recursive=recursive) if os.path.isfile(path))
+    # podkatalogi odtwarzane w katalogu wynikowym - pliki o tej samej nazwie nie nadpisują swoich obrazów
+    tasks = [(path, os.path.join(output_dir, os.path.relpath(os.path.dirname(path), directory)), lower, upper,
+              tuple(kinds_to_render), tuple(formats)) for path in paths]
+    if workers == 1:
+        _init_worker(size, dpi, cache_dir)
+        results = [_render_or_error(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(size, dpi, cache_dir)) as executor:
+            results = list(executor.map(_render_or_error, *zip(*tasks),
+                                        chunksize=max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))))
+    return {path: {"error": error} if error else outputs for path, outputs, error in results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Zapis wykresów plików WAV do obrazów PNG/SVG")
+    parser.add_argument("directory")
+    parser.add_argument("output_dir")
+    parser.add_argument("--pattern", default="*.wav")
+    parser.add_argument("--kinds", nargs="+", choices=kinds, default=list(kinds))
+    parser.add_argument("--formats", nargs="+", choices=("png", "svg"), default=["png"])
+    parser.add_argument("--range", nargs=2, type=int, metavar=("LOWER", "UPPER"), default=(None, None))
+    parser.add_argument("--size", nargs=2, type=int, metavar=("WIDTH", "HEIGHT"), default=default_size)
+    parser.add_argument("--dpi", type=int, default=default_dpi)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-dir", default=None, help="katalog pamięci podręcznej wyników")
+    arguments = parser.parse_args()
+
+    results = render_directory(arguments.directory, arguments.output_dir, arguments.pattern,
+                               lower=arguments.range[0], upper=arguments.range[1], kinds_to_render=arguments.kinds,
+                               formats=arguments.formats, size=tuple(arguments.size), dpi=arguments.dpi,
+                               workers=arguments.workers, cache_dir=arguments.cache_dir)
+    failed = {path: result["error"] for path, result in results.items() if isinstance(result, dict)}
+    print(f"Pliki: {len(results)}, błędy: {len(failed)}")
+    for path, error in failed.items():
+        print(f"\t{path}: {error}")
@@ -0,0 +1,231 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from utils.wav_chunks import ChunkWriter, WavSession
+
+# Pamięć podręczna wyników adresowana zawartością: klucz to skrót zawartości chunka danych pliku źródłowego
+# i ustawień, od których zależy wynik (odcisk klucza, ECB/CBC, RSA z biblioteki/własne, format wyjścia...).
+# Niezmienione dane dają ten sam klucz niezależnie od nazwy i czasu modyfikacji pliku.
+# Wyniki (pliki wynikowe, statystyki, widma, podglądy) zapisywane są w katalogu jako osobne pliki;
+# po przekroczeniu max_bytes usuwane są najdawniej używane (czas modyfikacji odświeżany przy każdym trafieniu).
+
+digest_block_size = 1 << 20
+_digest_memo = {}                   # (ścieżka, rozmiar, czas modyfikacji) -> skrót danych - w obrębie procesu
+_digest_lock = threading.Lock()
+_open_caches = {}                   # katalog -> ResultCache - jedna instancja na proces (open_cache)
+
+
+def _hasher():
+    return hashlib.blake2b(digest_size=20)
+
+
+def data_digest(path: str) -> str:
+    """
+    :return: skrót zawartości chunka danych pliku (bez nagłówków i metadanych)
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    memo_key = (path, stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_memo.get(memo_key)
+    if digest is not None:
+        return digest
+    session = WavSession.open(path, decode_samples=False, load_data=False)
+    data_offset, data_size = session.chunk_offsets["data"]
+    hasher = _hasher()
+    with open(path, "rb") as file:
+        file.seek(data_offset)
+        remaining = data_size
+        while remaining > 0:
+            block = file.read(min(digest_block_size, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    digest = hasher.hexdigest()
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+    return digest
+
+
+def session_digest(session: WavSession) -> str:
+    # dane w pamięci (np. odszyfrowane przy odczycie) albo chunk danych pliku źródłowego
+    if session.raw_data is not None:
+        hasher = _hasher()
+        hasher.update(session.raw_data)
+        return hasher.hexdigest()
+    return data_digest(session.source_name)
+
+
+def format_digest(session: WavSession) -> str:
+    # chunk fmt - wyniki liczone z próbek (statystyki, podglądy) zależą od formatu, nie tylko od bajtów danych
+    hasher = _hasher()
+    buffer = io.BytesIO()
+    writer = ChunkWriter(buffer, session.tab)
+    session.fmt.write(writer)
+    writer.close()
+    hasher.update(buffer.getvalue())
+    return hasher.hexdigest()
+
+
+def metadata_digest(session: WavSession, pass_through: bool = False) -> str:
+    # format i wybrane metadane (WavSession.tab) - wchodzą do pliku wynikowego razem z danymi
+    hasher = _hasher()
+    buffer = io.BytesIO()
+    writer = ChunkWriter(buffer, session.tab)
+    session.fmt.write(writer)
+    for chunk in (session.list, session.id3, session.fact, session.cue):
+        if chunk is not None and chunk.id in session.tab:
+            chunk.write(writer)
+    if pass_through:
+        for chunk in session.unrecognized:
+            chunk.write(writer)
+    writer.close()
+    hasher.update(buffer.getvalue())
+    return hasher.hexdigest()
+
+
+def open_cache(directory: str, max_bytes: int = 1 << 30) -> "ResultCache":
+    # wspólna instancja dla wielu wywołań w tym samym procesie (np. w procesach puli) - katalog skanowany raz
+    key = (os.path.abspath(directory), max_bytes)
+    with _digest_lock:
+        cache = _open_caches.get(key)
+        if cache is None:
+            cache = _open_caches[key] = ResultCache(directory, max_bytes)
+    return cache
+
+
+class ResultCache:
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        """
+        :param directory: katalog pamięci podręcznej (może być współdzielony przez procesy)
+        :param max_bytes: łączny limit rozmiaru przechowywanych wyników
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.total = sum(size for _, size, _ in self._scan())
+
+    @staticmethod
+    def key(digest: str, kind: str, **settings) -> str:
+        """
+        :param digest: skrót danych (data_digest/session_digest)
+        :param kind: rodzaj wyniku, np. "encrypted_wav", "statistics"
+        :param settings: ustawienia, od których zależy wynik (wartości serializowalne do JSON)
+        """
+        description = json.dumps({"data": digest, "kind": kind, "settings": settings}, sort_keys=True, default=str)
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, "objects", key[:2], key)
+
+    def _scan(self) -> list:
+        entries = []
+        objects = os.path.join(self.directory, "objects")
+        for prefix in os.scandir(objects):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue            # usunięty w międzyczasie przez inny proces
+                entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def _lookup(self, key: str):
+        path = self._path(key)
+        try:
+            os.utime(path)              # kolejność LRU
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def _store(self, key: str, write) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_name = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_name, "wb") as file:
+            write(file)
+        size = os.path.getsize(temporary_name)
+        if os.path.exists(path):
+            size -= os.path.getsize(path)     # zastąpienie istniejącego wpisu
+        os.replace(temporary_name, path)
+        with self.lock:
+            self.total += size
+            over_limit = self.total > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self) -> None:
+        # stan katalogu odczytywany od nowa - inne procesy mogły w tym czasie dodać lub usunąć wpisy
+        with self.lock:
+            entries = sorted(self._scan(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self.total = total
+
+    def get_file(self, key: str, destination: str) -> bool:
+        path = self._lookup(key)
+        if path is None:
+            return False
+        try:
+            shutil.copyfile(path, destination)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put_file(self, key: str, source: str) -> None:
+        with open(source, "rb") as source_file:
+            self._store(key, lambda file: shutil.copyfileobj(source_file, file, 1 << 20))
+
+    def get_json(self, key: str):
+        path = self._lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_json(self, key: str, value) -> None:
+        self._store(key, lambda file: file.write(json.dumps(value).encode("utf-8")))
+
+    def get_array(self, key: str):
+        path = self._lookup(key)
+        if path is None:
+            return None
+        try:
+            return np.load(path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put_array(self, key: str, array: np.ndarray) -> None:
+        self._store(key, lambda file: np.save(file, array))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self.total, "max_bytes": self.max_bytes}
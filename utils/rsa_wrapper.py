@@ -2,8 +2,9 @@ from utils import RSA
 from utils.encryption_utils import *
 
 
-def new_keys(bit_length: int):
-    public, private, primes = RSA.choose_prime_numbers(bit_length // 2)
+def new_keys(bit_length: int, public_exponent: int = RSA.DEFAULT_PUBLIC_EXPONENT):
+    # public_exponent=None - losowy wykładnik publiczny (wolniejsze szyfrowanie)
+    public, private, primes = RSA.choose_prime_numbers(bit_length // 2, public_exponent)
     e = public[0]
     n = public[1]
     d = private[0]
@@ -0,0 +1,265 @@
+import argparse
+import hmac
+import os
+import secrets
+import socket
+import socketserver
+import tempfile
+import threading
+
+import numpy as np
+
+from utils import encrypted_data, encryption_utils
+from utils.display_functions import compute_spectra, normalize_samples
+from utils.instrumentation import span
+from utils.lru_cache import LRUCache
+from utils.service_client import default_address, default_token_file, parse_address, read_message, write_message
+from utils.wav_chunks import DataChunk, WavSession
+from utils.wav_edit import fmt_fields
+
+# Długo działająca usługa lokalna (gniazdo uniksowe albo TCP na localhost) z ciepłymi pamięciami podręcznymi:
+# klucze RSA, wczytane nagłówki plików (WavSession bez danych) i zdekodowane zakresy próbek w ograniczonych LRU.
+# Wpisy są ważne, dopóki nie zmieni się rozmiar ani czas modyfikacji pliku.
+# Klient wskazuje ścieżki plików i kluczy, więc dostęp ma tylko właściciel usługi: gniazdo uniksowe powstaje
+# z uprawnieniami 0600, a przez TCP każde żądanie musi zawierać token z pliku czytelnego tylko dla właściciela.
+# Uruchomienie: python -m utils.service [--address ścieżka|host:port]; klient: python -m utils.service_client
+
+
+def _fail(message: str):
+    print(message)
+    raise Exception(message)
+
+
+def _file_key(path: str) -> tuple:
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+class WavService:
+    def __init__(self, max_sessions: int = 256, max_keys: int = 16, max_range_bytes: int = 256 << 20):
+        self.sessions = LRUCache(max_entries=max_sessions)
+        self.keys = LRUCache(max_entries=max_keys)
+        self.frame_counts = LRUCache(max_entries=max_sessions)     # liczba ramek odszyfrowanych danych
+        self.ranges = LRUCache(max_bytes=max_range_bytes, size_of=lambda array: array.nbytes)
+        self.commands = {"metadata": self.metadata, "samples": self.samples, "decrypted": self.decrypted,
+                         "spectrum": self.spectrum, "stats": self.stats}
+
+    def session(self, path: str) -> (tuple, WavSession):
+        key = _file_key(path)
+        return key, self.sessions.get_or_compute(
+            key, lambda: WavSession.open(key[0], decode_samples=False, load_data=False))
+
+    def rsa_data(self, key_file: str) -> encryption_utils.RsaData:
+        return self.keys.get_or_compute(_file_key(key_file), lambda: encryption_utils.load_rsa_data(key_file))
+
+    def _frames(self, key: tuple, session: WavSession, key_file: str = None) -> int:
+        # dla danych zaszyfrowanych rozmiar chunka danych to długość szyfrogramu - liczba ramek tekstu jawnego
+        # wymaga klucza (None bez klucza)
+        if session.encryption is None:
+            return session.chunk_offsets["data"][1] // session.fmt.data.block_align
+        if key_file is None:
+            return None
+
+        def count():
+            with open(key[0], "rb") as file:
+                return encrypted_data.decrypted_frames(session, self.rsa_data(key_file), file)
+        return self.frame_counts.get_or_compute((key, _file_key(key_file)), count)
+
+    @staticmethod
+    def _frame_range(frames: int, lower: int, upper: int) -> (int, int):
+        lower = 0 if lower is None else lower
+        upper = frames if upper is None else upper
+        if not 0 <= lower < upper <= frames:
+            _fail(f"Nieprawidłowy zakres ramek {lower}-{upper} (plik ma {frames} ramek)")
+        return lower, upper
+
+    def metadata(self, path: str, key_file: str = None) -> dict:
+        # key_file - klucz prywatny pliku zaszyfrowanego, potrzebny do liczby ramek ("frames": null bez niego)
+        key, session = self.session(path)
+        fmt = session.fmt
+        info = {"path": key[0], "size": key[1], "format": {field: getattr(fmt.data, field) for field in fmt_fields},
+                "frames": self._frames(key, session, key_file),
+                "chunks": {id: list(offset) for id, offset in session.chunk_offsets.items()},
+                "rf64": session.ds64 is not None,
+                "optional": list(session.optional.values()),
+                "unrecognized": [chunk.id for chunk in session.unrecognized]}
+        for name in ("list", "id3", "fact", "cue", "encryption"):
+            chunk = getattr(session, name)
+            info[name] = None if chunk is None else str(chunk)
+        return info
+
+    def samples(self, path: str, lower: int = None, upper: int = None) -> (dict, np.ndarray):
+        key, session = self.session(path)
+        if session.encryption is not None:
+            _fail("Dane pliku są zaszyfrowane - użyj polecenia decrypted")
+        lower, upper = self._frame_range(self._frames(key, session), lower, upper)
+
+        def decode():
+            fmt = session.fmt
+            data_offset = session.chunk_offsets["data"][0]
+            with span("service_samples", (upper - lower) * fmt.data.block_align), open(key[0], "rb") as file:
+                file.seek(data_offset + lower * fmt.data.block_align)
+                raw = file.read((upper - lower) * fmt.data.block_align)
+            return np.asarray(normalize_samples(DataChunk.Contents.bytes_to_array(fmt, raw), fmt), dtype=np.float64)
+        return {"sample_rate": session.fmt.data.sample_rate, "lower": lower, "upper": upper}, \
+            self.ranges.get_or_compute((key, "samples", lower, upper), decode)
+
+    def decrypted(self, path: str, key_file: str, lower: int = None, upper: int = None) -> (dict, np.ndarray):
+        key, session = self.session(path)
+        if session.encryption is None:
+            _fail("Plik nie zawiera chunka z parametrami szyfrowania")
+        lower, upper = self._frame_range(self._frames(key, session, key_file), lower, upper)
+        rsa_data = self.rsa_data(key_file)
+
+        def decrypt():
+            with span("service_decrypt", (upper - lower) * session.fmt.data.block_align), open(key[0], "rb") as file:
+                channels = encrypted_data.decrypt_frame_range(session, rsa_data, lower, upper, file)
+            return np.asarray(normalize_samples(channels, session.fmt), dtype=np.float64)
+        return {"sample_rate": session.fmt.data.sample_rate, "lower": lower, "upper": upper}, \
+            self.ranges.get_or_compute((key, "decrypted", _file_key(key_file), lower, upper), decrypt)
+
+    def spectrum(self, path: str, lower: int = None, upper: int = None, key_file: str = None) -> (dict, np.ndarray):
+        # widmo amplitudowe (kanał, prążek); częstotliwości: scipy.fft.rfftfreq(upper - lower, 1 / sample_rate)
+        if key_file is None:
+            info, samples = self.samples(path, lower, upper)
+        else:
+            info, samples = self.decrypted(path, key_file, lower, upper)
+        key = _file_key(path)
+        key_version = None if key_file is None else _file_key(key_file)
+        spectrum = self.ranges.get_or_compute((key, "spectrum", key_version, info["lower"], info["upper"]),
+                                              lambda: np.abs(compute_spectra(samples, info["sample_rate"])[1]))
+        return info, spectrum
+
+    def stats(self) -> dict:
+        return {"sessions": self.sessions.stats(), "keys": self.keys.stats(), "frame_counts": self.frame_counts.stats(),
+                "ranges": self.ranges.stats()}
+
+    def handle(self, request: dict) -> (object, np.ndarray):
+        command = self.commands.get(request.get("command"))
+        if command is None:
+            _fail(f"Nieznane polecenie: {request.get('command')}")
+        result = command(**request.get("args", {}))
+        if isinstance(result, tuple):
+            return result
+        return result, None
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # jedno połączenie - dowolnie wiele żądań, aż klient je zamknie
+        while True:
+            try:
+                request = read_message(self.rfile)
+            except ValueError:
+                write_message(self.wfile, {"ok": False, "error": "Nieprawidłowe żądanie", "payload": None})
+                return
+            if request is None:
+                return
+            token = self.server.token
+            if token is not None and not hmac.compare_digest(str(request.get("token", "")), token):
+                write_message(self.wfile, {"ok": False, "error": "Nieprawidłowy token", "payload": None})
+                return
+            if request.get("command") == "shutdown":
+                write_message(self.wfile, {"ok": True, "result": None, "payload": None})
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            try:
+                result, array = self.server.service.handle(request)
+            except Exception as e:
+                write_message(self.wfile, {"ok": False, "error": str(e) or repr(e), "payload": None})
+                continue
+            if array is None:
+                write_message(self.wfile, {"ok": True, "result": result, "payload": None})
+            else:
+                array = np.ascontiguousarray(array)
+                write_message(self.wfile, {"ok": True, "result": result, "payload": {
+                    "dtype": array.dtype.str, "shape": list(array.shape), "bytes": array.nbytes}}, array.tobytes())
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    token = None
+    token_file = None
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _write_token(token_file: str, token: str) -> None:
+    # mkstemp tworzy plik z uprawnieniami 0600, os.replace podmienia token po poprzednim procesie w całości
+    descriptor, temporary_name = tempfile.mkstemp(prefix=os.path.basename(token_file) + ".", suffix=".tmp",
+                                                  dir=os.path.dirname(os.path.abspath(token_file)))
+    try:
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            file.write(token)
+    except BaseException:
+        os.remove(temporary_name)
+        raise
+    os.replace(temporary_name, token_file)
+
+
+def create_server(address: str = None, service: WavService = None, token_file: str = None):
+    """
+    :param address: ścieżka gniazda uniksowego albo host:port (tylko localhost)
+    :param token_file: plik, do którego zapisywany jest token usługi TCP (domyślnie default_token_file)
+    """
+    address = parse_address(address or default_address())
+    if isinstance(address, tuple):
+        if address[0] not in ("127.0.0.1", "localhost", "::1"):
+            _fail("Usługa nasłuchuje tylko na localhost")
+        server = _TCPServer(address, _RequestHandler)
+        server.token = secrets.token_hex(32)
+        server.token_file = token_file or default_token_file(server.server_address)
+        try:
+            _write_token(server.token_file, server.token)
+        except BaseException:
+            server.server_close()
+            raise
+    else:
+        if os.path.exists(address):
+            # gniazdo po poprzednim procesie - usuwane tylko wtedy, gdy nikt na nim nie nasłuchuje
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(address)
+                probe.close()
+                _fail(f"Usługa już działa: {address}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(address)
+        # gniazdo od razu z uprawnieniami 0600 - chmod po bind zostawiałby chwilę na połączenia innych
+        previous_umask = os.umask(0o177)
+        try:
+            server = _UnixServer(address, _RequestHandler)
+        finally:
+            os.umask(previous_umask)
+    server.service = service or WavService()
+    return server
+
+
+def serve(address: str = None, service: WavService = None, token_file: str = None) -> None:
+    server = create_server(address, service, token_file)
+    print(f"Usługa nasłuchuje: {server.server_address}")
+    if server.token_file is not None:
+        print(f"Token: {server.token_file}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if server.address_family == socket.AF_UNIX and os.path.exists(server.server_address):
+            os.remove(server.server_address)
+        if server.token_file is not None and os.path.exists(server.token_file):
+            os.remove(server.token_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Usługa wav-reader z pamięciami podręcznymi")
+    parser.add_argument("--address", default=None, help="ścieżka gniazda albo host:port")
+    parser.add_argument("--token-file", default=None, help="plik tokenu usługi TCP")
+    parser.add_argument("--max-sessions", type=int, default=256)
+    parser.add_argument("--max-keys", type=int, default=16)
+    parser.add_argument("--cache-mb", type=int, default=256, help="limit pamięci zakresów próbek i widm")
+    arguments = parser.parse_args()
+    serve(arguments.address, WavService(arguments.max_sessions, arguments.max_keys, arguments.cache_mb << 20),
+          arguments.token_file)
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import shlex
+import socket
+import sys
+import tempfile
+
+# Cienki klient usługi utils.service - nie importuje numpy/scipy/matplotlib, więc uruchamia się szybko.
+# Protokół: żądanie to jedna linia JSON {"command": ..., "args": {...}}; odpowiedź to linia JSON
+# {"ok": ..., "result": ..., "error": ..., "payload": {"dtype", "shape", "bytes"} albo null},
+# po której następuje "bytes" bajtów tablicy (kolejność C). Połączenie obsługuje dowolnie wiele żądań.
+# Przez TCP każde żądanie zawiera też "token" - losowy ciąg, który usługa zapisuje przy starcie do pliku
+# czytelnego tylko dla jej właściciela (gniazdo uniksowe chronią uprawnienia pliku gniazda).
+
+ENV_SOCKET = "WAV_READER_SOCKET"
+ENV_TOKEN_FILE = "WAV_READER_TOKEN_FILE"
+
+
+def default_address() -> str:
+    name = f"wav-reader-{os.getuid()}.sock" if hasattr(os, "getuid") else "wav-reader.sock"
+    return os.environ.get(ENV_SOCKET, os.path.join(tempfile.gettempdir(), name))
+
+
+def default_token_file(address: tuple) -> str:
+    return os.environ.get(ENV_TOKEN_FILE, os.path.join(os.path.expanduser("~"), f".wav-reader-{address[1]}.token"))
+
+
+def parse_address(address: str):
+    # "host:port" - TCP na localhost, w przeciwnym razie ścieżka gniazda uniksowego
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit() and os.sep not in address:
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def read_message(file):
+    line = file.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def write_message(file, message: dict, payload: bytes = b"") -> None:
+    file.write(json.dumps(message).encode("utf-8") + b"\n")
+    if payload:
+        file.write(payload)
+    file.flush()
+
+
+class ServiceClient:
+    def __init__(self, address: str = None, timeout: float = None, token_file: str = None):
+        """
+        :param token_file: plik z tokenem usługi TCP (domyślnie default_token_file)
+        """
+        address = parse_address(address or default_address())
+        self.token = None
+        if isinstance(address, tuple):
+            with open(token_file or default_token_file(address), encoding="utf-8") as file:
+                self.token = file.read().strip()
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+        self.file = self.socket.makefile("rwb")
+
+    def request(self, command: str, **args) -> (object, dict, bytes):
+        """
+        :return: wynik, opis tablicy (dtype, shape) albo None i jej bajty
+        """
+        message = {"command": command, "args": args}
+        if self.token is not None:
+            message["token"] = self.token
+        write_message(self.file, message)
+        response = read_message(self.file)
+        if response is None:
+            print("Usługa zamknęła połączenie")
+            raise Exception
+        payload = b""
+        if response.get("payload"):
+            payload = self.file.read(response["payload"]["bytes"])
+        if not response["ok"]:
+            print(f"Błąd usługi: {response['error']}")
+            raise Exception(response["error"])
+        return response["result"], response.get("payload"), payload
+
+    def array(self, command: str, **args):
+        # wynik wraz z tablicą numpy (numpy importowany dopiero tutaj)
+        import numpy as np
+        result, description, payload = self.request(command, **args)
+        if description is None:
+            return result, None
+        return result, np.frombuffer(payload, dtype=description["dtype"]).reshape(description["shape"])
+
+    def close(self) -> None:
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Klient usługi wav-reader (python -m utils.service)",
+                                     epilog="bez polecenia - kolejne polecenia czytane ze standardowego wejścia "
+                                            "i wysyłane jednym połączeniem")
+    parser.add_argument("--address", default=None, help="ścieżka gniazda albo host:port")
+    parser.add_argument("--token-file", default=None, help="plik z tokenem usługi TCP")
+    commands = parser.add_subparsers(dest="command")
+    metadata = commands.add_parser("metadata")
+    metadata.add_argument("path")
+    metadata.add_argument("--key", dest="key_file", help="klucz pliku zaszyfrowanego - liczba ramek danych")
+    for name in ("samples", "decrypted", "spectrum"):
+        command = commands.add_parser(name)
+        command.add_argument("path")
+        command.add_argument("lower", type=int, nargs="?")
+        command.add_argument("upper", type=int, nargs="?")
+        command.add_argument("--key", dest="key_file", required=name == "decrypted")
+        command.add_argument("--output", help="zapis bajtów tablicy do pliku")
+    commands.add_parser("stats")
+    commands.add_parser("shutdown")
+    return parser
+
+
+def _run(client: ServiceClient, arguments: argparse.Namespace) -> None:
+    args = {key: value for key, value in vars(arguments).items()
+            if key not in ("command", "address", "token_file", "output") and value is not None}
+    # usługa może mieć inny katalog roboczy
+    for key in ("path", "key_file"):
+        if key in args:
+            args[key] = os.path.abspath(args[key])
+    result, description, payload = client.request(arguments.command, **args)
+    if description is not None:
+        output = getattr(arguments, "output", None)
+        if output:
+            with open(output, "wb") as file:
+                file.write(payload)
+        result = {"result": result, "array": description, "output": output}
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+def main(argv: list = None) -> None:
+    parser = _build_parser()
+    arguments = parser.parse_args(argv)
+    with ServiceClient(arguments.address, token_file=arguments.token_file) as client:
+        if arguments.command is not None:
+            _run(client, arguments)
+            return
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            try:
+                _run(client, parser.parse_args(shlex.split(line)))
+            except (Exception, SystemExit):
+                pass                    # komunikat został już wypisany, kolejne polecenia korzystają z połączenia
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import scipy.fft
+from matplotlib import mlab
+
+from utils.display_functions import normalize_samples, phase_spectra
+from utils.instrumentation import span
+from utils.wav_chunks import DataChunk, FmtChunk, WavSession
+
+# Znormalizowane próbki (tablica float64 (kanał, ramka)) umieszczane raz w multiprocessing.shared_memory.
+# Procesy puli SharedAnalysis dołączają do bufora przy starcie i widzą go jako tablicę numpy bez kopiowania;
+# do zadań przekazywane są tylko zakresy ramek, a z powrotem wracają wyniki obliczeń.
+
+
+class SharedSamples:
+    def __init__(self, memory: shared_memory.SharedMemory, shape: tuple, dtype: str, owner: bool):
+        self.memory = memory
+        self.shape = shape
+        self.dtype = dtype
+        self.owner = owner              # właściciel usuwa blok pamięci przy zamknięciu
+        self.array = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+    @staticmethod
+    def create(shape: tuple, dtype: str = "float64") -> "SharedSamples":
+        size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        return SharedSamples(shared_memory.SharedMemory(create=True, size=size), tuple(shape), dtype, True)
+
+    @staticmethod
+    def from_array(array: np.ndarray) -> "SharedSamples":
+        samples = SharedSamples.create(array.shape, str(array.dtype))
+        samples.array[...] = array
+        return samples
+
+    @staticmethod
+    def from_data_chunk(dataChunk: DataChunk, fmtChunk: FmtChunk) -> "SharedSamples":
+        return SharedSamples.from_array(np.asarray(normalize_samples(dataChunk.data.samples, fmtChunk),
+                                                   dtype=np.float64))
+
+    @staticmethod
+    def from_file(path: str, block_frames: int = 1 << 16) -> ("SharedSamples", FmtChunk):
+        # dekodowanie blokami prosto do pamięci współdzielonej, bez pełnej kopii pośredniej
+        session = WavSession.open(path, decode_samples=False, load_data=False)
+        fmt = session.fmt
+        data_offset, data_size = session.chunk_offsets["data"]
+        if fmt.data.audio_format not in (1, 3, 6, 7) or fmt.data.bits_per_sample % 8:
+            session = WavSession.open(path)
+            return SharedSamples.from_data_chunk(session.data, fmt), fmt
+
+        frames = data_size // fmt.data.block_align
+        samples = SharedSamples.create((fmt.data.num_channels, frames))
+        block_size = block_frames * fmt.data.block_align
+        with span("shared_samples_decode", data_size), open(path, "rb") as file:
+            file.seek(data_offset)
+            position = 0
+            while position < frames:
+                raw = file.read(min(block_size, (frames - position) * fmt.data.block_align))
+                channels = normalize_samples(DataChunk.Contents.bytes_to_array(fmt, raw), fmt)
+                if channels.shape[1] == 0:
+                    break
+                samples.array[:, position:position + channels.shape[1]] = channels
+                position += channels.shape[1]
+        if position < frames:
+            print("Plik jest krótszy niż zapisany w nim rozmiar chunka danych")
+            samples.close()
+            raise Exception
+        return samples, fmt
+
+    @property
+    def descriptor(self) -> tuple:
+        # wystarcza do dołączenia do bufora w innym procesie
+        return self.memory.name, self.shape, self.dtype
+
+    @staticmethod
+    def attach(descriptor: tuple) -> "SharedSamples":
+        name, shape, dtype = descriptor
+        return SharedSamples(shared_memory.SharedMemory(name=name), shape, dtype, False)
+
+    def close(self) -> None:
+        if self.memory is None:
+            return
+        self.array = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# bufor dołączony w procesie puli (initializer)
+_worker_samples = None
+
+
+def _attach_worker(descriptor: tuple) -> None:
+    global _worker_samples
+    _worker_samples = SharedSamples.attach(descriptor)
+
+
+def _run_task(function, args: tuple):
+    return function(_worker_samples.array, *args)
+
+
+def _spectrum_task(samples: np.ndarray, channel: int, lower: int, upper: int) -> np.ndarray:
+    return scipy.fft.rfft(samples[channel, lower:upper])
+
+
+def _envelope_task(samples: np.ndarray, channel: int, lower: int, upper: int, bucket: int) -> (np.ndarray, np.ndarray):
+    segment = samples[channel, lower:upper]
+    full = len(segment) // bucket * bucket
+    minimum = segment[:full].reshape(-1, bucket).min(axis=1)
+    maximum = segment[:full].reshape(-1, bucket).max(axis=1)
+    if full < len(segment):
+        minimum = np.append(minimum, segment[full:].min())
+        maximum = np.append(maximum, segment[full:].max())
+    return minimum, maximum
+
+
+def _spectrogram_task(samples: np.ndarray, channel: int, lower: int, upper: int, nfft: int, noverlap: int,
+                      sample_rate: int) -> (np.ndarray, np.ndarray, np.ndarray):
+    return mlab.specgram(samples[channel, lower:upper], NFFT=nfft, Fs=sample_rate, noverlap=noverlap)
+
+
+class SharedAnalysis:
+    def __init__(self, samples: SharedSamples, sample_rate: int, workers: int = None):
+        """
+        :param samples: bufor znormalizowanych próbek (kanał, ramka)
+        :param sample_rate: częstotliwość próbkowania
+        :param workers: liczba procesów (domyślnie liczba rdzeni)
+        """
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.workers = workers or os.cpu_count() or 1
+        # "fork" jak w utils.pipeline - main.py nie ma "if __name__"
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_attach_worker,
+                                            initargs=(samples.descriptor,))
+
+    @property
+    def num_channels(self) -> int:
+        return self.samples.shape[0]
+
+    def _range(self, lower: int, upper: int) -> (int, int):
+        # nieprawidłowy zakres - cały sygnał, jak w display_functions
+        frames = self.samples.shape[1]
+        if lower is None or upper is None or not 0 <= lower < upper <= frames:
+            return 0, frames
+        return lower, upper
+
+    def submit(self, function, *args):
+        """
+        :param function: funkcja najwyższego poziomu modułu, wywoływana w procesie puli jako
+                         function(próbki, *args), gdzie próbki to tablica (kanał, ramka) w pamięci współdzielonej
+        :return: concurrent.futures.Future
+        """
+        return self.executor.submit(_run_task, function, args)
+
+    def map_windows(self, function, lower: int, upper: int, window: int, *args) -> list:
+        # function(próbki, kanał, początek, koniec, *args) dla każdego kanału i kolejnych fragmentów po window ramek
+        futures = [[self.submit(function, channel, start, min(start + window, upper), *args)
+                    for start in range(lower, upper, window)] for channel in range(self.num_channels)]
+        return [[future.result() for future in channel] for channel in futures]
+
+    def amplitude_spectrum(self, lower: int = None, upper: int = None) -> (np.ndarray, list):
+        lower, upper = self._range(lower, upper)
+        spectra = [self.submit(_spectrum_task, channel, lower, upper) for channel in range(self.num_channels)]
+        frequencies = scipy.fft.rfftfreq(upper - lower, 1 / self.sample_rate)
+        return frequencies, [np.abs(future.result()) for future in spectra]
+
+    def phase_spectrum(self, lower: int = None, upper: int = None) -> (np.ndarray, list):
+        # składowe o amplitudzie poniżej 1% maksimum są zerowane, jak w display_phase_spectrum
+        lower, upper = self._range(lower, upper)
+        spectra = [self.submit(_spectrum_task, channel, lower, upper) for channel in range(self.num_channels)]
+        frequencies = scipy.fft.rfftfreq(upper - lower, 1 / self.sample_rate)
+        return frequencies, [phase_spectra(future.result()) for future in spectra]
+
+    def waveform_envelope(self, lower: int = None, upper: int = None, bucket: int = 256,
+                          window: int = 1 << 20) -> list:
+        # (min, max) przedziałów po bucket ramek dla każdego kanału
+        lower, upper = self._range(lower, upper)
+        window = max(window // bucket, 1) * bucket
+        results = self.map_windows(_envelope_task, lower, upper, window, bucket)
+        return [(np.concatenate([part[0] for part in channel]), np.concatenate([part[1] for part in channel]))
+                for channel in results]
+
+    def spectrogram(self, lower: int = None, upper: int = None, nfft: int = 256, noverlap: int = 128,
+                    windows_per_task: int = 1024) -> (np.ndarray, np.ndarray, list):
+        """
+        :return: częstotliwości, czasy środków okien i gęstość widmowa mocy (częstotliwość, okno) każdego kanału,
+                 jak matplotlib.mlab.specgram dla całego fragmentu
+        """
+        lower, upper = self._range(lower, upper)
+        step = nfft - noverlap
+        count = (upper - lower - noverlap) // step
+        if count < 1:
+            print("Fragment jest krótszy niż jedno okno spektrogramu")
+            raise Exception
+        # fragmenty zadań zawierają całe okna, więc wynik nie zależy od podziału
+        tasks = [(lower + first * step, lower + min(first + windows_per_task, count) * step + noverlap)
+                 for first in range(0, count, windows_per_task)]
+        futures = [[self.submit(_spectrogram_task, channel, start, end, nfft, noverlap, self.sample_rate)
+                    for start, end in tasks] for channel in range(self.num_channels)]
+        spectra = [np.concatenate([future.result()[0] for future in channel], axis=1) for channel in futures]
+        frequencies = futures[0][0].result()[1]
+        times = (np.arange(count) * step + nfft / 2) / self.sample_rate
+        return frequencies, times, spectra
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,226 @@
+import argparse
+import audioop
+import csv
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.display_functions import normalize_samples
+from utils.instrumentation import span
+from utils.result_cache import data_digest, format_digest, open_cache
+from utils.wav_chunks import DataChunk, FmtChunk, WavSession
+
+# Statystyki sygnału do kontroli jakości archiwum: szczyt, RMS, składowa stała, liczba próbek przesterowanych,
+# udział ciszy i korelacja między kanałami. Liczone jednym przebiegiem po blokach ramek chunka danych
+# na próbkach znormalizowanych tak jak w normalize_samples.
+# Użycie wsadowe: python -m utils.signal_statistics <katalog> [--csv plik] [--json plik] [--workers n]
+
+default_block_frames = 1 << 16
+default_silence_threshold_db = -60.0
+csv_fields = ("path", "channel", "frames", "duration", "peak", "peak_dbfs", "rms", "rms_dbfs", "dc_offset",
+              "clipped", "silence_ratio", "correlation")
+
+
+def to_dbfs(value: float) -> float:
+    # kanał cichy (wartość 0) nie ma poziomu w dBFS - None, w JSON null, w CSV puste pole
+    return float(20 * np.log10(value)) if value > 0 else None
+
+
+def clip_limits(fmtChunk: FmtChunk) -> (float, float):
+    """
+    :return: najmniejsza i największa znormalizowana wartość, jaką da się zapisać w danym formacie -
+             próbki równe tym wartościom (lub poza nimi) są liczone jako przesterowane
+    """
+    bits = fmtChunk.data.bits_per_sample
+    audio_format = fmtChunk.data.audio_format
+    if audio_format == 1:
+        if bits <= 8:
+            raw = np.array([[0, 2 ** bits - 1]])
+        else:
+            raw = np.array([[-2 ** (bits - 1), 2 ** (bits - 1) - 1]])
+    elif audio_format in (6, 7):
+        decode = audioop.alaw2lin if audio_format == 6 else audioop.ulaw2lin
+        sample_len = max(bits // 8, 1)
+        decoded = np.frombuffer(decode(bytes(range(256)), sample_len), dtype=f"<i{sample_len}")
+        raw = np.array([[decoded.min(), decoded.max()]])
+    else:
+        return -1.0, 1.0
+    low, high = normalize_samples(raw, fmtChunk)[0]
+    return float(low), float(high)
+
+
+class SignalStatistics:
+    # sumy potrzebne do wyniku - uzupełniane blok po bloku metodą update
+
+    def __init__(self, num_channels: int, clip_low: float, clip_high: float, silence_threshold: float):
+        self.frames = 0
+        self.peak = np.zeros(num_channels)
+        self.sum = np.zeros(num_channels)
+        self.products = np.zeros((num_channels, num_channels))    # suma x_i * x_j - RMS i korelacja
+        self.clipped = np.zeros(num_channels, dtype=np.int64)
+        self.silent_frames = 0
+        self.clip_low = clip_low
+        self.clip_high = clip_high
+        self.silence_threshold = silence_threshold
+
+    def update(self, channels: np.ndarray) -> None:
+        channels = np.asarray(channels, dtype=np.float64)
+        if channels.shape[1] == 0:
+            return
+        magnitude = np.abs(channels)
+        self.frames += channels.shape[1]
+        np.maximum(self.peak, magnitude.max(axis=1), out=self.peak)
+        self.sum += channels.sum(axis=1)
+        self.products += channels @ channels.T
+        self.clipped += np.count_nonzero((channels <= self.clip_low) | (channels >= self.clip_high), axis=1)
+        # ramka jest cicha, jeśli wszystkie kanały są poniżej progu
+        self.silent_frames += int(np.count_nonzero(magnitude.max(axis=0) < self.silence_threshold))
+
+    def result(self) -> dict:
+        frames = max(self.frames, 1)
+        mean = self.sum / frames
+        power = np.diag(self.products) / frames
+        rms = np.sqrt(power)
+        covariance = self.products / frames - np.outer(mean, mean)
+        deviation = np.sqrt(np.maximum(np.diag(covariance), 0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = covariance / np.outer(deviation, deviation)
+        # kanał stały nie ma określonej korelacji - NaN zamieniane na 0 (na przekątnej 1)
+        correlation = np.nan_to_num(correlation, nan=0.0, posinf=0.0, neginf=0.0)
+        np.fill_diagonal(correlation, 1.0)
+        return {"frames": self.frames,
+                "peak": self.peak.tolist(), "peak_dbfs": [to_dbfs(value) for value in self.peak],
+                "rms": rms.tolist(), "rms_dbfs": [to_dbfs(value) for value in rms],
+                "dc_offset": mean.tolist(), "clipped": self.clipped.tolist(),
+                "silence_ratio": self.silent_frames / frames if self.frames else 0.0,
+                "correlation": np.clip(correlation, -1.0, 1.0).tolist()}
+
+
+def analyze_file(path: str, block_frames: int = default_block_frames,
+                 silence_threshold_db: float = default_silence_threshold_db) -> dict:
+    """
+    :param path: ścieżka pliku WAV (niezaszyfrowanego)
+    :param block_frames: liczba ramek czytanych naraz
+    :param silence_threshold_db: próg ciszy w dBFS
+    :return: statystyki pliku, wartości kanałów w listach
+    """
+    session = WavSession.open(path, decode_samples=False, load_data=False)
+    if session.encryption is not None:
+        print(f"Dane pliku {path} są zaszyfrowane")
+        raise Exception
+    fmt = session.fmt
+    data_offset, data_size = session.chunk_offsets["data"]
+    statistics = SignalStatistics(fmt.data.num_channels, *clip_limits(fmt), 10 ** (silence_threshold_db / 20))
+    block_size = block_frames * fmt.data.block_align
+    with span("signal_statistics", data_size), open(path, "rb") as file:
+        file.seek(data_offset)
+        remaining = data_size
+        while remaining > 0:
+            raw = file.read(min(block_size, remaining))
+            if not raw:
+                break
+            remaining -= len(raw)
+            statistics.update(normalize_samples(DataChunk.Contents.bytes_to_array(fmt, raw), fmt))
+    result = {"path": path, "sample_rate": fmt.data.sample_rate, "channels": fmt.data.num_channels}
+    result.update(statistics.result())
+    result["duration"] = result["frames"] / fmt.data.sample_rate if fmt.data.sample_rate else 0.0
+    return result
+
+
+def analyze_file_cached(path: str, cache_dir: str, block_frames: int = default_block_frames,
+                        silence_threshold_db: float = default_silence_threshold_db) -> dict:
+    # wynik z utils.result_cache, jeśli dane pliku w tym samym formacie były już analizowane z tym progiem ciszy
+    cache = open_cache(cache_dir)
+    session = WavSession.open(path, decode_samples=False, load_data=False)
+    key = cache.key(data_digest(path), "statistics", fmt=format_digest(session),
+                    silence_threshold_db=silence_threshold_db)
+    result = cache.get_json(key)
+    if result is None:
+        result = analyze_file(path, block_frames, silence_threshold_db)
+        cache.put_json(key, result)
+    result["path"] = path
+    return result
+
+
+def _analyze_or_error(path: str, block_frames: int, silence_threshold_db: float, cache_dir: str = None) -> dict:
+    # błąd jednego pliku nie przerywa analizy całego katalogu
+    try:
+        if cache_dir is not None:
+            return analyze_file_cached(path, cache_dir, block_frames, silence_threshold_db)
+        return analyze_file(path, block_frames, silence_threshold_db)
+    except Exception as e:
+        return {"path": path, "error": repr(e)}
+
+
+def analyze_directory(directory: str, pattern: str = "*.wav", recursive: bool = True, workers: int = None,
+                      block_frames: int = default_block_frames,
+                      silence_threshold_db: float = default_silence_threshold_db, cache_dir: str = None) -> list:
+    """
+    :param directory: katalog z plikami
+    :param pattern: wzorzec nazw plików
+    :param recursive: czy przeszukiwać podkatalogi
+    :param workers: liczba procesów (domyślnie liczba rdzeni), 1 - bez puli procesów
+    :param cache_dir: katalog utils.result_cache - pliki o niezmienionych danych nie są analizowane ponownie
+    :return: wyniki analyze_file w kolejności ścieżek; pliki, których nie udało się przeanalizować, mają pole "error"
+    """
+    search = os.path.join(directory, "**", pattern) if recursive else os.path.join(directory, pattern)
+    paths = sorted(path for path in glob.glob(search, recursive=recursive) if os.path.isfile(path))
+    options = (block_frames, silence_threshold_db, cache_dir)
+    if workers == 1 or len(paths) <= 1:
+        return [_analyze_or_error(path, *options) for path in paths]
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_analyze_or_error, path, *options) for path in paths]
+        return [future.result() for future in futures]
+
+
+def csv_rows(results: list) -> list:
+    # jeden wiersz na kanał; korelacja z kolejnymi kanałami oddzielona średnikami
+    rows = []
+    for result in results:
+        if "error" in result:
+            rows.append({"path": result["path"], "channel": "error: " + result["error"]})
+            continue
+        for channel in range(result["channels"]):
+            row = {"path": result["path"], "channel": channel + 1, "frames": result["frames"],
+                   "duration": result["duration"], "silence_ratio": result["silence_ratio"],
+                   "correlation": ";".join(f"{value:.6f}" for value in result["correlation"][channel])}
+            for field in ("peak", "peak_dbfs", "rms", "rms_dbfs", "dc_offset", "clipped"):
+                row[field] = result[field][channel]
+            rows.append(row)
+    return rows
+
+
+def write_csv(results: list, file_name: str) -> None:
+    with open(file_name, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=csv_fields)
+        writer.writeheader()
+        writer.writerows(csv_rows(results))
+
+
+def write_json(results: list, file_name: str) -> None:
+    with open(file_name, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2, allow_nan=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Statystyki sygnału plików WAV w katalogu")
+    parser.add_argument("directory")
+    parser.add_argument("--pattern", default="*.wav")
+    parser.add_argument("--csv", dest="csv_file")
+    parser.add_argument("--json", dest="json_file")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--silence-threshold", type=float, default=default_silence_threshold_db)
+    parser.add_argument("--cache-dir", default=None, help="katalog pamięci podręcznej wyników")
+    arguments = parser.parse_args()
+
+    results = analyze_directory(arguments.directory, arguments.pattern, workers=arguments.workers,
+                                silence_threshold_db=arguments.silence_threshold, cache_dir=arguments.cache_dir)
+    if arguments.csv_file:
+        write_csv(results, arguments.csv_file)
+    if arguments.json_file:
+        write_json(results, arguments.json_file)
+    if not arguments.csv_file and not arguments.json_file:
+        print(json.dumps(results, indent=2, allow_nan=False))
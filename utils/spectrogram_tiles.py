@@ -0,0 +1,171 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import scipy.fft
+import scipy.signal
+
+from utils import display_functions
+from utils.display_functions import normalize_samples
+from utils.instrumentation import span
+from utils.lru_cache import LRUCache
+from utils.wav_chunks import DataChunk, WavSession
+
+# Piramida kafelków spektrogramu do przybliżania i przesuwania widoku bez liczenia STFT od nowa.
+# Poziom L ma okno nfft * 2^L (do max_nfft) i krok hop * 4^L; kafelek to tile_columns kolejnych kolumn STFT
+# (amplituda w dB, float32, (kanał, prążek, kolumna)). Kolumna, której krok jest dłuższy niż pół okna,
+# to maksimum amplitud okien przesuniętych o pół okna w całym kroku (jak min/max w utils.overview) -
+# krótkie zdarzenia między początkami kolumn nie znikają na grubszych poziomach. Kafelki liczone są
+# przy pierwszym użyciu z samych potrzebnych ramek pliku i trzymane w LRU w pamięci oraz opcjonalnie
+# w katalogu na dysku.
+
+default_nfft = 512
+default_max_nfft = 8192
+default_levels = 6
+time_factor = 4                     # krotność kroku STFT między kolejnymi poziomami
+tile_columns = 256
+floor_db = -160.0
+block_frames = 1 << 20              # ramki czytane naraz przy liczeniu kafelka
+tile_version = 2                    # zmiana sposobu liczenia kafelków - kafelki na dysku liczone są od nowa
+
+
+class SpectrogramPyramid:
+    def __init__(self, path: str, nfft: int = default_nfft, levels: int = default_levels,
+                 max_nfft: int = default_max_nfft, cache_bytes: int = 256 << 20, cache_dir: str = None):
+        """
+        :param path: plik WAV (niezaszyfrowany)
+        :param nfft: długość okna na najdokładniejszym poziomie (krok nfft // 2)
+        :param levels: liczba poziomów
+        :param cache_bytes: limit pamięci kafelków
+        :param cache_dir: katalog kafelków na dysku, None - tylko w pamięci
+        """
+        self.path = os.path.abspath(path)
+        session = WavSession.open(path, decode_samples=False, load_data=False)
+        if session.encryption is not None:
+            print("Dane pliku są zaszyfrowane")
+            raise Exception
+        self.fmt = session.fmt
+        self.data_offset, data_size = session.chunk_offsets["data"]
+        self.frames = data_size // self.fmt.data.block_align
+        self.sample_rate = self.fmt.data.sample_rate
+        self.levels = [(min(nfft << level, max_nfft), (nfft // 2) * time_factor ** level) for level in range(levels)]
+        self.tiles = LRUCache(max_bytes=cache_bytes, size_of=lambda tile: tile.nbytes)
+        self.cache_dir = None
+        if cache_dir is not None:
+            # kafelki są ważne tylko dla tej wersji pliku i tych parametrów
+            stat = os.stat(self.path)
+            key = repr((self.path, stat.st_size, stat.st_mtime_ns, nfft, levels, max_nfft, time_factor, tile_columns,
+                        tile_version))
+            self.cache_dir = os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def columns(self, level: int) -> int:
+        nfft, hop = self.levels[level]
+        return max(0, (self.frames - nfft) // hop + 1) if self.frames >= nfft else 1
+
+    def frequencies(self, level: int) -> np.ndarray:
+        return scipy.fft.rfftfreq(self.levels[level][0], 1 / self.sample_rate)
+
+    def window_starts(self, level: int) -> np.ndarray:
+        # początki okien składających się na kolumnę, względem początku kolumny
+        nfft, hop = self.levels[level]
+        step = max(nfft // 2, 1)
+        return np.arange(max(hop // step, 1)) * step
+
+    def column_times(self, level: int, first: int, last: int) -> np.ndarray:
+        # środki fragmentów objętych oknami kolumn [first, last)
+        nfft, hop = self.levels[level]
+        return (np.arange(first, last) * hop + (self.window_starts(level)[-1] + nfft) / 2) / self.sample_rate
+
+    def _read_frames(self, file, start: int, count: int) -> np.ndarray:
+        block_align = self.fmt.data.block_align
+        count = max(0, min(count, self.frames - start))
+        file.seek(self.data_offset + start * block_align)
+        raw = file.read(count * block_align)
+        return np.asarray(normalize_samples(DataChunk.Contents.bytes_to_array(self.fmt, raw), self.fmt),
+                          dtype=np.float64)
+
+    def _compute_tile(self, level: int, index: int) -> np.ndarray:
+        nfft, hop = self.levels[level]
+        starts = self.window_starts(level)
+        first = index * tile_columns
+        count = min(tile_columns, self.columns(level) - first)
+        channels = self.fmt.data.num_channels
+        window = scipy.signal.get_window("hann", nfft)
+        spectra = np.zeros((channels, count, nfft // 2 + 1))
+        batch = max(1, block_frames // hop)
+        with span("spectrogram_tile", count * hop * self.fmt.data.block_align), open(self.path, "rb") as file:
+            for column in range(0, count, batch):
+                columns = min(batch, count - column)
+                # okna wszystkich kolumn partii: (kanał, kolumna * okno w kolumnie, ramka okna)
+                offsets = (np.arange(columns)[:, None] * hop + starts).ravel()
+                span_frames = offsets[-1] + nfft
+                samples = self._read_frames(file, (first + column) * hop, span_frames)
+                padded = np.zeros((channels, span_frames))
+                padded[:, :samples.shape[1]] = samples
+                windows = np.lib.stride_tricks.sliding_window_view(padded, nfft, axis=1)[:, offsets]
+                amplitude = np.abs(scipy.fft.rfft(windows * window, axis=-1,
+                                                  workers=display_functions.fft_workers)) / window.sum()
+                spectra[:, column:column + columns] = amplitude.reshape(channels, columns, len(starts), -1).max(axis=2)
+        with np.errstate(divide="ignore"):
+            magnitude = 20 * np.log10(spectra)
+        # (kanał, prążek, kolumna)
+        return np.maximum(magnitude, floor_db).astype(np.float32).transpose(0, 2, 1)
+
+    def tile(self, level: int, index: int) -> np.ndarray:
+        key = (level, index)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            return tile
+        file_name = None if self.cache_dir is None else os.path.join(self.cache_dir, f"{level}_{index}.npy")
+        if file_name is not None and os.path.exists(file_name):
+            try:
+                tile = np.load(file_name)
+            except (OSError, ValueError):
+                tile = None
+        if tile is None:
+            tile = self._compute_tile(level, index)
+            if file_name is not None:
+                # plik tymczasowy o unikalnej nazwie - równoległe procesy liczące ten sam kafelek nie piszą
+                # do jednego pliku, a os.replace podmienia kafelek w całości
+                descriptor, temporary_name = tempfile.mkstemp(prefix=os.path.basename(file_name) + ".",
+                                                              suffix=".tmp", dir=self.cache_dir)
+                try:
+                    with os.fdopen(descriptor, "wb") as file:
+                        np.save(file, tile)
+                except BaseException:
+                    os.remove(temporary_name)
+                    raise
+                os.replace(temporary_name, file_name)
+        self.tiles.put(key, tile)
+        return tile
+
+    def best_level(self, lower: int, upper: int, max_columns: int = 1024) -> int:
+        # najdokładniejszy poziom, na którym fragment ma najwyżej max_columns kolumn
+        for level, (nfft, hop) in enumerate(self.levels):
+            if (upper - lower) / hop <= max_columns:
+                return level
+        return len(self.levels) - 1
+
+    def view(self, lower: int = None, upper: int = None, max_columns: int = 1024,
+             level: int = None) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        :param lower: pierwsza ramka widoku
+        :param upper: ramka za ostatnią; nieprawidłowy zakres - cały plik
+        :param max_columns: największa liczba kolumn widoku (wybór poziomu, jeśli level nie jest podany)
+        :return: czasy środków kolumn, częstotliwości i amplituda w dB (kanał, prążek, kolumna)
+        """
+        if lower is None or upper is None or not 0 <= lower < upper <= self.frames:
+            lower, upper = 0, self.frames
+        if level is None:
+            level = self.best_level(lower, upper, max_columns)
+        nfft, hop = self.levels[level]
+        columns = self.columns(level)
+        # kolumny, których okno zaczyna się w wybranym fragmencie
+        first = min(lower // hop, columns - 1)
+        last = min(max(first + 1, -(-upper // hop)), columns)
+        tiles = [self.tile(level, index) for index in range(first // tile_columns, (last - 1) // tile_columns + 1)]
+        offset = first - first // tile_columns * tile_columns
+        magnitude = np.concatenate(tiles, axis=2)[:, :, offset:offset + last - first]
+        return self.column_times(level, first, last), self.frequencies(level), magnitude
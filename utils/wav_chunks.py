@@ -1,13 +1,189 @@
 from matplotlib import pyplot as plt
 import scipy.fft
+import io
+import os
+import shutil
+import tempfile
 import struct
 import audioop
 import numpy as np
 
-Optional, index, tab, unrecognizedChunk, data = {}, 1, [], [], []
+from utils.compression import methods as compression_methods, method_names as compression_method_names
+from utils.instrumentation import span
+
+
+padding_chunk_ids = ("JUNK", "junk", "PAD ", "pad ")      # chunki wypełniające bez zawartości
+
+
+def decode_text(data) -> str:
+    # surrogateescape - bajty spoza UTF-8 przechodzą bez zmian przez odczyt i zapis
+    return str(data, encoding="utf-8", errors="surrogateescape")
+
+
+def encode_text(text: str) -> bytes:
+    return text.encode(encoding="utf-8", errors="surrogateescape")
+
+
+class ChunkWriter:
+    # Buforowany zapis chunków: pola pakowane gotowymi strukturami do bufora, rozmiary uzupełniane po zapisaniu
+    # zawartości (w buforze, a jeśli nagłówek został już zapisany do pliku - przez powrót seek)
+    # Chunki większe niż 4 GiB: w polu rozmiaru zapisywane jest 0xFFFFFFFF, a przy zamknięciu zarezerwowany
+    # chunk JUNK zamieniany jest na "ds64" z 64-bitowymi rozmiarami, a nagłówek RIFF na RF64.
+    # JUNK rezerwowany jest domyślnie w każdym pliku, więc i plik dopisywany później (WavAppender)
+    # może przekroczyć 4 GiB bez przesuwania zawartości.
+    header_struct = struct.Struct("<4sI")
+    size_struct = struct.Struct("<I")
+    id_struct = struct.Struct("<4s")
+    max_size = 0xFFFFFFFF
+    rf64_threshold = max_size - (1 << 24)   # rozmiar danych, od którego rezerwowane jest miejsce na ds64
+
+    def __init__(self, file, selected=None, buffer_size: int = 1 << 20, reserve_ds64: bool = True):
+        self.file = file
+        self.selected = selected                # identyfikatory wybrane do zapisu, None - wszystkie
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.buffer_offset = file.tell()        # pozycja w pliku odpowiadająca początkowi bufora
+        self.open_chunks = []                   # (pozycja pola rozmiaru, czy rozmiar znany z góry, identyfikator)
+        self.reserve_ds64 = reserve_ds64        # miejsce na ds64 za nagłówkiem RIFF (RIFFHeader.write)
+        self.ds64_offset = None
+        self.riff_offset = None
+        self.large_sizes = {}                   # identyfikator -> rozmiar większy niż max_size
+        self.data_size = 0
+
+    def tell(self) -> int:
+        return self.buffer_offset + len(self.buffer)
+
+    def is_selected(self, id: str) -> bool:
+        return self.selected is None or id in self.selected
+
+    def write(self, data: bytes) -> None:
+        if len(data) >= self.buffer_size:
+            self.flush()
+            self.file.write(data)
+            self.buffer_offset += len(data)
+        else:
+            self.buffer += data
+            if len(self.buffer) >= self.buffer_size:
+                self.flush()
+
+    def pack(self, fmt: struct.Struct, *values) -> None:
+        self.buffer += fmt.pack(*values)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def reserve(self, fmt: struct.Struct) -> int:
+        offset = self.tell()
+        self.buffer += bytes(fmt.size)
+        return offset
+
+    def patch(self, offset: int, fmt: struct.Struct, *values) -> None:
+        if offset >= self.buffer_offset:
+            fmt.pack_into(self.buffer, offset - self.buffer_offset, *values)
+        else:
+            self.flush()
+            self.file.seek(offset)
+            self.file.write(fmt.pack(*values))
+            self.file.seek(self.buffer_offset)
+
+    def begin_chunk(self, id: str, size: int = None) -> None:
+        if not self.open_chunks and self.riff_offset is None:
+            self.riff_offset = self.tell()
+        if size is not None and size > ChunkWriter.max_size:
+            self.check_large_size(id)
+            self.pack(ChunkWriter.header_struct, id.encode(encoding="utf-8"), ChunkWriter.max_size)
+        else:
+            self.pack(ChunkWriter.header_struct, id.encode(encoding="utf-8"), 0 if size is None else size)
+        self.open_chunks.append((self.tell() - 4, size is not None, id))
+
+    def end_chunk(self) -> int:
+        size_offset, size_known, id = self.open_chunks.pop()
+        size = self.tell() - size_offset - 4
+        if id == "data":
+            self.data_size = size
+        if size > ChunkWriter.max_size:
+            self.check_large_size(id)
+            self.large_sizes[id] = size
+            self.patch(size_offset, ChunkWriter.size_struct, ChunkWriter.max_size)
+        elif not size_known:
+            self.patch(size_offset, ChunkWriter.size_struct, size)
+        if size % 2:
+            self.buffer += b"\x00"      # wyrównanie chunków RIFF do parzystej liczby bajtów
+        return size
+
+    def copy_from(self, source, offset: int, size: int, block_size: int = 1 << 20) -> None:
+        # kopiowanie bajtów z pliku źródłowego z pominięciem Pythona (copy_file_range/sendfile),
+        # a jeśli system lub obiekt pliku na to nie pozwala - dużymi blokami przez bufor
+        self.flush()
+        self.file.flush()
+        copied = 0
+        try:
+            source_fd, destination_fd = source.fileno(), self.file.fileno()
+            if hasattr(os, "copy_file_range"):
+                try:
+                    while copied < size:
+                        n = os.copy_file_range(source_fd, destination_fd, size - copied, offset + copied,
+                                               self.buffer_offset + copied)
+                        if n == 0:
+                            break
+                        copied += n
+                except OSError:
+                    pass
+            if copied < size and hasattr(os, "sendfile"):
+                os.lseek(destination_fd, self.buffer_offset + copied, os.SEEK_SET)
+                while copied < size:
+                    n = os.sendfile(destination_fd, source_fd, offset + copied, size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+        except (OSError, ValueError):
+            pass
+        if copied < size:
+            self.file.seek(self.buffer_offset + copied)
+            source.seek(offset + copied)
+            while copied < size:
+                block = source.read(min(block_size, size - copied))
+                if not block:
+                    print("Plik źródłowy jest krótszy niż zapisany w nim rozmiar chunka")
+                    raise Exception
+                self.file.write(block)
+                copied += len(block)
+        self.buffer_offset += size
+        self.file.seek(self.buffer_offset)
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer_offset += len(self.buffer)
+            self.buffer = bytearray()
+
+    def write_ds64_placeholder(self) -> None:
+        if self.reserve_ds64:
+            self.ds64_offset = self.tell()
+            self.begin_chunk("JUNK", DS64Chunk.sizes_struct.size)
+            self.write(bytes(DS64Chunk.sizes_struct.size))
+            self.end_chunk()
+
+    def check_large_size(self, id: str) -> None:
+        if self.ds64_offset is None or id not in ("RIFF", "data"):
+            print(f"Rozmiar chunka {id} przekracza 4 GiB - zapis wymaga ChunkWriter(reserve_ds64=True)")
+            raise Exception
+
+    def close(self) -> None:
+        while self.open_chunks:
+            self.end_chunk()
+        if self.large_sizes:
+            # zamiana na RF64: identyfikator pliku, chunk ds64 w miejscu zarezerwowanego JUNK
+            riff_size = self.large_sizes.get("RIFF", self.tell() - self.riff_offset - 8)
+            self.patch(self.riff_offset, ChunkWriter.id_struct, b"RF64")
+            self.patch(self.ds64_offset, ChunkWriter.header_struct, b"ds64", DS64Chunk.sizes_struct.size)
+            self.patch(self.ds64_offset + 8, DS64Chunk.sizes_struct, riff_size, self.data_size, 0, 0)
+        self.flush()
 
 
 class Chunk:
+    __slots__ = ("id", "size", "data")
+    header_struct = ChunkWriter.header_struct
+
     def __init__(self, id: str, size: int, data=None):
         self.id = id
         self.size = size
@@ -21,12 +197,33 @@ class Chunk:
 
     pass
 
-    def write(self, file):
-        try:
-            file.write(self.id.encode(encoding='utf-8'))
-            file.write(self.size.to_bytes(4, byteorder="little", signed=True))
-        except Exception:
-            pass
+    def write(self, writer: ChunkWriter):
+        writer.begin_chunk(self.id, len(self.data))
+        writer.write(self.data)
+        writer.end_chunk()
+
+
+class MetadataContents:
+    # baza kontenerów metadanych - znane pola w __slots__ podklas, nierozpoznane podchunki osobno dla każdej instancji
+    __slots__ = ("unrecognized",)
+    fields = ()
+    unrecognized_indent = "\t\t\t"
+
+    def __init__(self):
+        self.unrecognized = []          # nierozpoznany
+        for field in self.fields:
+            setattr(self, field, None)
+
+    def __repr__(self):
+        list = ""
+        for field in self.fields:
+            value = getattr(self, field)
+            if value is not None:
+                list += str(value)
+        for unrecognized in self.unrecognized:
+            list += self.unrecognized_indent + "Nierozpoznany:\n"
+            list += str(unrecognized)
+        return list
 
 
 class RIFFHeader(Chunk):
@@ -41,11 +238,8 @@ class RIFFHeader(Chunk):
 
         pass
 
-        def write(self, file):
-            try:
-                file.write(self.format.encode(encoding='utf-8'))
-            except Exception:
-                pass
+        def write(self, writer: ChunkWriter):
+            writer.write(self.format.encode(encoding='utf-8'))
 
     data: Contents
 
@@ -60,9 +254,70 @@ class RIFFHeader(Chunk):
         return Chunk.__str__(self) + str(self.data)
     pass
 
-    def write(self, file=None):
-        Chunk.write(self, file)
-        self.data.write(file)
+    rf64_ids = ("RF64", "BW64")
+
+    def write(self, writer: ChunkWriter):
+        # chunk RIFF obejmuje wszystkie kolejne chunki - rozmiar uzupełnia writer.close();
+        # plik RF64 zapisywany jest jako RIFF i zamieniany na RF64 dopiero po przekroczeniu 4 GiB
+        writer.begin_chunk("RIFF" if self.id in RIFFHeader.rf64_ids else self.id)
+        self.data.write(writer)
+        writer.write_ds64_placeholder()
+
+
+class DS64Chunk(Chunk):
+    # "ds64" w plikach RF64/BW64 - 64-bitowe rozmiary chunków, których pole rozmiaru zawiera 0xFFFFFFFF
+    __slots__ = ()
+    sizes_struct = struct.Struct("<QQQI")       # rozmiar RIFF, rozmiar danych, liczba próbek, długość tablicy
+    table_entry_struct = struct.Struct("<4sQ")  # identyfikator chunka, rozmiar
+
+    class Contents:
+        __slots__ = ("riff_size", "data_size", "sample_count", "table")
+
+        def __init__(self, riff_size: int, data_size: int, sample_count: int = 0, table: dict = None):
+            self.riff_size = riff_size
+            self.data_size = data_size
+            self.sample_count = sample_count
+            self.table = table if table is not None else {}
+
+        def __repr__(self):
+            ret = f"\t\tRIFF size: {self.riff_size}"
+            ret += f"\n\t\tData size: {self.data_size}"
+            ret += f"\n\t\tSample count: {self.sample_count}"
+            for id, size in self.table.items():
+                ret += f"\n\t\t{id} size: {size}"
+            return ret + "\n"
+
+        @staticmethod
+        def parse(data: bytes) -> "DS64Chunk.Contents":
+            riff_size, data_size, sample_count, table_length = DS64Chunk.sizes_struct.unpack_from(data)
+            table = {}
+            offset = DS64Chunk.sizes_struct.size
+            for _ in range(table_length):
+                id, size = DS64Chunk.table_entry_struct.unpack_from(data, offset)
+                table[decode_text(id)] = size
+                offset += DS64Chunk.table_entry_struct.size
+            return DS64Chunk.Contents(riff_size, data_size, sample_count, table)
+
+        def size_of(self, id: str, size: int) -> int:
+            if id == "RIFF" or id in RIFFHeader.rf64_ids:
+                return self.riff_size
+            if id == "data":
+                return self.data_size
+            return self.table.get(id, size)
+
+        def write(self, writer: ChunkWriter):
+            writer.pack(DS64Chunk.sizes_struct, self.riff_size, self.data_size, self.sample_count, len(self.table))
+            for id, size in self.table.items():
+                writer.pack(DS64Chunk.table_entry_struct, encode_text(id), size)
+
+    data: Contents
+
+    def __init__(self, id: str, size: int, data: bytes):
+        Chunk.__init__(self=self, id=id, size=size, data=None)
+        self.data = DS64Chunk.Contents.parse(data)
+
+    def __str__(self):
+        return Chunk.__str__(self) + "\n" + str(self.data)
 
 
 class FmtChunk(Chunk):
@@ -83,14 +338,14 @@ class FmtChunk(Chunk):
             self.byte_rate = data[3]
             self.block_align = data[4]
             self.bits_per_sample = data[5]
-            if data.index(data[-1]) > 5:
+            if len(data) > 6:
                 self.num_extra_format_bytes = data[6]
                 self.extra_format_bytes = data[7]
 
         def __repr__(self):
             list = str(self.audio_format) + " - " + str(self.num_channels) + " - " + str(self.sample_rate) + \
                    " - " + str(self.byte_rate) + " - " + str(self.block_align) + " - " + str(self.bits_per_sample)
-            if data.index(data[-1]) > 5:
+            if hasattr(self, "num_extra_format_bytes"):
                 list += " - " + str(self.num_extra_format_bytes) + " - " + str(self.extra_format_bytes)
             return list
 
@@ -101,7 +356,7 @@ class FmtChunk(Chunk):
             ret += f"\n\t\tByte rate: {self.byte_rate}"
             ret += f"\n\t\tBlock align: {self.block_align}"
             ret += f"\n\t\tBits per sample: {self.bits_per_sample}"
-            if len(data) > 5:
+            if hasattr(self, "num_extra_format_bytes"):
                 ret += f"\n\t\tNumber of extra format bytes {self.num_extra_format_bytes}"
                 ret += f"\n\t\tExtra format bytes {self.extra_format_bytes}"
             ret += "\n"
@@ -109,25 +364,15 @@ class FmtChunk(Chunk):
 
         pass
 
-        def write(self, file):
-            try:
-                file.write(self.audio_format.to_bytes(2, byteorder="little", signed=True))
-                file.write(self.num_channels.to_bytes(2, byteorder="little", signed=True))
-                file.write(self.sample_rate.to_bytes(4, byteorder="little", signed=True))
-                file.write(self.byte_rate.to_bytes(4, byteorder="little", signed=True))
-                file.write(self.block_align.to_bytes(2, byteorder="little", signed=True))
-                file.write(self.bits_per_sample.to_bytes(2, byteorder="little", signed=True))
-                try:
-                    file.write(self.num_extra_format_bytes.to_bytes(2, byteorder="little", signed=True))
-                    file.write(
-                        self.extra_format_bytes.to_bytes(self.data.num_extra_format_bytes + 1, byteorder="little",
-                                                         signed=True))
-                    file.seek(-1, np.os.SEEK_END)
-                    file.truncate()
-                except Exception:
-                    pass
-            except Exception:
-                pass
+        fmt_struct = struct.Struct("<HHIIHH")
+        extra_size_struct = struct.Struct("<H")
+
+        def write(self, writer: ChunkWriter):
+            writer.pack(FmtChunk.Contents.fmt_struct, self.audio_format, self.num_channels, self.sample_rate,
+                        self.byte_rate, self.block_align, self.bits_per_sample)
+            if hasattr(self, "num_extra_format_bytes"):
+                writer.pack(FmtChunk.Contents.extra_size_struct, self.num_extra_format_bytes)
+                writer.write(self.extra_format_bytes.to_bytes(self.num_extra_format_bytes, byteorder="little"))
 
     data: Contents
 
@@ -144,9 +389,10 @@ class FmtChunk(Chunk):
 
     pass
 
-    def write(self, file=None):
-        Chunk.write(self, file)
-        self.data.write(file)
+    def write(self, writer: ChunkWriter):
+        writer.begin_chunk(self.id)
+        self.data.write(writer)
+        writer.end_chunk()
 
 
 class factChunk(Chunk):
@@ -161,11 +407,10 @@ class factChunk(Chunk):
 
         pass
 
-        def write(self, file):
-            try:
-                file.write(self.data.to_bytes(4, byteorder="little", signed=True))
-            except Exception:
-                pass
+        data_struct = struct.Struct("<I")
+
+        def write(self, writer: ChunkWriter):
+            writer.pack(factChunk.Contents.data_struct, self.data)
     data: Contents
 
     def __init__(self, id: str, size: int, data: list):
@@ -179,13 +424,118 @@ class factChunk(Chunk):
         return "\t" + Chunk.__str__(self) + str(self.data)
     pass
 
-    def write(self, file):
-        Chunk.write(self, file)
-        self.data.write(file)
+    def write(self, writer: ChunkWriter):
+        writer.begin_chunk(self.id)
+        self.data.write(writer)
+        writer.end_chunk()
+
+
+class EncryptionChunk(Chunk):
+    # Jawne parametry szyfrowania zapisywane w pliku: tryb, rodzaj implementacji RSA, wektor inicjalizujący,
+    # długość ostatniego bloku, kompresja przed szyfrowaniem i odcisk klucza publicznego.
+    # Klucz prywatny nigdy nie trafia do pliku.
+    chunk_id = "encr"
+
+    class Contents:
+        mode: str                   # "ECB" albo "CBC"
+        library: bool               # True - biblioteka rsa, False - własna implementacja
+        block_leftover_len: int     # None dla biblioteki rsa
+        init_vector: int            # None w trybie ECB
+        key_fingerprint: bytes
+        compression: str            # None, "zlib" albo "lzma" - kompresja próbek przed szyfrowaniem
+        delta_filter: bool          # kodowanie różnicowe próbek przed kompresją
+
+        FLAG_LIBRARY = 1
+        FLAG_BLOCK_LEFTOVER_LEN = 2
+        FLAG_INIT_VECTOR = 4
+        FLAG_DELTA_FILTER = 8
+        version = 1
+        header_struct = struct.Struct("<4sBBBBI32s")    # tryb, wersja, flagi, kompresja, bajt zarezerwowany,
+        init_vector_len_struct = struct.Struct("<I")    # długość ostatniego bloku, odcisk klucza
+
+        def __init__(self, mode: str, library: bool, block_leftover_len: int = None, init_vector: int = None,
+                     key_fingerprint: bytes = bytes(32), compression: str = None, delta_filter: bool = False):
+            self.mode = mode
+            self.library = library
+            self.block_leftover_len = block_leftover_len
+            self.init_vector = init_vector
+            self.key_fingerprint = key_fingerprint
+            self.compression = compression
+            self.delta_filter = delta_filter
+
+        def __repr__(self):
+            ret = f"\t\tMode: {self.mode}"
+            ret += f"\n\t\tRSA: {'rsa library' if self.library else 'custom'}"
+            ret += f"\n\t\tBlock leftover length: {self.block_leftover_len}"
+            ret += f"\n\t\tInit vector: {'yes' if self.init_vector is not None else 'no'}"
+            ret += f"\n\t\tCompression: {self.compression}{' (delta)' if self.delta_filter else ''}"
+            ret += f"\n\t\tKey fingerprint: {self.key_fingerprint.hex()}\n"
+            return ret
+
+        @staticmethod
+        def parse(data: bytes) -> "EncryptionChunk.Contents":
+            Contents = EncryptionChunk.Contents
+            mode, version, flags, compression, _, block_leftover_len, key_fingerprint = \
+                Contents.header_struct.unpack_from(data)
+            offset = Contents.header_struct.size
+            init_vector = None
+            if flags & Contents.FLAG_INIT_VECTOR:
+                init_vector_len = Contents.init_vector_len_struct.unpack_from(data, offset)[0]
+                offset += Contents.init_vector_len_struct.size
+                init_vector = int.from_bytes(data[offset:offset + init_vector_len], byteorder="little")
+            if not flags & Contents.FLAG_BLOCK_LEFTOVER_LEN:
+                block_leftover_len = None
+            return Contents(decode_text(mode).strip(), bool(flags & Contents.FLAG_LIBRARY), block_leftover_len,
+                            init_vector, bytes(key_fingerprint), compression_method_names.get(compression),
+                            bool(flags & Contents.FLAG_DELTA_FILTER))
+
+        def write(self, writer: ChunkWriter):
+            Contents = EncryptionChunk.Contents
+            flags = Contents.FLAG_LIBRARY if self.library else 0
+            if self.block_leftover_len is not None:
+                flags |= Contents.FLAG_BLOCK_LEFTOVER_LEN
+            if self.init_vector is not None:
+                flags |= Contents.FLAG_INIT_VECTOR
+            if self.delta_filter:
+                flags |= Contents.FLAG_DELTA_FILTER
+            writer.pack(Contents.header_struct, self.mode.ljust(4).encode(encoding="utf-8"), Contents.version,
+                        flags, compression_methods.get(self.compression, 0), 0, self.block_leftover_len or 0,
+                        self.key_fingerprint)
+            if self.init_vector is not None:
+                init_vector = self.init_vector.to_bytes((self.init_vector.bit_length() + 7) // 8, byteorder="little")
+                writer.pack(Contents.init_vector_len_struct, len(init_vector))
+                writer.write(init_vector)
+
+    data: Contents
+
+    def __init__(self, id: str, size: int, data: bytes):
+        Chunk.__init__(self=self, id=id, size=size, data=None)
+        self.data = EncryptionChunk.Contents.parse(data)
+
+    @staticmethod
+    def create(contents: Contents) -> "EncryptionChunk":
+        chunk = EncryptionChunk.__new__(EncryptionChunk)
+        Chunk.__init__(self=chunk, id=EncryptionChunk.chunk_id, size=0, data=contents)
+        return chunk
+
+    def __repr__(self):
+        return Chunk.__repr__(self) + "\n" + str(self.data)
+
+    def __str__(self):
+        return "\t" + Chunk.__str__(self) + "\n" + str(self.data)
+    pass
+
+    def write(self, writer: ChunkWriter):
+        writer.begin_chunk(self.id)
+        self.data.write(writer)
+        self.size = writer.end_chunk()
 
 
 class INFOsubChunk(Chunk):
+    __slots__ = ()
+
     class Contents:
+        __slots__ = ("data",)
         data: str
 
         def __init__(self, data: str):
@@ -196,16 +546,13 @@ class INFOsubChunk(Chunk):
 
         pass
 
-        def write(self, file):
-            try:
-                file.write(self.data.encode(encoding="utf-8"))
-            except Exception:
-                pass
+        def write(self, writer: ChunkWriter):
+            writer.write(encode_text(self.data))
     data: Contents
 
-    def __init__(self, id: str, size: int, data: list):
+    def __init__(self, id: str, size: int, data: bytes):
         Chunk.__init__(self=self, id=id, size=size, data=None)
-        self.data = INFOsubChunk.Contents(bytes.decode(data[:]))
+        self.data = INFOsubChunk.Contents(decode_text(data))
 
     def __repr__(self):
         return Chunk.__repr__(self) + " - " + str(self.data)
@@ -214,132 +561,67 @@ class INFOsubChunk(Chunk):
         return f"\t\t\t" + Chunk.__str__(self) + "\n" + str(self.data)
     pass
 
-    def write(self, file):
-        Chunk.write(self, file)
-        self.data.write(file)
+    def write(self, writer: ChunkWriter):
+        payload = encode_text(self.data.data)
+        writer.begin_chunk(self.id, len(payload))
+        writer.write(payload)
+        writer.end_chunk()
 
+    def write_id3_frame(self, writer: ChunkWriter):
+        # ramka ID3v2: identyfikator, rozmiar big-endian bez 2 bajtów flag, flagi i treść
+        payload = encode_text(self.data.data)
+        writer.pack(INFOsubChunk.id3_frame_struct, self.id.encode(encoding="utf-8"), len(payload) - 2)
+        writer.write(payload)
 
-class INFOChunk(Chunk):
-    class Contents:
-        IART: INFOsubChunk          # wykonawca
-        INAM: INFOsubChunk          # tytuł utworu
-        IPRD: INFOsubChunk          # tytuł albumu
-        ICRD: INFOsubChunk          # data wydania
-        IGNR: INFOsubChunk          # gatunek
-        ICMT: INFOsubChunk          # komentarze
-        ITRK: INFOsubChunk          # komentarze
-        ISFT: INFOsubChunk          # oprogramowanie
-        unrecognized = []           # nierozpoznany
+    id3_frame_struct = struct.Struct(">4sI")
 
-        def __repr__(self):
-            list = ""
-            try:
-                list += str(self.IART)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.INAM)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.IPRD)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.ICRD)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.IGNR)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.ICMT)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.ITRK)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.ISFT)
-            except AttributeError:
-                pass
-            try:
-                for unrecognized in self.unrecognized:
-                    try:
-                        list += "\t\t\tNierozpoznany:\n"
-                        list += str(unrecognized)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            return list
 
-        def write(self, file):
-            try:
-                if 'INAM' in tab:
-                    self.INAM.write(file)
-            except AttributeError:
-                pass
-            try:
-                if 'IPRD' in tab:
-                    self.IPRD.write(file)
-            except AttributeError:
-                pass
-            try:
-                if 'IART' in tab:
-                    self.IART.write(file)
-            except AttributeError:
-                pass
-            try:
-                if 'ICMT' in tab:
-                    self.ICMT.write(file)
-            except AttributeError:
-                pass
-            try:
-                if 'ICRD' in tab:
-                   self.ICRD.write(file)
-            except AttributeError:
-                pass
-            try:
-                if 'IGNR' in tab:
-                    self.IGNR.write(file)
-            except AttributeError:
-                pass
-            try:
-                if 'ITRK' in tab:
-                   self.ITRK.write(file)
-            except AttributeError:
-                pass
-            try:
-                if 'ISFT' in tab:
-                    self.ISFT.write(file)
-            except AttributeError:
-                pass
+class INFOChunk(Chunk):
+    __slots__ = ()
+
+    class Contents(MetadataContents):
+        fields = ("IART",               # wykonawca
+                  "INAM",               # tytuł utworu
+                  "IPRD",               # tytuł albumu
+                  "ICRD",               # data wydania
+                  "IGNR",               # gatunek
+                  "ICMT",               # komentarze
+                  "ITRK",               # numer ścieżki
+                  "ISFT")               # oprogramowanie
+        __slots__ = fields
+        write_order = ("INAM", "IPRD", "IART", "ICMT", "ICRD", "IGNR", "ITRK", "ISFT")
+
+        def write(self, writer: ChunkWriter):
+            for field in INFOChunk.Contents.write_order:
+                subchunk = getattr(self, field)
+                if subchunk is not None and writer.is_selected(field):
+                    subchunk.write(writer)
 
     data: Contents
 
-    def __init__(self, id: str, size: int, data: list):
-        global index
+    subchunk_types = dict.fromkeys(Contents.fields, INFOsubChunk)
+
+    def __init__(self, id: str, size: int, data: bytes, session: "WavSession" = None):
         Chunk.__init__(self=self, id=id, size=size, data=None)
         self.data = INFOChunk.Contents()
+        view = memoryview(data)
         start = 0
-        while start < len(data) - 1:
-            subid = bytes.decode(data[start:start + 4])
-            if len(subid):
-                sizesubid = int.from_bytes(data[start + 4:start + 8], byteorder="little")
-            if subid in self.Contents.__annotations__:
-                exec(
-                    "%s=%s" % ('self.data.' + subid, "INFOsubChunk(subid, sizesubid, data[start+8:start+sizesubid+8])"))
-                Optional.update({index: subid})
-                index += 1
+        while start + 8 <= len(view):
+            subid, sizesubid = Chunk.header_struct.unpack_from(view, start)
+            subid = decode_text(subid)
+            payload = view[start + 8:start + 8 + sizesubid]
+            subchunk_type = INFOChunk.subchunk_types.get(subid)
+            if subchunk_type is not None:
+                setattr(self.data, subid, subchunk_type(subid, sizesubid, payload))
+                if session is not None:
+                    session.register_optional(subid)
             else:
-                self.data.unrecognized.append(INFOsubChunk(subid, sizesubid, data[start + 8:start + sizesubid + 8]))
-            start = start + sizesubid + 8
+                self.data.unrecognized.append(INFOsubChunk(subid, sizesubid, payload))
+            start = start + 8 + sizesubid + (sizesubid & 1)
 
-        if len(data) > 4 + start:
-            self.data.unrecognized.append(INFOsubChunk(bytes.decode(data[start:start + 4]), len(data[start + 4:]), data[start + 4:]))
+        if len(view) > 4 + start:
+            self.data.unrecognized.append(INFOsubChunk(decode_text(view[start:start + 4]), len(view) - start - 4,
+                                                       view[start + 4:]))
 
     def __repr__(self):
         return Chunk.__repr__(self) + "\n" + str(self.data)
@@ -348,9 +630,9 @@ class INFOChunk(Chunk):
         return f"\t\t" + Chunk.__str__(self) + "\n" + str(self.data)
     pass
 
-    def write(self, file):
-        file.write(self.id.encode(encoding='utf-8'))
-        self.data.write(file)
+    def write(self, writer: ChunkWriter):
+        writer.write(self.id.encode(encoding='utf-8'))
+        self.data.write(writer)
 
 
 class CuesubChunk:
@@ -386,16 +668,11 @@ class CuesubChunk:
 
         pass
 
-        def write(self, file):
-            try:
-                file.write(self.ID.encode(encoding='utf-8'))
-                file.write(self.position.to_bytes(4, byteorder="little", signed=True))
-                file.write(self.data_chunk_ID.encode(encoding='utf-8'))
-                file.write(self.chunk_start.to_bytes(4, byteorder="little", signed=True))
-                file.write(self.block_start.to_bytes(4, byteorder="little", signed=True))
-                file.write(self.sample_offset.to_bytes(4, byteorder="little", signed=True))
-            except Exception:
-                pass
+        point_struct = struct.Struct("<6I")
+
+        def write(self, writer: ChunkWriter):
+            writer.pack(CuesubChunk.Contents.point_struct, self.ID, self.position, self.data_chunk_ID,
+                        self.chunk_start, self.block_start, self.sample_offset)
 
     data: Contents
 
@@ -410,17 +687,18 @@ class CuesubChunk:
 
     pass
 
-    def write(self, file=None):
-        self.data.write(file)
+    def write(self, writer: ChunkWriter):
+        self.data.write(writer)
 
 
 class CueChunk(Chunk):
     class Contents:
         numPoints: int
-        #Points: list[CuesubChunk]
+        Points: list
 
         def __init__(self, numPoints: int):
             self.numPoints = numPoints
+            self.Points = []
 
         def __repr__(self):
             list = "\t\tnumber of Points: " + str(self.numPoints) + "\n"
@@ -431,34 +709,25 @@ class CueChunk(Chunk):
                     pass
             return list
 
-        def write(self, file):
-            file.write(self.numPoints.to_bytes(4, byteorder="little", signed=True))
+        count_struct = struct.Struct("<I")
+
+        def write(self, writer: ChunkWriter):
+            writer.pack(CueChunk.Contents.count_struct, len(self.Points))
             for cue in self.Points:
-                try:
-                    cue.write(file)
-                except AttributeError:
-                    pass
+                cue.write(writer)
 
     data: Contents
 
     def __init__(self, id: str, size: int, data: list):
-        global index
         Chunk.__init__(self=self, id=id, size=size, data=None)
         data = data[0]
         numPoints = int.from_bytes(data[:4], byteorder="little")
         self.data = CueChunk.Contents(numPoints)
         for start in range(numPoints):
-            point = []
-            for i in range(6):
-                if start*24+i*4+8 > size:
-                    print("Wrong format of point.")
-                    break
-                point.append(int.from_bytes(data[start*24+i*4+4:start*24+i*4+8], byteorder="little"))
-
-            if len(point) == 6:
-                self.data.Points.append(CuesubChunk(point))
-            else:
-                pass
+            if start * 24 + 28 > len(data):
+                print("Wrong format of point.")
+                break
+            self.data.Points.append(CuesubChunk(list(CuesubChunk.Contents.point_struct.unpack_from(data, start * 24 + 4))))
 
     def __repr__(self):
         return Chunk.__repr__(self) + "\n" + str(self.data)
@@ -468,13 +737,17 @@ class CueChunk(Chunk):
 
     pass
 
-    def write(self, file):
-        Chunk.write(self, file)
-        self.data.write(file)
+    def write(self, writer: ChunkWriter):
+        writer.begin_chunk(self.id)
+        self.data.write(writer)
+        writer.end_chunk()
 
 
 class ADTLsubChunk(Chunk):
+    __slots__ = ()
+
     class Contents:
+        __slots__ = ("cueID", "sample", "purpouse", "country", "lang", "dial", "code", "data")
         cueID: str
         sample: str
         purpouse: str
@@ -514,33 +787,24 @@ class ADTLsubChunk(Chunk):
 
         pass
 
-        def write(self, file, id):
-            try:
-                file.write(self.cueID.encode(encoding="utf-8"))
-                if id == "itxt":
-                    file.write(self.cueID.encode(encoding="utf-8"))
-                    file.write(self.sample.encode(encoding="utf-8"))
-                    file.write(self.purpouse.encode(encoding="utf-8"))
-                    file.write(self.country.encode(encoding="utf-8"))
-                    file.write(self.lang.encode(encoding="utf-8"))
-                    file.write(self.dial.encode(encoding="utf-8"))
-                    file.write(self.code.encode(encoding="utf-8"))
-
-                file.write(self.data.encode(encoding="utf-8"))
-            except Exception:
-                pass
+        def write(self, writer: ChunkWriter, id):
+            writer.write(encode_text(self.cueID))
+            if id == "ltxt":
+                writer.write(encode_text(self.sample + self.purpouse + self.country + self.lang + self.dial +
+                                         self.code))
+            writer.write(encode_text(self.data))
 
     data: Contents
 
-    def __init__(self, id: str, size: int, cueID: str, data: list):
+    def __init__(self, id: str, size: int, cueID: str, data: bytes):
         Chunk.__init__(self=self, id=id, size=size, data=None)
         if id != "ltxt":
-            self.data = ADTLsubChunk.Contents(cueID, bytes.decode(data[:]))
+            self.data = ADTLsubChunk.Contents(cueID, decode_text(data))
         else:
-            self.data = ADTLsubChunk.Contents(cueID, bytes.decode(data[16:]), bytes.decode(data[:4]),
-                                              bytes.decode(data[4:8]), bytes.decode(data[8:10]),
-                                              bytes.decode(data[10:12]), bytes.decode(data[12:14]),
-                                              bytes.decode(data[14:16]))
+            self.data = ADTLsubChunk.Contents(cueID, decode_text(data[16:]), decode_text(data[:4]),
+                                              decode_text(data[4:8]), decode_text(data[8:10]),
+                                              decode_text(data[10:12]), decode_text(data[12:14]),
+                                              decode_text(data[14:16]))
 
     def __repr__(self):
         return Chunk.__repr__(self) + " - " + str(self.data)
@@ -549,84 +813,53 @@ class ADTLsubChunk(Chunk):
         return f"\t\t\t" + Chunk.__str__(self) + "\n" + str(self.data)
     pass
 
-    def write(self, file):
-        Chunk.write(self, file)
-        self.data.write(file, self.id)
+    def write(self, writer: ChunkWriter):
+        writer.begin_chunk(self.id)
+        self.data.write(writer, self.id)
+        writer.end_chunk()
 
 
 class ADTLChunk(Chunk):
-    class Contents:
-        labl: ADTLsubChunk          # nazwy znaczników (cue)
-        note: ADTLsubChunk          # opisy znaczników (cue)
-        ltxt: ADTLsubChunk          # informacje dodatkowe znaczników (cue)
-        unrecognized = []           # nierozpoznany
+    __slots__ = ()
 
-        def __repr__(self):
-            list = ""
-            try:
-                list += str(self.labl)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.note)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.ltxt)
-            except AttributeError:
-                pass
-            try:
-                for unrecognized in self.unrecognized:
-                    try:
-                        list += "\t\t\tNierozpoznany:\n"
-                        list += str(unrecognized)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            return list
+    class Contents(MetadataContents):
+        fields = ("labl",               # nazwy znaczników (cue)
+                  "note",               # opisy znaczników (cue)
+                  "ltxt")               # informacje dodatkowe znaczników (cue)
+        __slots__ = fields
 
-        def write(self, file):
-            try:
-                if 'labl' in tab:
-                    self.labl.write(file)
-            except AttributeError:
-                pass
-            try:
-                if 'note' in tab:
-                    self.note.write(file)
-            except AttributeError:
-                pass
-            try:
-                if 'ltxt' in tab:
-                    self.ltxt.write(file)
-            except AttributeError:
-                pass
+        def write(self, writer: ChunkWriter):
+            for field in ADTLChunk.Contents.fields:
+                subchunk = getattr(self, field)
+                if subchunk is not None and writer.is_selected(field):
+                    subchunk.write(writer)
 
     data: Contents
 
-    def __init__(self, id: str, size: int, data: list):
-        global index
+    subchunk_types = dict.fromkeys(Contents.fields, ADTLsubChunk)
+
+    def __init__(self, id: str, size: int, data: bytes, session: "WavSession" = None):
         Chunk.__init__(self=self, id=id, size=size, data=None)
         self.data = ADTLChunk.Contents()
+        view = memoryview(data)
         start = 0
-        while start < len(data) - 1:
-            subid = bytes.decode(data[start:start + 4])
-            if len(subid):
-                sizesubid = int.from_bytes(data[start + 4:start + 8], byteorder="little")
-                cueID = bytes.decode(data[start + 8:start + 12])
-            if subid in self.Contents.__annotations__:
-                exec("%s=%s" % (
-                    'self.data.' + subid, "ADTLsubChunk(subid, sizesubid, cueID, data[start+12:start+sizesubid+12])"))
-                Optional.update({index: subid})
-                index += 1
+        while start + 12 <= len(view):
+            subid, sizesubid = Chunk.header_struct.unpack_from(view, start)
+            subid = decode_text(subid)
+            cueID = decode_text(view[start + 8:start + 12])
+            payload = view[start + 12:start + 8 + sizesubid]
+            subchunk_type = ADTLChunk.subchunk_types.get(subid)
+            if subchunk_type is not None:
+                setattr(self.data, subid, subchunk_type(subid, sizesubid, cueID, payload))
+                if session is not None:
+                    session.register_optional(subid)
             else:
-                self.data.unrecognized.append(ADTLsubChunk(subid, sizesubid, cueID, data[start + 12:start + sizesubid + 12]))
-            start = start + sizesubid + 8
+                self.data.unrecognized.append(ADTLsubChunk(subid, sizesubid, cueID, payload))
+            start = start + 8 + sizesubid + (sizesubid & 1)
 
-        if len(data) > 4 + start:
-            self.data.unrecognized.append(ADTLsubChunk(bytes.decode(data[start:start + 4]), len(data[start + 4:]), "",
-                                                  data[start + 4:]))
+        if len(view) > 4 + start:
+            self.data.unrecognized.append(ADTLsubChunk(decode_text(view[start:start + 4]), len(view) - start - 4, "",
+                                                       view[start + 4:]))
 
     def __repr__(self):
         return Chunk.__repr__(self) + "\n" + str(self.data)
@@ -635,75 +868,43 @@ class ADTLChunk(Chunk):
         return f"\t\t" + Chunk.__str__(self) + "\n" + str(self.data)
     pass
 
-    def write(self, file):
-        file.write(self.id.encode(encoding='utf-8'))
-        self.data.write(file)
+    def write(self, writer: ChunkWriter):
+        writer.write(self.id.encode(encoding='utf-8'))
+        self.data.write(writer)
 
 
 class LISTChunk(Chunk):
-    class Contents:
-        INFO: INFOChunk             # informacje o utworze
-        adtl: ADTLChunk             # informacje o znacznikach w utworze
-        unrecognized = []           # nierozpoznany
-
-        def __repr__(self):
-            list = ""
-            try:
-                list += str(self.INFO)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.adtl)
-            except AttributeError:
-                pass
-            try:
-                for unrecognized in self.unrecognized:
-                    try:
-                        list += "\t\tNierozpoznany:\n"
-                        list += str(unrecognized)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            return list
+    __slots__ = ()
 
-        pass
+    class Contents(MetadataContents):
+        fields = ("INFO",               # informacje o utworze
+                  "adtl")               # informacje o znacznikach w utworze
+        __slots__ = fields
+        unrecognized_indent = "\t\t"
 
-        def write(self, file):
-            try:
-                if 'INFO' in tab:
-                    self.INFO.write(file)
-            except Exception:
-                pass
-            try:
-                if 'adtl' in tab:
-                    self.adtl.write(file)
-            except Exception:
-                pass
+        def write(self, writer: ChunkWriter):
+            if writer.is_selected('INFO') and self.INFO is not None:
+                self.INFO.write(writer)
+            if writer.is_selected('adtl') and self.adtl is not None:
+                self.adtl.write(writer)
 
     data: Contents
 
-    def __init__(self, id: str, size: int, data: [bytes, int]):
-        global index
+    list_types = {"INFO": INFOChunk, "adtl": ADTLChunk}
+
+    def __init__(self, id: str, size: int, data: bytes, session: "WavSession" = None):
         Chunk.__init__(self=self, id=id, size=size, data=None)
         self.data = LISTChunk.Contents()
-        start = 0
-        while start < data.index(data[-1]):
-            subid = bytes.decode(data[start:start + 4])
-            if subid == "INFO":
-                self.data.INFO = INFOChunk(subid, len(data[start + 4:start + size]), data[start + 4:start + size])
-                Optional.update({index: self.data.INFO.id})
-                index += 1
-            elif subid == "adtl":
-                self.data.adtl = ADTLChunk(subid, len(data[start + 4:start + size]), data[start + 4:start + size])
-                Optional.update({index: self.data.adtl.id})
-                index += 1
+        view = memoryview(data)
+        if len(view) >= 4:
+            subid = decode_text(view[:4])
+            list_type = LISTChunk.list_types.get(subid)
+            if list_type is not None:
+                setattr(self.data, subid, list_type(subid, len(view) - 4, view[4:], session))
+                if session is not None:
+                    session.register_optional(subid)
             else:
-                self.data.unrecognized.append(INFOsubChunk(subid, len(data[start + 4:start + size]), data[start + 4:start + size]))
-            start = start + size
-
-        if len(data) > 4 + start:
-            self.data.unrecognized.append(INFOsubChunk(bytes.decode(data[start:start + 4]), len(data[start + 4:]), data[start + 4:]))
+                self.data.unrecognized.append(INFOsubChunk(subid, len(view) - 4, view[4:]))
 
     def __repr__(self):
         return Chunk.__repr__(self) + "\n" + str(self.data)
@@ -712,23 +913,10 @@ class LISTChunk(Chunk):
         return f"\t" + Chunk.__str__(self) + "\n" + str(self.data)
     pass
 
-    def write(self, file):
-        self.size = 0
-        if "INFO" in tab:
-            for field in tab:
-                if tab.index(field) < tab.index("INFO") and field in self.data.INFO.Contents.__annotations__:
-                    exec("self.size += self.data.INFO.data.%s.size + 8" % field)
-        if self.size > 0:
-            self.size += 4
-        tmp = self.size
-        if "adtl" in tab:
-            for field in tab:
-                if tab.index(field) < tab.index("adtl") and field in self.data.adtl.Contents.__annotations__:
-                    exec("self.size += self.data.adtl.data.%s.size + 8" % field)
-        if self.size > tmp:
-            self.size += 4
-        Chunk.write(self, file)
-        self.data.write(file)
+    def write(self, writer: ChunkWriter):
+        writer.begin_chunk(self.id)
+        self.data.write(writer)
+        self.size = writer.end_chunk()
 
 
 class DataChunk(Chunk):
@@ -792,6 +980,36 @@ class DataChunk(Chunk):
                 channels.append(samples[c::fmtChunk.data.num_channels])
             return channels
 
+        @staticmethod
+        def bytes_to_array(fmtChunk: FmtChunk, raw_samples: bytes, size: int = None) -> np.ndarray:
+            # wektorowy odpowiednik bytes_to_channels - tablica (kanał, ramka), niepełna ostatnia ramka pomijana
+            size = len(raw_samples) if size is None else size
+            sample_len = int(fmtChunk.data.bits_per_sample / 8)
+            num_channels = fmtChunk.data.num_channels
+            audio_format = fmtChunk.data.audio_format
+            if sample_len == 0 or audio_format not in (1, 3, 6, 7) or (audio_format == 3 and sample_len not in (4, 8)):
+                channels = DataChunk.Contents.bytes_to_channels(fmtChunk, raw_samples, size)
+                frames = min(len(channel) for channel in channels)
+                return np.array([channel[:frames] for channel in channels])
+
+            size -= size % (sample_len * num_channels)
+            raw = memoryview(raw_samples)[:size]
+            if audio_format == 1:
+                if sample_len == 1:
+                    samples = np.frombuffer(raw, dtype=np.uint8)
+                elif sample_len == 3:
+                    b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+                    samples = ((b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) ^ 0x800000) - 0x800000
+                else:
+                    samples = np.frombuffer(raw, dtype=f"<i{sample_len}")
+            elif audio_format == 3:
+                samples = np.frombuffer(raw, dtype="<f4" if sample_len == 4 else "<f8")
+            elif audio_format == 6:
+                samples = np.frombuffer(audioop.alaw2lin(raw, sample_len), dtype=f"<i{sample_len}")
+            else:
+                samples = np.frombuffer(audioop.ulaw2lin(raw, sample_len), dtype=f"<i{sample_len}")
+            return samples.reshape(-1, num_channels).T
+
         @staticmethod
         def channels_to_bytes(fmtChunk: FmtChunk, contents) -> bytes:
             combined_channels = [None] * (len(contents.samples) * len(contents.samples[0]))
@@ -849,9 +1067,10 @@ class DataChunk(Chunk):
 
                 return b"".join(bytes_samples)
 
-        def write(self, file, fmtChunk: FmtChunk):
+        def write(self, writer: ChunkWriter, fmtChunk: FmtChunk):
             bytes_to_save = DataChunk.Contents.channels_to_bytes(fmtChunk, self)
-            file.write(bytes_to_save)
+            writer.write(bytes_to_save)
+            return len(bytes_to_save)
 
 
     data: Contents
@@ -867,14 +1086,15 @@ class DataChunk(Chunk):
         return Chunk.__str__(self) + "\n" + str(self.data)
     pass
 
-    def write(self, file, fmtChunk: FmtChunk, overwrite_data: bytearray = None):
+    def write(self, writer: ChunkWriter, fmtChunk: FmtChunk, overwrite_data: bytearray = None):
         if overwrite_data is None:
-            Chunk.write(self, file)
-            self.data.write(file, fmtChunk)
+            bytes_to_save = DataChunk.Contents.channels_to_bytes(fmtChunk, self.data)
         else:
-            self.size = len(overwrite_data)
-            Chunk.write(self, file)
-            file.write(overwrite_data)
+            bytes_to_save = overwrite_data
+        self.size = len(bytes_to_save)
+        writer.begin_chunk(self.id, self.size)
+        writer.write(bytes_to_save)
+        writer.end_chunk()
 
 
     def update(self, new_byte_data: bytearray):
@@ -883,144 +1103,63 @@ class DataChunk(Chunk):
 
 
 class ID3Chunk(Chunk):
-    class Contents:
-        version: int
-        TPE1: INFOsubChunk          # wykonawca
-        COMM: INFOsubChunk          # tytuł utworu
-        TIT2: INFOsubChunk          # tytuł albumu
-        TDRC: INFOsubChunk          # gatunek
-        TALB: INFOsubChunk          # komentarze
-        TRCK: INFOsubChunk          # sciezka
-        TCON: INFOsubChunk          # gatunek
-        TXXX: INFOsubChunk          # przerwa
-        unrecognized = []           # nierozpoznany
+    __slots__ = ()
+
+    class Contents(MetadataContents):
+        fields = ("TPE1",               # wykonawca
+                  "TIT2",               # tytuł utworu
+                  "COMM",               # komentarze
+                  "TALB",               # tytuł albumu
+                  "TDRC",               # data nagrania
+                  "TRCK",               # numer ścieżki
+                  "TCON",               # gatunek
+                  "TXXX")               # pole użytkownika
+        __slots__ = fields + ("version",)
+
+        def __init__(self, version: int = 3):
+            MetadataContents.__init__(self)
+            self.version = version
 
         def __repr__(self):
-            list = "\t\t\tVersion: " + str(self.version) + "\n"
-            try:
-                list += str(self.TPE1)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.TIT2)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.COMM)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.TALB)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.TDRC)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.TRCK)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.TCON)
-            except AttributeError:
-                pass
-            try:
-                list += str(self.TXXX)
-            except AttributeError:
-                pass
-            try:
-                for unrecognized in self.unrecognized:
-                    try:
-                        list += "\t\t\tNierozpoznany:\n"
-                        list += str(unrecognized)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            return list
+            return "\t\t\tVersion: " + str(self.version) + "\n" + MetadataContents.__repr__(self)
 
-        def write(self, file):
-            try:
-                if 'TPE1' in tab:
-                    self.TPE1.size -= 2
-                    self.TPE1.size = int.from_bytes(self.TPE1.size.to_bytes(4, byteorder="big", signed=True), byteorder="little")
-                    self.TPE1.write(file)
-            except Exception:
-                pass
-            try:
-                if 'TIT2' in tab:
-                    self.TIT2.size -= 2
-                    self.TIT2.size = int.from_bytes(self.TIT2.size.to_bytes(4, byteorder="big", signed=True), byteorder="little")
-                    self.TIT2.write(file)
-            except:
-                pass
-            try:
-                if 'COMM' in tab:
-                    self.COMM.size -= 2
-                    self.COMM.size = int.from_bytes(self.COMM.size.to_bytes(4, byteorder="big", signed=True), byteorder="little")
-                    self.COMM.write(file)
-            except:
-                pass
-            try:
-                if 'TALB' in tab:
-                    self.TALB.size -= 2
-                    self.TALB.size = int.from_bytes(self.TALB.size.to_bytes(4, byteorder="big", signed=True), byteorder="little")
-                    self.TALB.write(file)
-            except:
-                pass
-            try:
-                if 'TDRC' in tab:
-                    self.TDRC.size -= 2
-                    self.TDRC.size = int.from_bytes(self.TDRC.size.to_bytes(4, byteorder="big", signed=True), byteorder="little")
-                    self.TDRC.write(file)
-            except:
-                pass
-            try:
-                if 'TRCK' in tab:
-                    self.TRCK.size -= 2
-                    self.TRCK.size = int.from_bytes(self.TRCK.size.to_bytes(4, byteorder="big", signed=True), byteorder="little")
-                    self.TRCK.write(file)
-            except:
-                pass
-            try:
-                if 'TCON' in tab:
-                    self.TCON.size -= 2
-                    self.TCON.size = int.from_bytes(self.TCON.size.to_bytes(4, byteorder="big", signed=True), byteorder="little")
-                    self.TCON.write(file)
-            except:
-                pass
-            try:
-                if 'TXXX' in tab:
-                    self.TXXX.size -= 2
-                    self.TXXX.size = int.from_bytes(self.TXXX.size.to_bytes(4, byteorder="big", signed=True), byteorder="little")
-                    self.TXXX.write(file)
-            except:
-                pass
+        def write(self, writer: ChunkWriter):
+            for field in ID3Chunk.Contents.fields:
+                frame = getattr(self, field)
+                if frame is not None and writer.is_selected(field):
+                    frame.write_id3_frame(writer)
 
     data: Contents
 
-    def __init__(self, id: str, size: int, data: list, version: int):
-        global index
+    frame_types = dict.fromkeys(Contents.fields, INFOsubChunk)
+    header_struct = struct.Struct(">3sBBB")
+    size_struct = struct.Struct(">I")
+    frame_header_struct = struct.Struct(">4sI")
+
+    def __init__(self, id: str, size: int, data: bytes, version: int, session: "WavSession" = None):
         Chunk.__init__(self=self, id=id, size=size, data=None)
-        self.data = ID3Chunk.Contents()
-        self.data.version = version
+        self.data = ID3Chunk.Contents(version)
+        view = memoryview(data)
         start = 0
-        while start < len(data) - 1:
-            subid = bytes.decode(data[start:start + 4])
-            if len(subid):
-                sizesubid = int.from_bytes(data[start + 4:start + 8], byteorder="big") + 2
-            if subid in self.Contents.__annotations__:
-                exec(
-                    "%s=%s" % ('self.data.' + subid, "INFOsubChunk(subid, sizesubid, data[start+8:start+sizesubid+8])"))
-                Optional.update({index: subid})
-                index += 1
+        while start + 10 <= len(view):
+            subid, sizesubid = ID3Chunk.frame_header_struct.unpack_from(view, start)
+            if subid == b"\x00\x00\x00\x00":
+                break               # dopełnienie zerami na końcu znacznika
+            subid = decode_text(subid)
+            sizesubid += 2          # rozmiar ramki nie obejmuje 2 bajtów flag
+            payload = view[start + 8:start + 8 + sizesubid]
+            frame_type = ID3Chunk.frame_types.get(subid)
+            if frame_type is not None:
+                setattr(self.data, subid, frame_type(subid, sizesubid, payload))
+                if session is not None:
+                    session.register_optional(subid)
             else:
-                self.data.unrecognized.append(INFOsubChunk(subid, sizesubid, data[start + 8:start + sizesubid + 8]))
-            start = start + sizesubid + 8
+                self.data.unrecognized.append(INFOsubChunk(subid, sizesubid, payload))
+            start = start + 8 + sizesubid
 
-        if len(data) > 4 + start:
-            self.data.unrecognized.append(INFOsubChunk(bytes.decode(data[start:start + 4]), len(data[start + 4:]), data[start + 4:]))
+        if len(view) > 4 + start and view[start:].tobytes().strip(b"\x00"):
+            self.data.unrecognized.append(INFOsubChunk(decode_text(view[start:start + 4]), len(view) - start - 4,
+                                                       view[start + 4:]))
 
     def __repr__(self):
         return Chunk.__repr__(self) + "\n" + str(self.data)
@@ -1029,72 +1168,57 @@ class ID3Chunk(Chunk):
         return f"\t\t" + Chunk.__str__(self) + "\n" + str(self.data)
     pass
 
-    def write(self, file):
-        self.size = 0
-        if "ID3" in tab:
-            for field in tab:
-                if tab.index(field) < tab.index("ID3") and field in self.Contents.__annotations__:
-                    exec("self.size += self.data.%s.size + 8" % field)
+    @staticmethod
+    def syncsafe(size: int) -> int:
+        # rozmiar znacznika ID3v2 zapisywany jest na 4 bajtach po 7 bitów
+        return (size & 0x7f) | (size & 0x3f80) << 1 | (size & 0x1fc000) << 2 | (size & 0xfe00000) << 3
 
-        file.write(self.id.encode(encoding='utf-8'))
-        file.write(self.data.version.to_bytes(1, byteorder="little", signed=True))
-        file.write(self.size.to_bytes(6, byteorder='big', signed=True))
-        self.data.write(file)
+    @staticmethod
+    def from_syncsafe(value: int) -> int:
+        return (value & 0x7f) | (value & 0x7f00) >> 1 | (value & 0x7f0000) >> 2 | (value & 0x7f000000) >> 3
 
+    def write(self, writer: ChunkWriter):
+        writer.pack(ID3Chunk.header_struct, self.id.encode(encoding='utf-8'), self.data.version, 0, 0)
+        size_offset = writer.reserve(ID3Chunk.size_struct)
+        self.data.write(writer)
+        self.size = writer.tell() - size_offset - 4
+        writer.patch(size_offset, ID3Chunk.size_struct, ID3Chunk.syncsafe(self.size))
 
-class id3Chunk(Chunk):
-    class Contents:
-        ID3: ID3Chunk               # informacje o utworze
-        unrecognized = []           # nierozpoznany
 
-        def __repr__(self):
-            list = ""
-            try:
-                list += str(self.ID3)
-            except AttributeError:
-                pass
-            try:
-                for unrecognized in self.unrecognized:
-                    try:
-                        list += "\t\tNierozpoznany:\n"
-                        list += str(unrecognized)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            return list
+class id3Chunk(Chunk):
+    __slots__ = ()
 
-        pass
+    class Contents(MetadataContents):
+        fields = ("ID3",)               # informacje o utworze
+        __slots__ = fields
+        unrecognized_indent = "\t\t"
 
-        def write(self, file):
-            try:
-                if 'ID3' in tab:
-                    self.ID3.write(file)
-            except Exception:
-                pass
+        def write(self, writer: ChunkWriter):
+            if writer.is_selected('ID3') and self.ID3 is not None:
+                self.ID3.write(writer)
 
     data: Contents
 
-    def __init__(self, id: str, size: int, data: [bytes, int]):
-        global index
+    tag_header_struct = struct.Struct(">3sBBBI")
+
+    def __init__(self, id: str, size: int, data: bytes, session: "WavSession" = None):
         Chunk.__init__(self=self, id=id, size=size, data=None)
         self.data = id3Chunk.Contents()
+        view = memoryview(data)
         start = 0
-        while start < data.index(data[-1]):
-            subid = bytes.decode(data[start:start + 3])
-            if len(subid):
-                version = data[start+3]
-                subsize = int.from_bytes(data[start + 4:start + 10], byteorder="big")
+        if len(view) >= 10:
+            subid, version, revision, flags, subsize = id3Chunk.tag_header_struct.unpack_from(view, 0)
+            subid = decode_text(subid)
+            subsize = ID3Chunk.from_syncsafe(subsize)
             if subid == "ID3":
-                self.data.ID3 = ID3Chunk(subid, subsize, data[start + 10:start + size], version)
-                Optional.update({index: self.data.ID3.id})
-                index += 1
-            else:
-                self.data.unrecognized.append(ID3Chunk(subid, subsize, data[start + 10:start + size], version))
-            start = start + size
+                self.data.ID3 = ID3Chunk(subid, subsize, view[10:10 + subsize], version, session)
+                if session is not None:
+                    session.register_optional(self.data.ID3.id)
+                start = 10 + subsize
 
-        if len(data) > 4 + start:
-            self.data.unrecognized.append(ID3Chunk(bytes.decode(data[start:start + 3]), len(data[start + 4:]), data[start + 4:], data[start+3]))
+        if len(view) > 4 + start and view[start:].tobytes().strip(b"\x00"):
+            self.data.unrecognized.append(Chunk(decode_text(view[start:start + 4]), len(view) - start - 4,
+                                                view[start + 4:].tobytes()))
 
     def __repr__(self):
         return Chunk.__repr__(self) + "\n" + str(self.data)
@@ -1103,13 +1227,439 @@ class id3Chunk(Chunk):
         return f"\t" + Chunk.__str__(self) + "\n" + str(self.data)
     pass
 
-    def write(self, file):
-        self.size = 0
-        if "ID3" in tab:
-            for field in tab:
-                if tab.index(field) < tab.index("ID3") and field in self.data.ID3.Contents.__annotations__:
-                    exec("self.size += self.data.ID3.data.%s.size + 8" % field)
-        self.size += 11
-        Chunk.write(self, file)
-        self.data.write(file)
+    def write(self, writer: ChunkWriter):
+        writer.begin_chunk(self.id)
+        self.data.write(writer)
+        self.size = writer.end_chunk()
+
+
+class WavSession:
+    # Stan wczytywania i zapisu jednego pliku - osobna instancja dla każdego pliku/wątku
+    optional_chunk_types = {"LIST": LISTChunk, "id3 ": id3Chunk}
+
+    def __init__(self):
+        self.optional = {}              # indeks -> identyfikator chunka/pola, które można wybrać do zapisu
+        self.index = 1
+        self.tab = []                   # identyfikatory wybrane do zapisu
+        self.unrecognized = []          # nierozpoznane chunki
+        self.unrecognized_offsets = []  # pozycje zawartości nierozpoznanych chunków w pliku źródłowym
+        self.source_name = None         # ścieżka wczytanego pliku (kopiowanie niezmienionych chunków)
+        self.unmodified = set()         # chunki, których zawartość w pliku źródłowym jest aktualna
+        self.chunk_offsets = {}         # identyfikator -> (pozycja zawartości w pliku, rozmiar)
+        self.riff = None
+        self.fmt = None
+        self.data = None
+        self.raw_data = None
+        self.list = None
+        self.id3 = None
+        self.fact = None
+        self.cue = None
+        self.encryption = None          # parametry szyfrowania zapisane w pliku (EncryptionChunk)
+        self.ds64 = None                # 64-bitowe rozmiary plików RF64/BW64
+
+    @staticmethod
+    def open(path: str, decode_samples: bool = True, load_data: bool = True) -> "WavSession":
+        session = WavSession()
+        with open(path, "rb") as file:
+            session.read(file, decode_samples, load_data)
+        return session
+
+    def register_optional(self, id: str) -> None:
+        self.optional.update({self.index: id})
+        self.index += 1
+
+    def select(self, id: str) -> None:
+        if id is not None and id not in self.tab:
+            self.tab.append(id)
+
+    def read(self, file, decode_samples: bool = True, load_data: bool = True) -> None:
+        # load_data=False - zawartość chunka danych zostaje w pliku (pozycja w chunk_offsets["data"])
+        if isinstance(getattr(file, "name", None), str):
+            self.source_name = file.name
+        while 1:
+            header = file.read(8)
+            if len(header) < 8:
+                break
+            id, size = Chunk.header_struct.unpack(header)
+            id = decode_text(id)
+            if size == ChunkWriter.max_size and self.ds64 is not None:
+                size = self.ds64.data.size_of(id, size)
+            self.chunk_offsets[id] = (file.tell(), size)
+            if id == "RIFF" or id in RIFFHeader.rf64_ids:
+                self.riff = RIFFHeader(id, size, [decode_text(file.read(4))])
+                continue
+            elif id == "data" and not load_data:
+                self.unmodified.add(id)
+                file.seek(size, 1)
+            elif id == "data":
+                self.unmodified.add(id)
+                self.raw_data = file.read(size)
+                if decode_samples:
+                    self.decode_data(self.raw_data)
+            else:
+                self.read_chunk(id, size, file.read(size), self.chunk_offsets[id][0])
+            if size % 2:
+                file.read(1)
+
+    def read_chunk(self, id: str, size: int, content: bytes, offset: int) -> None:
+        # chunk inny niż RIFF i dane; offset - pozycja zawartości w pliku źródłowym
+        if id == "ds64":
+            self.ds64 = DS64Chunk(id, size, content)
+            self.riff.size = self.ds64.data.riff_size
+            self.chunk_offsets[self.riff.id] = (self.chunk_offsets[self.riff.id][0], self.riff.size)
+        elif id == "fmt ":
+            fields = list(FmtChunk.Contents.fmt_struct.unpack_from(content))
+            if size > 16:
+                fields.append(int.from_bytes(content[16:18], byteorder="little"))
+                fields.append(int.from_bytes(content[18:18 + fields[6]], byteorder="little"))
+            self.fmt = FmtChunk(id, size, fields)
+        elif id in WavSession.optional_chunk_types:
+            chunk = WavSession.optional_chunk_types[id](id, size, content, self)
+            if id == "LIST":
+                self.list = chunk
+            else:
+                self.id3 = chunk
+            self.register_optional(chunk.id)
+        elif id == "fact":
+            self.fact = factChunk(id, size, [content])
+            self.register_optional(self.fact.id)
+        elif id == "cue ":
+            self.cue = CueChunk(id, size, [content])
+            self.register_optional(self.cue.id)
+        elif id == EncryptionChunk.chunk_id:
+            self.encryption = EncryptionChunk(id, size, content)
+        else:
+            self.unrecognized_offsets.append(offset)
+            self.unrecognized.append(Chunk(id, size, content))
+
+    def decode_data(self, raw_data: bytes) -> None:
+        if raw_data is not self.raw_data:
+            self.unmodified.discard("data")
+        with span("bytes_to_channels", len(raw_data)):
+            channels = DataChunk.Contents.bytes_to_channels(self.fmt, raw_data, len(raw_data))
+        self.raw_data = raw_data
+        self.data = DataChunk("data", len(raw_data), channels)
+
+    def write(self, file, encrypted_samples: bytes = None, data_writer=None, pass_through: bool = False) -> None:
+        # data_writer - funkcja zapisująca cały chunk danych zamiast self.data (np. EncryptionPipeline)
+        # pass_through - niezmienione chunki (dane, metadane bez usuniętych pól, nierozpoznane) kopiowane bajt po bajcie
+        # z pliku źródłowego w kolejności, w jakiej w nim występują; plik źródłowy musi być innym plikiem
+        # niż docelowy (zapis do pliku źródłowego - WavSession.save)
+        if encrypted_samples is not None:
+            data_size = len(encrypted_samples)
+        elif self.raw_data is not None:
+            data_size = len(self.raw_data)
+        else:
+            data_size = self.chunk_offsets.get("data", (0, 0))[1]
+        copy_data = pass_through and encrypted_samples is None and data_writer is None and "data" in self.unmodified
+        # miejsce na ds64 (plik zapisywany jako RF64, jeśli chunk danych przekroczy 4 GiB) - przy kopiowaniu
+        # niezmienionych danych tylko wtedy, gdy jest potrzebne od razu albo było w pliku źródłowym, więc plik
+        # bez zmian zostaje identyczny ze źródłowym; JUNK bezpośrednio za "WAVE" w pliku źródłowym jest wtedy
+        # zastępowany rezerwacją writera
+        leading_junk = [index for index, (chunk, offset) in enumerate(zip(self.unrecognized, self.unrecognized_offsets))
+                        if chunk.id == "JUNK" and offset == 20]
+        reserve_ds64 = not copy_data or bool(leading_junk) or self.ds64 is not None or \
+            data_size > ChunkWriter.rf64_threshold
+        writer = ChunkWriter(file, self.tab, reserve_ds64=reserve_ds64)
+        source = None
+        if pass_through and self.source_name is not None:
+            source = open(self.source_name, "rb")
+
+        def write_chunk(chunk, *args):
+            with span("write " + chunk.id) as record:
+                start = writer.tell()
+                chunk.write(writer, *args)
+                record.bytes = writer.tell() - start
+
+        def copy_chunk(id, offset, size):
+            with span("copy " + id, size):
+                writer.begin_chunk(id, size)
+                writer.copy_from(source, offset, size)
+                writer.end_chunk()
+
+        def write_data():
+            if data_writer is not None:
+                with span("write data") as record:
+                    start = writer.tell()
+                    data_writer(writer)
+                    record.bytes = writer.tell() - start
+            elif copy_data:
+                if source is not None:
+                    copy_chunk("data", *self.chunk_offsets["data"])
+                else:
+                    write_chunk(Chunk("data", len(self.raw_data), self.raw_data))
+            else:
+                write_chunk(self.data, self.fmt, encrypted_samples)
+
+        def write_metadata(chunk):
+            if source is not None and chunk.id in self.chunk_offsets and self.is_complete(chunk):
+                copy_chunk(chunk.id, *self.chunk_offsets[chunk.id])
+            else:
+                write_chunk(chunk)
+
+        # (pozycja w pliku źródłowym, funkcja zapisu) w kolejności zapisu bez pliku źródłowego
+        parts = [(self.chunk_offsets.get("fmt "), lambda: write_chunk(self.fmt))]
+        if self.encryption is not None:
+            parts.append((self.chunk_offsets.get(EncryptionChunk.chunk_id), lambda: write_chunk(self.encryption)))
+        parts.append((self.chunk_offsets.get("data"), write_data))
+        for chunk in (self.list, self.id3, self.fact, self.cue):
+            if chunk is not None and chunk.id in self.tab:
+                parts.append((self.chunk_offsets.get(chunk.id), lambda chunk=chunk: write_metadata(chunk)))
+        if pass_through:
+            for index, (chunk, offset) in enumerate(zip(self.unrecognized, self.unrecognized_offsets)):
+                if index in leading_junk:
+                    continue
+                if source is not None:
+                    parts.append(((offset, chunk.size), lambda chunk=chunk, offset=offset:
+                                  copy_chunk(chunk.id, offset, chunk.size)))
+                else:
+                    parts.append(((offset, chunk.size), lambda chunk=chunk: write_chunk(chunk)))
+        if source is not None:
+            # kolejność chunków z pliku źródłowego; chunki, których w nim nie było, zostają za poprzedzającymi je
+            position = 0
+            ordered = []
+            for offset, write_part in parts:
+                position = position if offset is None else offset[0]
+                ordered.append((position, write_part))
+            ordered.sort(key=lambda part: part[0])
+            parts = ordered
 
+        try:
+            write_chunk(self.riff)
+            for _, write_part in parts:
+                write_part()
+            writer.close()
+        finally:
+            if source is not None:
+                source.close()
+
+    def is_complete(self, chunk) -> bool:
+        # czy zapis chunka z wybranymi polami (self.tab) nie pomija żadnego pola - wtedy można go skopiować ze źródła
+        selected, complete = io.BytesIO(), io.BytesIO()
+        for buffer, tab in ((selected, self.tab), (complete, None)):
+            writer = ChunkWriter(buffer, tab)
+            chunk.write(writer)
+            writer.close()
+        return selected.getvalue() == complete.getvalue()
+
+    def save(self, path: str, encrypted_samples: bytes = None, data_writer=None, pass_through: bool = False) -> None:
+        # zapis do pliku o podanej ścieżce; jeśli jest to plik źródłowy, z którego kopiowane są niezmienione chunki,
+        # wynik trafia najpierw do pliku tymczasowego w tym samym katalogu i zastępuje źródło dopiero po zapisie
+        if self.source_name is None or not os.path.exists(path) or not os.path.samefile(path, self.source_name):
+            with open(path, "wb") as file:
+                self.write(file, encrypted_samples, data_writer, pass_through)
+            return
+        descriptor, temporary_name = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                                      dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                self.write(file, encrypted_samples, data_writer, pass_through)
+            shutil.copymode(path, temporary_name)
+        except BaseException:
+            os.remove(temporary_name)
+            raise
+        os.replace(temporary_name, path)
+
+
+class WavAppender:
+    # Dopisywanie ramek na koniec chunka danych istniejącego pliku, z kosztem zależnym od liczby nowych ramek
+    # i rozmiaru metadanych za danymi. Metadane za danymi nie są nadpisywane, dopóki w pliku nie ma ich kopii:
+    # jeśli nowe ramki się przed nimi nie mieszczą, kopia zapisywana jest na końcu pliku, a miejsce między danymi
+    # a kopią staje się chunkiem JUNK, który wypełniają kolejne dopisywane ramki. Rozmiary (data, RIFF, ds64,
+    # fact) poprawiane są dopiero po zapisaniu ramek, więc przerwany zapis zostawia poprawny plik z metadanymi
+    # (w najgorszym razie z kilkoma bajtami niezapisanych próbek). Wyjątek: dopisanie mniej niż 8 bajtów przed
+    # chunkiem JUNK - nowe ramki zajmują miejsce jego nagłówka, więc między poprawieniem rozmiarów a zapisaniem
+    # nagłówka w nowym miejscu (dwa kolejne zapisy) plik nie ma poprawnego chunka za danymi.
+    # Po przekroczeniu 4 GiB plik zamieniany jest na RF64 - ds64 zajmuje miejsce chunka JUNK zarezerwowanego
+    # za nagłówkiem, a w plikach bez rezerwacji zawartość za "WAVE" jest raz przesuwana, żeby zrobić na niego miejsce.
+    large_sizes_struct = struct.Struct("<QQQ")  # rozmiar RIFF, rozmiar danych, liczba próbek - początek ds64
+
+    def __init__(self, path: str, sync: bool = True):
+        """
+        :param path: plik WAV
+        :param sync: os.fsync między kolejnymi krokami dopisywania - bez tego kolejność zapisów na dysku
+                     nie jest gwarantowana po awarii systemu (po przerwaniu samego procesu plik nadal jest poprawny)
+        """
+        self.file = open(path, "r+b")
+        self.sync = sync
+        try:
+            self.session = WavSession()
+            self.session.read(self.file, decode_samples=False, load_data=False)
+            if "data" not in self.session.chunk_offsets or self.session.fmt is None:
+                print("Plik nie zawiera chunków fmt i data")
+                raise Exception
+            self.data_offset, self.data_size = self.session.chunk_offsets["data"]
+            self.ds64_offset = self.session.chunk_offsets["ds64"][0] if self.session.ds64 is not None else None
+            # chunk fact przed danymi; fact za danymi znajduje _read_layout
+            self.fact_offset = None
+            if self.session.fact is not None and self.session.chunk_offsets["fact"][0] < self.data_offset:
+                self.fact_offset = self.session.chunk_offsets["fact"][0]
+            self._read_layout()
+        except Exception:
+            self.file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def frames(self) -> int:
+        return self.data_size // self.session.fmt.data.block_align
+
+    @property
+    def gap_start(self) -> int:
+        # początek pierwszego chunka za danymi
+        return self.data_offset + self.data_size + self.data_size % 2
+
+    def _read_layout(self) -> None:
+        # chunki za danymi: metadata - ich zawartość bez chunków JUNK/PAD (zapisywana przy przenoszeniu),
+        # metadata_offset - początek pierwszego z nich w pliku (wcześniej tylko JUNK/PAD), file_end - koniec pliku
+        start = self.gap_start
+        self.file.seek(start)
+        raw = self.file.read()
+        self.file_end = start + len(raw)
+        self.metadata_offset = self.file_end
+        self.trailing_fact_offset = None
+        metadata = []
+        offset = 0
+        while offset + Chunk.header_struct.size <= len(raw):
+            id, size = Chunk.header_struct.unpack_from(raw, offset)
+            id = decode_text(id)
+            end = min(offset + Chunk.header_struct.size + size + size % 2, len(raw))
+            if id not in padding_chunk_ids:
+                if not metadata:
+                    self.metadata_offset = start + offset
+                if id == "fact" and size >= factChunk.Contents.data_struct.size:
+                    self.trailing_fact_offset = start + offset + Chunk.header_struct.size
+                metadata.append(raw[offset:end])
+            offset = end
+        self.metadata = b"".join(metadata)
+
+    def _flush(self) -> None:
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def _write_at(self, offset: int, data: bytes) -> None:
+        if data:
+            self.file.seek(offset)
+            self.file.write(data)
+
+    def _patch_sizes(self, riff_size: int) -> None:
+        data_size = self.data_size
+        sample_count = min(self.frames, ChunkWriter.max_size)
+        if self.ds64_offset is not None:
+            self._write_at(self.ds64_offset, WavAppender.large_sizes_struct.pack(riff_size, data_size, self.frames))
+            data_size = riff_size = ChunkWriter.max_size
+        self._write_at(self.data_offset - 4, ChunkWriter.size_struct.pack(data_size))
+        self._write_at(4, ChunkWriter.size_struct.pack(riff_size))
+        for offset in (self.fact_offset, self.trailing_fact_offset):
+            if offset is not None:
+                self._write_at(offset, factChunk.Contents.data_struct.pack(sample_count))
+
+    def insert_space(self, offset: int, length: int, block_size: int = 1 << 20) -> None:
+        # przesunięcie zawartości pliku od offset o length bajtów w stronę końca, blokami od końca pliku
+        end = self.file.seek(0, os.SEEK_END)
+        position = end
+        while position > offset:
+            start = max(offset, position - block_size)
+            self.file.seek(start)
+            block = self.file.read(position - start)
+            self.file.seek(start + length)
+            self.file.write(block)
+            position = start
+        self.file.seek(offset)
+        self.file.write(bytes(length))
+        self.data_offset += length
+        if self.fact_offset is not None:
+            self.fact_offset += length
+        self._read_layout()
+
+    def convert_to_rf64(self) -> None:
+        # zarezerwowany chunk JUNK bezpośrednio za "WAVE" staje się chunkiem ds64; jeśli go nie ma,
+        # miejsce na ds64 robione jest przez przesunięcie reszty pliku (jednorazowo, koszt zależny od rozmiaru pliku)
+        self.file.seek(12)
+        id, size = Chunk.header_struct.unpack(self.file.read(8))
+        if id != b"JUNK" or size < DS64Chunk.sizes_struct.size:
+            size = DS64Chunk.sizes_struct.size
+            self.insert_space(12, Chunk.header_struct.size + size)
+        self._write_at(12, Chunk.header_struct.pack(b"ds64", size) +
+                       DS64Chunk.sizes_struct.pack(self.file_end - 8, self.data_size, self.frames, 0))
+        self._flush()
+        self._write_at(0, ChunkWriter.id_struct.pack(b"RF64"))
+        self.ds64_offset = 20
+        self._patch_sizes(self.file_end - 8)
+        self._flush()
+
+    def append(self, frames: bytes) -> None:
+        # frames - zakodowane ramki (wielokrotność block_align bajtów)
+        if len(frames) % self.session.fmt.data.block_align:
+            print("Dopisywane dane nie są całkowitą liczbą ramek")
+            raise Exception
+        if not frames:
+            return
+        gap_start = self.gap_start
+        data_end = self.data_offset + self.data_size
+        new_size = self.data_size + len(frames)
+        new_gap_start = self.data_offset + new_size + new_size % 2
+        header_size = Chunk.header_struct.size
+
+        if not self.metadata:
+            target = None                       # za danymi nic do zachowania
+            file_end = new_gap_start
+        elif new_gap_start == self.metadata_offset or new_gap_start + header_size <= self.metadata_offset:
+            target = self.metadata_offset       # ramki mieszczą się przed metadanymi
+            file_end = self.file_end
+        else:
+            # kopia metadanych za końcem pliku (nie nachodzi na obecne metadane), między danymi a kopią - JUNK
+            # odstępy od końca pliku i od końca nowych danych: zero albo co najmniej nagłówek chunka JUNK
+            target = max(self.file_end, new_gap_start)
+            for start in (self.file_end, new_gap_start, self.file_end):
+                if 0 < target - start < header_size:
+                    target = start + header_size
+            file_end = target + len(self.metadata)
+        if file_end - 8 > ChunkWriter.max_size and self.ds64_offset is None:
+            self.convert_to_rf64()
+            self.append(frames)
+            return
+
+        if target is not None and target != self.metadata_offset:
+            if target > self.file_end:
+                # JUNK zamiast nieopisanej dziury między końcem pliku a kopią
+                self._write_at(self.file_end, Chunk.header_struct.pack(b"JUNK", target - self.file_end - header_size))
+            self._write_at(target, self.metadata)
+            self._flush()
+            # JUNK od końca danych do kopii - plik z dotychczasowym rozmiarem danych ma metadane w nowym miejscu
+            self._write_at(gap_start, Chunk.header_struct.pack(b"JUNK", target - gap_start - header_size))
+            self._patch_sizes(file_end - 8)
+            self._flush()
+            self._read_layout()
+
+        # obraz obszaru od końca danych: ramki, bajt wyrównania, nagłówek JUNK przed metadanymi
+        image = frames + bytes(new_size % 2)
+        if target is not None and target > new_gap_start:
+            image += Chunk.header_struct.pack(b"JUNK", target - new_gap_start - header_size)
+        # nagłówek chunka za dotychczasowymi danymi zapisywany jest na końcu - do poprawienia rozmiarów
+        # plik jest czytelny z dotychczasowym rozmiarem danych
+        protected = 0
+        if self.file_end > gap_start:
+            protected = min(len(image), max(0, gap_start + header_size - data_end))
+        self._write_at(data_end + protected, image[protected:])
+        self._flush()
+        self.data_size = new_size
+        self._patch_sizes(file_end - 8)
+        self._flush()
+        self._write_at(data_end, image[:protected])
+        if target is None:
+            self.file.truncate(file_end)
+        self._flush()
+        self._read_layout()
+
+    def append_samples(self, contents: DataChunk.Contents) -> None:
+        self.append(DataChunk.Contents.channels_to_bytes(self.session.fmt, contents))
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,128 @@
+from collections import deque
+
+from utils.wav_chunks import ChunkWriter, FmtChunk, WavSession, factChunk
+
+# Cięcie i łączenie plików z dokładnością do ramki (block_align bajtów) bez dekodowania próbek -
+# zawartość chunka danych kopiowana jest bezpośrednio między plikami.
+
+fmt_fields = ("audio_format", "num_channels", "sample_rate", "byte_rate", "block_align", "bits_per_sample")
+
+
+def formats_compatible(first: FmtChunk, second: FmtChunk) -> bool:
+    for field in fmt_fields:
+        if getattr(first.data, field) != getattr(second.data, field):
+            return False
+    return getattr(first.data, "extra_format_bytes", None) == getattr(second.data, "extra_format_bytes", None)
+
+
+def _fact_chunk(session: WavSession, frames: int) -> factChunk:
+    # liczba ramek pliku wynikowego - chunk fact jest wymagany dla formatów innych niż PCM
+    if session.fact is None and session.fmt.data.audio_format == 1:
+        return None
+    return factChunk("fact", factChunk.Contents.data_struct.size,
+                     [factChunk.Contents.data_struct.pack(min(frames, ChunkWriter.max_size))])
+
+
+def _begin_file(writer: ChunkWriter, session: WavSession, data_size: int) -> None:
+    session.riff.write(writer)
+    session.fmt.write(writer)
+    fact = _fact_chunk(session, data_size // session.fmt.data.block_align)
+    if fact is not None:
+        fact.write(writer)
+    writer.begin_chunk("data", data_size)
+
+
+def _end_file(writer: ChunkWriter, session: WavSession, copy_metadata: bool) -> None:
+    writer.end_chunk()
+    if copy_metadata:
+        for chunk in (session.list, session.id3):
+            if chunk is not None:
+                chunk.write(writer)
+    writer.close()
+
+
+def split(source_path: str, segments: list, copy_metadata: bool = False, block_size: int = 1 << 20) -> list:
+    """
+    :param source_path: plik źródłowy
+    :param segments: lista (pierwsza ramka, ramka za ostatnią, ścieżka pliku wynikowego); zakresy mogą się pokrywać
+    :param copy_metadata: czy kopiować chunki LIST i id3 do każdego fragmentu
+    :param block_size: rozmiar bloku odczytu
+    :return: ścieżki zapisanych plików
+    """
+    session = WavSession.open(source_path, decode_samples=False, load_data=False)
+    block_align = session.fmt.data.block_align
+    data_offset, data_size = session.chunk_offsets["data"]
+    frames = data_size // block_align if block_align > 0 else 0
+    ranges = []
+    for start, end, path in segments:
+        if not 0 <= start < end <= frames:
+            print(f"Nieprawidłowy zakres ramek {start}-{end} (plik ma {frames} ramek)")
+            raise Exception
+        ranges.append((data_offset + start * block_align, data_offset + end * block_align, path))
+    ranges.sort(key=lambda entry: entry[0])
+
+    # jeden przebieg po pliku źródłowym: granice bloków wypadają na początkach i końcach fragmentów,
+    # więc każdy otwarty fragment obejmuje cały bieżący blok
+    pending = deque(ranges)
+    active = []                                 # (koniec, plik, writer)
+    position = ranges[0][0] if ranges else 0
+    stop = max((end for _, end, _ in ranges), default=0)
+    with open(source_path, "rb") as source:
+        try:
+            source.seek(position)
+            while position < stop:
+                if not active and pending[0][0] > position:
+                    position = pending[0][0]
+                    source.seek(position)
+                while pending and pending[0][0] == position:
+                    start, end, path = pending.popleft()
+                    file = open(path, "wb")
+                    writer = ChunkWriter(file)
+                    _begin_file(writer, session, end - start)
+                    active.append((end, file, writer))
+                limits = [position + block_size] + [end for end, _, _ in active]
+                if pending:
+                    limits.append(pending[0][0])
+                block_end = min(limits)
+                block = source.read(block_end - position)
+                if len(block) < block_end - position:
+                    print("Plik źródłowy jest krótszy niż zapisany w nim rozmiar chunka danych")
+                    raise Exception
+                for _, _, writer in active:
+                    writer.write(block)
+                position = block_end
+                for entry in [entry for entry in active if entry[0] == position]:
+                    _end_file(entry[2], session, copy_metadata)
+                    entry[1].close()
+                    active.remove(entry)
+        finally:
+            for _, file, _ in active:
+                file.close()
+    return [path for _, _, path in segments]
+
+
+def concatenate(source_paths: list, destination_path: str, copy_metadata: bool = False) -> int:
+    """
+    :param source_paths: pliki do połączenia (w tym samym formacie), różne od pliku wynikowego
+    :param destination_path: plik wynikowy
+    :param copy_metadata: czy skopiować chunki LIST i id3 pierwszego pliku
+    :return: liczba ramek w pliku wynikowym
+    """
+    sessions = [WavSession.open(path, decode_samples=False, load_data=False) for path in source_paths]
+    first = sessions[0]
+    block_align = first.fmt.data.block_align
+    for path, session in zip(source_paths[1:], sessions[1:]):
+        if not formats_compatible(first.fmt, session.fmt):
+            print(f"Format pliku {path} różni się od formatu pliku {source_paths[0]}")
+            raise Exception
+    # niepełna ostatnia ramka pliku nie jest kopiowana
+    sizes = [session.chunk_offsets["data"][1] // block_align * block_align for session in sessions]
+
+    with open(destination_path, "wb") as file:
+        writer = ChunkWriter(file)
+        _begin_file(writer, first, sum(sizes))
+        for path, session, size in zip(source_paths, sessions, sizes):
+            with open(path, "rb") as source:
+                writer.copy_from(source, session.chunk_offsets["data"][0], size)
+        _end_file(writer, first, copy_metadata)
+    return sum(sizes) // block_align
@@ -0,0 +1,237 @@
+import argparse
+import io
+import sys
+
+import numpy as np
+
+from utils.display_functions import normalize_samples
+from utils.wav_chunks import Chunk, ChunkWriter, DataChunk, FmtChunk, RIFFHeader, WavSession, decode_text, factChunk
+
+# Odczyt i zapis strumieniowy (potoki, gniazda, stdin/stdout) - bez seek i tell, chunki w kolejności z pliku.
+# Producenci strumieni nie znają z góry długości nagrania i wpisują w pola rozmiaru RIFF i "data"
+# 0xFFFFFFFF albo 0 - taki chunk danych trwa do końca strumienia.
+
+unknown_size = ChunkWriter.max_size
+
+
+class WavStreamReader:
+    def __init__(self, stream, block_frames: int = 4096):
+        """
+        :param stream: obiekt z metodą read(n) (np. sys.stdin.buffer, socket.makefile("rb"))
+        :param block_frames: największa liczba ramek w jednym bloku
+        """
+        self.stream = stream
+        self.block_frames = block_frames
+        self.session = WavSession()     # metadane - chunki za danymi są dostępne po odczytaniu wszystkich bloków
+        self.position = 0               # liczba bajtów odczytanych ze strumienia
+        self.frames = 0                 # liczba ramek oddanych przez blocks/raw_blocks
+        self.data_size = None           # None - do końca strumienia
+        self._data_started = False
+        self._read_header()
+
+    @property
+    def fmt(self) -> FmtChunk:
+        return self.session.fmt
+
+    def _read(self, size: int) -> bytes:
+        data = self.stream.read(size)
+        # read na surowym potoku/gnieździe może zwrócić mniej bajtów, niż jest dostępnych do końca strumienia
+        while data is not None and len(data) < size:
+            more = self.stream.read(size - len(data))
+            if not more:
+                break
+            data += more
+        data = data or b""
+        self.position += len(data)
+        return data
+
+    def _read_exactly(self, size: int) -> bytes:
+        data = self._read(size)
+        if len(data) < size:
+            print("Strumień zakończył się w środku chunka")
+            raise Exception
+        return data
+
+    def _read_header(self) -> None:
+        id, size = Chunk.header_struct.unpack(self._read_exactly(8))
+        id = decode_text(id)
+        if id != "RIFF" and id not in RIFFHeader.rf64_ids:
+            print("Strumień nie zaczyna się nagłówkiem RIFF")
+            raise Exception
+        self.session.riff = RIFFHeader(id, size, [decode_text(self._read_exactly(4))])
+        self.session.chunk_offsets[id] = (8, size)
+        # chunki przed danymi
+        while True:
+            header = self._read(8)
+            if len(header) < 8:
+                print("Strumień nie zawiera chunka danych")
+                raise Exception
+            id, size = Chunk.header_struct.unpack(header)
+            id = decode_text(id)
+            if id == "data":
+                self._begin_data(size)
+                return
+            self._read_chunk(id, size)
+
+    def _read_chunk(self, id: str, size: int) -> None:
+        if size == ChunkWriter.max_size and self.session.ds64 is not None:
+            size = self.session.ds64.data.size_of(id, size)
+        self.session.chunk_offsets[id] = (self.position, size)
+        self.session.read_chunk(id, size, self._read_exactly(size), self.position - size)
+        if size % 2:
+            self._read(1)
+
+    def _begin_data(self, size: int) -> None:
+        if self.fmt is None:
+            print("Chunk danych przed chunkiem fmt")
+            raise Exception
+        ds64 = self.session.ds64
+        if size == ChunkWriter.max_size and ds64 is not None:
+            size = ds64.data.size_of("data", size)
+        # 0 i 0xFFFFFFFF (także w ds64) - rozmiar nieznany, dane do końca strumienia
+        self.data_size = None if size in (0, ChunkWriter.max_size) else size
+        self.session.chunk_offsets["data"] = (self.position, self.data_size)
+
+    def raw_blocks(self):
+        """
+        :return: generator bajtów kolejnych pełnych ramek (najwyżej block_frames ramek naraz)
+        """
+        if self._data_started:
+            print("Dane strumienia można odczytać tylko raz")
+            raise Exception
+        self._data_started = True
+        block_align = self.fmt.data.block_align
+        block_size = self.block_frames * block_align
+        remaining = self.data_size
+        pending = b""                   # niepełna ramka z poprzedniego odczytu
+        # read1 oddaje to, co już jest dostępne - blok nie czeka na zapełnienie (opóźnienie ograniczone)
+        read = getattr(self.stream, "read1", self.stream.read)
+        while remaining is None or remaining > 0:
+            wanted = block_size - len(pending)
+            if remaining is not None:
+                wanted = min(wanted, remaining - len(pending))
+            data = read(wanted) if wanted > 0 else b""
+            if not data:
+                break
+            self.position += len(data)
+            data = pending + data
+            usable = len(data) - len(data) % block_align
+            pending = data[usable:]
+            if usable:
+                if remaining is not None:
+                    remaining -= usable
+                self.frames += usable // block_align
+                yield data[:usable]
+        if remaining is not None and remaining > len(pending):
+            print("Strumień zakończył się przed końcem chunka danych")
+            raise Exception
+        if remaining is not None:
+            # bajt wyrównania i chunki za danymi; niepełna ostatnia ramka (pending) jest pomijana
+            self._read(self.data_size % 2)
+            self._read_trailing_chunks()
+
+    def _read_trailing_chunks(self) -> None:
+        while True:
+            header = self._read(8)
+            if len(header) < 8:
+                return
+            id, size = Chunk.header_struct.unpack(header)
+            self._read_chunk(decode_text(id), size)
+
+    def blocks(self, normalize: bool = False):
+        """
+        :param normalize: czy zamieniać próbki na wartości znormalizowane (jak normalize_samples)
+        :return: generator (numer pierwszej ramki, tablica (kanał, ramka))
+        """
+        first = 0
+        for raw in self.raw_blocks():
+            channels = DataChunk.Contents.bytes_to_array(self.fmt, raw)
+            if normalize:
+                channels = normalize_samples(channels, self.fmt)
+            yield first, channels
+            first += channels.shape[1]
+
+
+class WavStreamWriter:
+    def __init__(self, stream, fmtChunk: FmtChunk, data_size: int = None, chunks: tuple = (), selected=None):
+        """
+        :param stream: obiekt z metodą write (np. sys.stdout.buffer)
+        :param fmtChunk: format zapisywanych ramek
+        :param data_size: rozmiar danych w bajtach, None - nieznany (w nagłówku 0xFFFFFFFF)
+        :param chunks: chunki metadanych zapisywane przed danymi (fact - zastępowany liczbą zapisywanych ramek)
+        :param selected: identyfikatory pól do zapisania (jak WavSession.tab), None - wszystkie
+        """
+        self.stream = stream
+        self.block_align = fmtChunk.data.block_align
+        self.data_size = data_size
+        self.written = 0
+        # nagłówek składany w pamięci - do strumienia trafia w całości, bez poprawiania rozmiarów
+        # bez rezerwacji miejsca na ds64 - zapis strumieniowy nie wraca do nagłówka
+        buffer = io.BytesIO()
+        writer = ChunkWriter(buffer, selected, reserve_ds64=False)
+        RIFFHeader("RIFF", 0, ["WAVE"]).write(writer)
+        fmtChunk.write(writer)
+        # liczba ramek - chunk fact jest wymagany dla formatów innych niż PCM; nieznany rozmiar - 0xFFFFFFFF
+        if fmtChunk.data.audio_format != 1 or any(isinstance(chunk, factChunk) for chunk in chunks):
+            frames = unknown_size if data_size is None else min(data_size // self.block_align, unknown_size)
+            factChunk("fact", factChunk.Contents.data_struct.size,
+                      [factChunk.Contents.data_struct.pack(frames)]).write(writer)
+        for chunk in chunks:
+            if chunk is not None and not isinstance(chunk, factChunk):
+                chunk.write(writer)
+        writer.begin_chunk("data", 0)
+        writer.flush()
+        header = bytearray(buffer.getvalue())
+        if data_size is None or len(header) - 8 + data_size + data_size % 2 > ChunkWriter.max_size:
+            riff_size, size = unknown_size, unknown_size
+        else:
+            riff_size, size = len(header) - 8 + data_size + data_size % 2, data_size
+        ChunkWriter.size_struct.pack_into(header, 4, riff_size)
+        ChunkWriter.size_struct.pack_into(header, len(header) - 4, size)
+        self.stream.write(header)
+
+    def write_frames(self, raw: bytes) -> None:
+        if len(raw) % self.block_align:
+            print("Zapisywane dane nie są wielokrotnością rozmiaru ramki")
+            raise Exception
+        if self.data_size is not None and self.written + len(raw) > self.data_size:
+            print("Zapisywane dane przekraczają zadeklarowany rozmiar")
+            raise Exception
+        self.stream.write(raw)
+        self.written += len(raw)
+
+    def write_array(self, channels: np.ndarray, dtype: str) -> None:
+        # tablica (kanał, ramka) z próbkami w postaci zapisu w pliku, np. dtype "<i2" dla PCM 16 bitów
+        self.write_frames(np.ascontiguousarray(np.asarray(channels).T, dtype=dtype).tobytes())
+
+    def close(self) -> None:
+        if self.data_size is not None:
+            if self.written != self.data_size:
+                print(f"Zapisano {self.written} z {self.data_size} zadeklarowanych bajtów danych")
+                raise Exception
+            if self.data_size % 2:
+                self.stream.write(b"\x00")
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+if __name__ == "__main__":
+    # przepisanie strumienia WAV ze stdin na stdout z nagłówkiem strumieniowym; informacje o formacie na stderr
+    parser = argparse.ArgumentParser(description="Strumieniowe przepisanie pliku WAV ze stdin na stdout")
+    parser.add_argument("--block-frames", type=int, default=4096)
+    parser.add_argument("--metadata", action="store_true", help="przepisanie chunków LIST i id3 sprzed danych")
+    arguments = parser.parse_args()
+
+    reader = WavStreamReader(sys.stdin.buffer, arguments.block_frames)
+    print(reader.fmt, file=sys.stderr)
+    metadata = (reader.session.list, reader.session.id3) if arguments.metadata else ()
+    with WavStreamWriter(sys.stdout.buffer, reader.fmt, reader.data_size, metadata) as stream_writer:
+        for block in reader.raw_blocks():
+            stream_writer.write_frames(block)
+    print(f"Ramki: {reader.frames}", file=sys.stderr)